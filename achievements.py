@@ -0,0 +1,150 @@
+"""
+Achievement registry for the gamification module
+
+Every achievement is declared once, with the counter of the gamification
+data it watches. Rules are indexed by counter and sorted by threshold, so an
+event only evaluates the rules of the counters it changed and stops at the
+first threshold that is not reached.
+"""
+
+from typing import Dict, List, Any, Callable, Iterable, Set
+
+# Functions reading each watched counter from the gamification data
+COUNTERS: Dict[str, Callable[[Dict[str, Any]], int]] = {
+    "streak": lambda data: data["streak"]["current"],
+    "completed_homework": lambda data: data["completed_homework"],
+    "completed_flashcards": lambda data: data["completed_flashcards"],
+    "perfect_sessions": lambda data: data["flashcard_stats"].get("perfect_sessions", 0),
+    "total_reviews": lambda data: data["flashcard_stats"].get("total_reviews", 0),
+    "study_streak": lambda data: data["flashcard_stats"].get("study_streak", 0),
+    "sets_studied": lambda data: len(data["flashcard_stats"].get("sets_studied", {})),
+    "viewed_grades": lambda data: data["viewed_grades"],
+    "checked_timetable": lambda data: data["checked_timetable"],
+    "sent_messages": lambda data: data["sent_messages"],
+    "study_plans_created": lambda data: len(data["study_plans"]),
+    "study_plans_completed": lambda data: len([p for p in data["study_plans"] if p.get("completed", False)]),
+}
+
+# Counters changed by a flashcard study session
+FLASHCARD_COUNTERS = ("completed_flashcards", "perfect_sessions", "total_reviews", "study_streak", "sets_studied")
+
+# Counters changed by study plans
+STUDY_PLAN_COUNTERS = ("study_plans_created", "study_plans_completed")
+
+# Every achievement (badge: also award the badge of the same id)
+ACHIEVEMENTS: List[Dict[str, Any]] = [
+    # Login streak
+    {"id": "streak_3", "name": "Série de 3 jours", "description": "Connexion pendant 3 jours consécutifs", "threshold": 3, "points": 20, "category": "streak", "counter": "streak"},
+    {"id": "streak_7", "name": "Guerrier Hebdomadaire", "description": "Connexion pendant 7 jours consécutifs", "threshold": 7, "points": 50, "category": "streak", "counter": "streak"},
+    {"id": "streak_14", "name": "Combattant de la Quinzaine", "description": "Connexion pendant 14 jours consécutifs", "threshold": 14, "points": 100, "category": "streak", "counter": "streak"},
+    {"id": "streak_30", "name": "Maître du Mois", "description": "Connexion pendant 30 jours consécutifs", "threshold": 30, "points": 200, "category": "streak", "counter": "streak", "badge": True},
+    {"id": "streak_60", "name": "Guerrier Saisonnier", "description": "Connexion pendant 60 jours consécutifs", "threshold": 60, "points": 300, "category": "streak", "counter": "streak", "badge": True},
+    {"id": "streak_100", "name": "Légende de l'Assiduité", "description": "Connexion pendant 100 jours consécutifs", "threshold": 100, "points": 500, "category": "streak", "counter": "streak", "badge": True},
+
+    # Homework
+    {"id": "hw_5", "name": "Débutant des Devoirs", "description": "Terminer 5 devoirs", "threshold": 5, "points": 25, "category": "homework", "counter": "completed_homework"},
+    {"id": "hw_20", "name": "Héros des Devoirs", "description": "Terminer 20 devoirs", "threshold": 20, "points": 75, "category": "homework", "counter": "completed_homework"},
+    {"id": "hw_50", "name": "Maître des Devoirs", "description": "Terminer 50 devoirs", "threshold": 50, "points": 150, "category": "homework", "counter": "completed_homework", "badge": True},
+    {"id": "hw_100", "name": "Légende des Devoirs", "description": "Terminer 100 devoirs", "threshold": 100, "points": 300, "category": "homework", "counter": "completed_homework", "badge": True},
+    {"id": "hw_200", "name": "Érudit des Devoirs", "description": "Terminer 200 devoirs", "threshold": 200, "points": 500, "category": "homework", "counter": "completed_homework", "badge": True},
+
+    # Flashcard completion
+    {"id": "fc_5", "name": "Apprenti des Flashcards", "description": "Terminer 5 quiz de flashcards", "threshold": 5, "points": 30, "category": "flashcards", "counter": "completed_flashcards"},
+    {"id": "fc_20", "name": "Étudiant Assidu", "description": "Terminer 20 quiz de flashcards", "threshold": 20, "points": 80, "category": "flashcards", "counter": "completed_flashcards"},
+    {"id": "fc_50", "name": "Maître de la Mémorisation", "description": "Terminer 50 quiz de flashcards", "threshold": 50, "points": 200, "category": "flashcards", "counter": "completed_flashcards", "badge": True},
+    {"id": "fc_100", "name": "Génie des Flashcards", "description": "Terminer 100 quiz de flashcards", "threshold": 100, "points": 350, "category": "flashcards", "counter": "completed_flashcards", "badge": True},
+    {"id": "fc_200", "name": "Sage de la Connaissance", "description": "Terminer 200 quiz de flashcards", "threshold": 200, "points": 600, "category": "flashcards", "counter": "completed_flashcards", "badge": True},
+
+    # Flashcard perfect sessions
+    {"id": "fc_perfect_5", "name": "Mémoire Photographique", "description": "Obtenir 5 sessions parfaites", "threshold": 5, "points": 50, "category": "flashcards_perfect", "counter": "perfect_sessions", "badge": True},
+    {"id": "fc_perfect_25", "name": "Mémoire d'Éléphant", "description": "Obtenir 25 sessions parfaites", "threshold": 25, "points": 150, "category": "flashcards_perfect", "counter": "perfect_sessions", "badge": True},
+
+    # Flashcard reviews
+    {"id": "fc_reviews_100", "name": "Centenaire", "description": "Réviser 100 cartes", "threshold": 100, "points": 40, "category": "flashcards_reviews", "counter": "total_reviews", "badge": True},
+    {"id": "fc_reviews_500", "name": "Réviseur Assidu", "description": "Réviser 500 cartes", "threshold": 500, "points": 100, "category": "flashcards_reviews", "counter": "total_reviews", "badge": True},
+    {"id": "fc_reviews_1000", "name": "Maître de la Révision", "description": "Réviser 1000 cartes", "threshold": 1000, "points": 250, "category": "flashcards_reviews", "counter": "total_reviews", "badge": True},
+
+    # Flashcard study streak
+    {"id": "fc_streak_3", "name": "Habitude Naissante", "description": "Maintenir une série d'étude de 3 jours", "threshold": 3, "points": 25, "category": "flashcards_streak", "counter": "study_streak", "badge": True},
+    {"id": "fc_streak_7", "name": "Habitude Hebdomadaire", "description": "Maintenir une série d'étude de 7 jours", "threshold": 7, "points": 60, "category": "flashcards_streak", "counter": "study_streak", "badge": True},
+    {"id": "fc_streak_30", "name": "Habitude Mensuelle", "description": "Maintenir une série d'étude de 30 jours", "threshold": 30, "points": 200, "category": "flashcards_streak", "counter": "study_streak", "badge": True},
+
+    # Flashcard sets studied
+    {"id": "fc_sets_3", "name": "Explorateur", "description": "Étudier 3 ensembles de cartes différents", "threshold": 3, "points": 30, "category": "flashcards_sets", "counter": "sets_studied"},
+    {"id": "fc_sets_10", "name": "Polymathe", "description": "Étudier 10 ensembles de cartes différents", "threshold": 10, "points": 80, "category": "flashcards_sets", "counter": "sets_studied"},
+
+    # Grade views
+    {"id": "grades_5", "name": "Observateur de Notes", "description": "Consulter ses notes 5 fois", "threshold": 5, "points": 20, "category": "grades", "counter": "viewed_grades"},
+    {"id": "grades_15", "name": "Analyste de Notes", "description": "Consulter ses notes 15 fois", "threshold": 15, "points": 50, "category": "grades", "counter": "viewed_grades"},
+    {"id": "grades_30", "name": "Expert en Notes", "description": "Consulter ses notes 30 fois", "threshold": 30, "points": 100, "category": "grades", "counter": "viewed_grades"},
+    {"id": "grades_50", "name": "Maître des Notes", "description": "Consulter ses notes 50 fois", "threshold": 50, "points": 150, "category": "grades", "counter": "viewed_grades"},
+
+    # Timetable views
+    {"id": "timetable_5", "name": "Planificateur Débutant", "description": "Consulter son emploi du temps 5 fois", "threshold": 5, "points": 20, "category": "timetable", "counter": "checked_timetable"},
+    {"id": "timetable_15", "name": "Organisateur", "description": "Consulter son emploi du temps 15 fois", "threshold": 15, "points": 50, "category": "timetable", "counter": "checked_timetable"},
+    {"id": "timetable_30", "name": "Maître du Temps", "description": "Consulter son emploi du temps 30 fois", "threshold": 30, "points": 100, "category": "timetable", "counter": "checked_timetable"},
+    {"id": "timetable_50", "name": "Chronométreur Suprême", "description": "Consulter son emploi du temps 50 fois", "threshold": 50, "points": 150, "category": "timetable", "counter": "checked_timetable"},
+
+    # Messages
+    {"id": "msg_5", "name": "Communicateur Débutant", "description": "Envoyer 5 messages", "threshold": 5, "points": 25, "category": "messages", "counter": "sent_messages"},
+    {"id": "msg_15", "name": "Communicateur Actif", "description": "Envoyer 15 messages", "threshold": 15, "points": 50, "category": "messages", "counter": "sent_messages"},
+    {"id": "msg_30", "name": "Communicateur Expert", "description": "Envoyer 30 messages", "threshold": 30, "points": 100, "category": "messages", "counter": "sent_messages", "badge": True},
+    {"id": "msg_50", "name": "Maître de la Communication", "description": "Envoyer 50 messages", "threshold": 50, "points": 150, "category": "messages", "counter": "sent_messages", "badge": True},
+
+    # Study plans
+    {"id": "plan_create_3", "name": "Planificateur Débutant", "description": "Créer 3 plans d'étude", "threshold": 3, "points": 30, "category": "study_plans", "counter": "study_plans_created"},
+    {"id": "plan_create_10", "name": "Planificateur Expert", "description": "Créer 10 plans d'étude", "threshold": 10, "points": 75, "category": "study_plans", "counter": "study_plans_created"},
+    {"id": "plan_complete_3", "name": "Étudiant Discipliné", "description": "Compléter 3 plans d'étude", "threshold": 3, "points": 50, "category": "study_plans", "counter": "study_plans_completed"},
+    {"id": "plan_complete_10", "name": "Maître de l'Étude", "description": "Compléter 10 plans d'étude", "threshold": 10, "points": 150, "category": "study_plans", "counter": "study_plans_completed", "badge": True},
+]
+
+
+def _index_rules(rules: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Group rules by counter, sorted by threshold
+
+    Args:
+        rules: Achievement rules
+
+    Returns:
+        Dict mapping counter names to their rules
+    """
+    index = {}
+    for rule in rules:
+        if rule["counter"] not in COUNTERS:
+            raise ValueError(f"Achievement {rule['id']} watches an unknown counter: {rule['counter']}")
+        index.setdefault(rule["counter"], []).append(rule)
+    for counter_rules in index.values():
+        counter_rules.sort(key=lambda rule: rule["threshold"])
+    return index
+
+
+# Rules of each counter, built once at import
+RULES_BY_COUNTER = _index_rules(ACHIEVEMENTS)
+
+
+def evaluate(data: Dict[str, Any], earned: Set[str], counters: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Find the achievements newly reached for some counters
+
+    Args:
+        data: The gamification data of the user
+        earned: Ids of the achievements the user already has
+        counters: Names of the counters that changed
+
+    Returns:
+        List of rules reached and not earned yet, in threshold order per counter
+    """
+    reached = []
+    for counter in counters:
+        rules = RULES_BY_COUNTER.get(counter)
+        if not rules:
+            continue
+
+        value = COUNTERS[counter](data)
+        for rule in rules:
+            if value < rule["threshold"]:
+                break
+            if rule["id"] not in earned:
+                reached.append(rule)
+    return reached
@@ -0,0 +1,90 @@
+"""
+Benchmark for the number of writes done by one gamification API call
+
+Counts the event log appends, document snapshots and leaderboard index
+updates of each GamificationSystem call, with transactions (one save per
+call) and without them (a save for every add_points, achievement and final
+_save_data, as before).
+
+Usage: python benchmarks/bench_gamification_writes.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# The gamification data directory is relative to the working directory
+os.chdir(tempfile.mkdtemp())
+
+import gamification
+from event_log import EventLog
+from leaderboard_index import LeaderboardIndex
+
+writes = Counter()
+
+
+def count_writes(cls, name: str, label: str, skip_empty: bool = False) -> None:
+    """Wrap a method to count its calls"""
+    original = getattr(cls, name)
+
+    def wrapper(self, *args, **kwargs):
+        if not skip_empty or args[0]:
+            writes[label] += 1
+        return original(self, *args, **kwargs)
+
+    setattr(cls, name, wrapper)
+
+
+class UntransactedSystem(gamification.GamificationSystem):
+    """Gamification system saving on every _save_data call"""
+
+    @contextmanager
+    def transaction(self):
+        yield self
+
+
+def scenario(system_class, username: str) -> list:
+    """Run a typical sequence of calls and count the writes of each one"""
+    system = system_class(username)
+    calls = [
+        ("update_login_streak", lambda: system.update_login_streak()),
+        ("track_homework_completion x5", lambda: [system.track_homework_completion() for _ in range(5)]),
+        ("track_flashcard_completion", lambda: system.track_flashcard_completion(
+            "set_1", {"total": 120, "good": 100, "easy": 20, "hard": 0, "failed": 0}, subject="Maths")),
+        ("track_message_sent x5", lambda: [system.track_message_sent() for _ in range(5)]),
+        ("create_study_plan", lambda: system.create_study_plan("Contrôle", "2030-01-01", "Maths", 1)),
+        ("track_exercise_completion", lambda: system.track_exercise_completion(system.data["study_plans"][-1]["id"])),
+    ]
+
+    results = []
+    for label, call in calls:
+        writes.clear()
+        t0 = time.perf_counter()
+        call()
+        elapsed = time.perf_counter() - t0
+        results.append((label, sum(writes.values()), elapsed))
+    return results
+
+
+def main() -> None:
+    # Only count appends that reach the disk (an empty batch writes nothing)
+    count_writes(EventLog, "append", "event log", skip_empty=True)
+    count_writes(gamification.GamificationSystem, "_write_snapshot", "snapshot")
+    count_writes(LeaderboardIndex, "update", "leaderboard")
+
+    before = scenario(UntransactedSystem, "before")
+    after = scenario(gamification.GamificationSystem, "after")
+
+    print(f"{'call':<32} {'writes before':>14} {'writes after':>13} {'ms before':>10} {'ms after':>9}")
+    for (label, count_before, time_before), (_, count_after, time_after) in zip(before, after):
+        print(f"{label:<32} {count_before:>14} {count_after:>13} {time_before * 1000:>10.2f} {time_after * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
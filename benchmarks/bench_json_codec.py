@@ -0,0 +1,120 @@
+"""
+Benchmark for the JSON codec used by the data files
+
+Compares the previous encoding (stdlib json, indent=2) with json_codec on a
+5,000-card flashcard set and a year of study analytics data.
+
+Usage: python benchmarks/bench_json_codec.py
+"""
+
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import json_codec
+
+
+def make_flashcard_set(num_cards: int = 5000) -> dict:
+    """Build a flashcard set with a review history on every card"""
+    now = datetime.datetime(2025, 1, 1)
+    cards = []
+    for i in range(num_cards):
+        history = [
+            {"date": (now + datetime.timedelta(days=d)).isoformat(), "quality": d % 6,
+             "ease_factor": 2.5 - (d % 5) * 0.1, "interval": d}
+            for d in range(20)
+        ]
+        cards.append({
+            "id": f"card_{i}_1735689600",
+            "question": f"Question numéro {i} : quelle est la capitale ?",
+            "answer": f"Réponse {i}",
+            "created_at": now.isoformat(),
+            "image_url": None,
+            "audio_url": None,
+            "tags": ["géographie", "europe"],
+            "learning_data": {
+                "ease_factor": 2.36,
+                "interval": 6,
+                "reviews": len(history),
+                "last_review": now.isoformat(),
+                "next_review": (now + datetime.timedelta(days=6)).isoformat(),
+                "history": history
+            }
+        })
+    return {"id": "1735689600", "name": "Benchmark", "subject": "Géographie",
+            "description": "", "cards": cards,
+            "stats": {"total_reviews": 0, "correct_reviews": 0, "incorrect_reviews": 0, "average_ease": 2.5}}
+
+
+def make_analytics_year() -> dict:
+    """Build a year of study analytics with three sessions of 30 cards a day"""
+    start = datetime.datetime(2025, 1, 1, 18)
+    sessions, reviews, daily = [], [], {}
+    for day in range(365):
+        for s in range(3):
+            date = start + datetime.timedelta(days=day, hours=s)
+            session_id = f"session_{len(sessions) + 1}_{int(date.timestamp())}"
+            sessions.append({
+                "id": session_id, "type": "flashcard", "set_id": str(1735689600 + s),
+                "set_name": "Vocabulaire", "subject": "Anglais", "date": date.isoformat(),
+                "day_of_week": date.weekday(), "hour_of_day": date.hour, "duration": 900,
+                "stats": {"failed": 3, "hard": 5, "good": 12, "easy": 10, "total": 30},
+                "performance": 71.3
+            })
+            for _ in range(30):
+                reviews.append({"session_id": session_id, "set_id": str(1735689600 + s),
+                                "subject": "Anglais", "date": date.isoformat(), "performance": "correct"})
+        daily[(start + datetime.timedelta(days=day)).date().isoformat()] = {
+            "study_time": 2700, "cards_reviewed": 90, "correct_cards": 66, "sessions": 3}
+    return {"study_sessions": sessions, "flashcard_reviews": reviews, "subject_performance": {},
+            "daily_stats": daily, "weekly_stats": {}, "monthly_stats": {}, "study_streak": 365,
+            "last_study_date": None, "total_study_time": 365 * 2700, "preferences": {}}
+
+
+def bench(label: str, save, load, path: Path, repeat: int = 5) -> None:
+    """Time save and load of a document"""
+    save_times, load_times = [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        save(path)
+        t1 = time.perf_counter()
+        load(path)
+        t2 = time.perf_counter()
+        save_times.append(t1 - t0)
+        load_times.append(t2 - t1)
+    size = os.path.getsize(path)
+    print(f"  {label:<22} save {min(save_times) * 1000:8.1f} ms   load {min(load_times) * 1000:8.1f} ms   "
+          f"size {size / 1024:9.1f} KiB")
+
+
+def main() -> None:
+    print(f"json_codec backend: {json_codec.BACKEND}")
+    documents = {"flashcard set (5,000 cards)": make_flashcard_set(),
+                 "analytics (1 year)": make_analytics_year()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "doc.json"
+        for name, doc in documents.items():
+            print(name)
+
+            def save_stdlib(p, doc=doc):
+                with open(p, 'w', encoding='utf-8') as f:
+                    json.dump(doc, f, indent=2, default=str)
+
+            def load_stdlib(p):
+                with open(p, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+
+            bench("stdlib indent=2", save_stdlib, load_stdlib, path)
+            bench("json_codec compact", lambda p, doc=doc: json_codec.dump(doc, p, pretty=False), json_codec.load, path)
+            bench("json_codec pretty", lambda p, doc=doc: json_codec.dump(doc, p, pretty=True), json_codec.load, path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark for the gamification leaderboard
+
+Compares the previous leaderboard (load every user file, then sort) with the
+SQLite leaderboard index on 10,000 users: top 10, the rank of one user and
+the incremental update done when a user earns points.
+
+Usage: python benchmarks/bench_leaderboard.py [num_users]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import json_codec
+from leaderboard_index import LeaderboardIndex
+
+
+def make_users(directory: Path, num_users: int) -> list:
+    """Write one gamification document per user and return their entries"""
+    rng = random.Random(42)
+    entries = []
+    for i in range(num_users):
+        level = rng.randint(1, 40)
+        entry = {"username": f"eleve{i:05d}", "points": rng.randint(0, 20000),
+                 "xp": rng.randint(0, 100000), "level": level,
+                 "streak": rng.randint(0, 60), "flame_level": rng.randint(0, 5)}
+        document = {"points": entry["points"], "xp": entry["xp"], "level": level,
+                    "streak": {"current": entry["streak"], "flame_level": entry["flame_level"]},
+                    "activity_history": [{"date": "2025-01-01T18:00:00", "action": "Devoir terminé",
+                                          "points": 10, "xp": 50}] * 100,
+                    "inventory": {"boosters": [], "avatars": ["default"], "themes": ["default"]}}
+        json_codec.dump(document, directory / f"{entry['username']}.json")
+        entries.append(entry)
+    return entries
+
+
+def scan_leaderboard(directory: Path, top_n: int = 10) -> list:
+    """Previous implementation: parse every document and sort"""
+    leaderboard = []
+    for file in directory.glob("*.json"):
+        data = json_codec.load(file)
+        leaderboard.append({"username": file.stem, "points": data.get("points", 0),
+                            "xp": data.get("xp", 0), "level": data.get("level", 1),
+                            "streak": data.get("streak", {}).get("current", 0)})
+    leaderboard.sort(key=lambda x: (x["level"], x["xp"]), reverse=True)
+    return leaderboard
+
+
+def timed(label: str, func, repeat: int = 5) -> None:
+    """Print the best time of a function"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    print(f"  {label:<34} {min(times) * 1000:10.3f} ms")
+
+
+def main() -> None:
+    num_users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        print(f"Writing {num_users} user documents...")
+        entries = make_users(directory, num_users)
+        target = entries[len(entries) // 2]["username"]
+
+        index = LeaderboardIndex(directory / "leaderboard.db")
+        t0 = time.perf_counter()
+        index.rebuild(entries)
+        print(f"Index rebuilt in {(time.perf_counter() - t0) * 1000:.1f} ms "
+              f"({os.path.getsize(directory / 'leaderboard.db') / 1024:.0f} KiB)")
+
+        scanned = sorted(scan_leaderboard(directory), key=lambda x: (-x["level"], -x["xp"], x["username"]))
+        assert [e["username"] for e in index.top(10)] == [e["username"] for e in scanned[:10]]
+        assert index.rank(target)["rank"] == [e["username"] for e in scanned].index(target) + 1
+
+        print("file scan")
+        timed("top 10", lambda: scan_leaderboard(directory)[:10], repeat=3)
+        timed("rank of one user", lambda: [e["username"] for e in scan_leaderboard(directory)].index(target),
+              repeat=3)
+
+        print("leaderboard index")
+        timed("top 10", lambda: index.top(10))
+        timed("rank of one user", lambda: index.rank(target))
+        entry = dict(entries[0])
+
+        def update():
+            entry["xp"] += 50
+            index.update(entry)
+        timed("update after add_points", update)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,6 @@ This module provides functionality to:
 """
 
 import datetime
-import json
 import os
 import math
 import random
@@ -21,11 +20,40 @@ from icalendar import Calendar, Event, vText
 from datetime import datetime, timedelta
 import pytz
 import tempfile
+import json_codec
+from document_schema import DocumentSchema
 
 # Path for calendar data
 CALENDAR_DIR = Path('data/calendar')
 os.makedirs(CALENDAR_DIR, exist_ok=True)
 
+
+def _default_data() -> Dict[str, Any]:
+    """
+    Build the calendar data of a new user
+
+    Returns:
+        Dict containing default calendar data
+    """
+    return {
+        "study_blocks": [],
+        "scheduled_sessions": [],
+        "external_calendars": [],
+        "homework_priorities": [],
+        "preferences": {
+            "preferred_study_times": [],
+            "study_session_length": 45,  # minutes
+            "break_length": 15,  # minutes
+            "max_daily_study_time": 180,  # minutes
+            "calendar_sync_enabled": False
+        }
+    }
+
+
+# Versioned schema of the calendar document
+CALENDAR_SCHEMA = DocumentSchema("calendar", 1, _default_data)
+
+
 class CalendarIntegration:
     """Class to manage calendar integration and task scheduling"""
     
@@ -44,51 +72,25 @@ class CalendarIntegration:
         
     def _load_data(self) -> Dict[str, Any]:
         """
-        Load calendar data from file
-        
+        Load calendar data from file, migrating older documents once
+
         Returns:
             Dict containing calendar data
         """
-        if not self.data_file.exists():
-            # Initialize with default data
-            return {
-                "study_blocks": [],
-                "scheduled_sessions": [],
-                "external_calendars": [],
-                "homework_priorities": [],
-                "preferences": {
-                    "preferred_study_times": [],
-                    "study_session_length": 45,  # minutes
-                    "break_length": 15,  # minutes
-                    "max_daily_study_time": 180,  # minutes
-                    "calendar_sync_enabled": False
-                }
-            }
-        
-        try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading calendar data: {e}")
-            return {
-                "study_blocks": [],
-                "scheduled_sessions": [],
-                "external_calendars": [],
-                "homework_priorities": [],
-                "preferences": {
-                    "preferred_study_times": [],
-                    "study_session_length": 45,  # minutes
-                    "break_length": 15,  # minutes
-                    "max_daily_study_time": 180,  # minutes
-                    "calendar_sync_enabled": False
-                }
-            }
+        data, migrated = CALENDAR_SCHEMA.load(self.data_file)
+
+        if migrated:
+            try:
+                json_codec.dump(data, self.data_file)
+            except Exception as e:
+                print(f"Error saving calendar data: {e}")
+
+        return data
     
     def _save_data(self) -> None:
         """Save calendar data to file"""
         try:
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=2, default=str)
+            json_codec.dump(self.data, self.data_file)
         except Exception as e:
             print(f"Error saving calendar data: {e}")
     
@@ -445,11 +447,6 @@ class CalendarIntegration:
         Returns:
             List of scheduled sessions
         """
-        # Make sure the scheduled_sessions key exists in the data
-        if "scheduled_sessions" not in self.data:
-            self.data["scheduled_sessions"] = []
-            self._save_data()
-            
         sessions = self.data["scheduled_sessions"]
         
         # If no dates specified, return all sessions
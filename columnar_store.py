@@ -0,0 +1,336 @@
+"""
+Append-only columnar storage for time-ordered history (study sessions, reviews)
+
+Each column is a flat binary file of fixed-size values (the raw buffer of a
+Python ``array``), so the files can be memory-mapped and a time range can be
+read without parsing the rows outside of it. Strings are dictionary-encoded
+into integer ids shared by every column of the store. Writers (appends,
+interning, rewrites) hold a lock file of the store, so several processes
+can write the same store.
+"""
+
+import bisect
+import mmap
+import os
+from array import array
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+import json_codec
+from file_lock import file_lock
+
+
+class ColumnStore:
+    """
+    Store of rows sharing a fixed set of typed columns
+
+    The ``ts`` column (epoch seconds, typecode ``d``) is mandatory and rows
+    must be appended in timestamp order so range queries can binary search it.
+    """
+
+    def __init__(self, directory: Path, columns: Dict[str, str]):
+        """
+        Initialize the column store
+
+        Args:
+            directory: Directory holding one file per column
+            columns: Dict mapping column names to ``array`` typecodes
+        """
+        if columns.get("ts") != "d":
+            raise ValueError("A column store needs a 'ts' column of typecode 'd'")
+
+        self.directory = Path(directory)
+        self.columns = dict(columns)
+        self.strings_file = self.directory / "strings.json"
+        self.lock_file = self.directory / "store.lock"
+        self._strings = None
+        self._string_ids = None
+        self._strings_state = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __len__(self) -> int:
+        """Number of complete rows in the store"""
+        return min(self._column_length(name) for name in self.columns)
+
+    def append(self, row: Dict[str, Any]) -> None:
+        """
+        Append one row
+
+        Args:
+            row: Dict mapping column names to values (missing values are 0)
+        """
+        self.extend([row])
+
+    def extend(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """
+        Append rows in timestamp order
+
+        Args:
+            rows: Rows to append
+        """
+        buffers = {name: array(typecode) for name, typecode in self.columns.items()}
+
+        for row in rows:
+            for name, buffer in buffers.items():
+                buffer.append(row.get(name) or 0)
+
+        if not len(buffers["ts"]):
+            return
+
+        with file_lock(self.lock_file):
+            self._write(buffers)
+
+    def _write(self, buffers: Dict[str, array]) -> None:
+        """Append the buffers of the columns (under the store lock)"""
+        # Drop the partial tail of a previously interrupted append
+        length = len(self)
+        for name, buffer in buffers.items():
+            path = self._column_file(name)
+            with open(path, 'ab') as f:
+                f.truncate(length * buffer.itemsize)
+                f.write(buffer.tobytes())
+
+    def intern(self, value: Optional[str]) -> int:
+        """
+        Get the id of a string, adding it to the dictionary if needed
+
+        Args:
+            value: The string to encode
+
+        Returns:
+            The integer id of the string
+        """
+        self._load_strings()
+        value = "" if value is None else str(value)
+        if value in self._string_ids and self._strings_state == _file_state(self.strings_file):
+            return self._string_ids[value]
+
+        # Another process may have added or renamed strings since they were loaded
+        with file_lock(self.lock_file):
+            self._load_strings(reload=True)
+            if value not in self._string_ids:
+                self._string_ids[value] = len(self._strings)
+                self._strings.append(value)
+                self._save_strings()
+
+        return self._string_ids[value]
+
+    def string(self, string_id: int) -> str:
+        """
+        Get the string of a dictionary id
+
+        Args:
+            string_id: The id returned by intern
+
+        Returns:
+            The decoded string
+        """
+        self._load_strings()
+        if string_id >= len(self._strings):
+            # Added by another writer since the dictionary was loaded
+            self._load_strings(reload=True)
+        return self._strings[string_id] if 0 <= string_id < len(self._strings) else ""
+
+    def lookup(self, value: str) -> Optional[int]:
+        """
+        Get the id of a string without adding it
+
+        Args:
+            value: The string to look up
+
+        Returns:
+            The integer id or None if the string was never stored
+        """
+        self._load_strings()
+        return self._string_ids.get(value)
+
+    def rename_strings(self, renames: Dict[str, str]) -> int:
+        """
+        Replace strings of the dictionary in place
+
+        Rows keep their ids, so every row holding a renamed string reads the
+        new value without the columns being rewritten.
+
+        Args:
+            renames: Dict mapping old strings to new strings
+
+        Returns:
+            Number of strings renamed
+        """
+        with file_lock(self.lock_file):
+            self._load_strings(reload=True)
+            renamed = 0
+            for i, value in enumerate(self._strings):
+                if renames.get(value, value) != value:
+                    self._strings[i] = renames[value]
+                    renamed += 1
+
+            if renamed:
+                self._string_ids = {value: i for i, value in enumerate(self._strings)}
+                self._save_strings()
+        return renamed
+
+    def range_bounds(self, start_ts: Optional[float] = None, end_ts: Optional[float] = None) -> slice:
+        """
+        Find the rows of a time range
+
+        Args:
+            start_ts: Inclusive lower bound (epoch seconds)
+            end_ts: Exclusive upper bound (epoch seconds)
+
+        Returns:
+            Slice of row positions inside the range
+        """
+        length = len(self)
+        if not length:
+            return slice(0, 0)
+
+        with self._map("ts") as ts:
+            start = 0 if start_ts is None else bisect.bisect_left(ts, start_ts, 0, length)
+            end = length if end_ts is None else bisect.bisect_left(ts, end_ts, start, length)
+
+        return slice(start, end)
+
+    def read(self, columns: Optional[List[str]] = None, start_ts: Optional[float] = None,
+             end_ts: Optional[float] = None) -> Dict[str, array]:
+        """
+        Read columns for a time range
+
+        Args:
+            columns: Names of the columns to read (defaults to all)
+            start_ts: Inclusive lower bound (epoch seconds)
+            end_ts: Exclusive upper bound (epoch seconds)
+
+        Returns:
+            Dict mapping column names to arrays of the selected rows
+        """
+        rows = self.range_bounds(start_ts, end_ts)
+        return {name: self.read_slice(name, rows) for name in (columns or self.columns)}
+
+    def read_slice(self, name: str, rows: slice) -> array:
+        """
+        Read a contiguous slice of one column
+
+        Args:
+            name: The column name
+            rows: Slice of row positions
+
+        Returns:
+            Array holding the values of the slice
+        """
+        values = array(self.columns[name])
+        count = rows.stop - rows.start
+        if count <= 0:
+            return values
+
+        with open(self._column_file(name), 'rb') as f:
+            f.seek(rows.start * values.itemsize)
+            values.frombytes(f.read(count * values.itemsize))
+
+        return values
+
+    def rewrite(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """
+        Replace the whole content of the store
+
+        Args:
+            rows: Rows in timestamp order
+        """
+        buffers = {name: array(typecode) for name, typecode in self.columns.items()}
+        for row in rows:
+            for name, buffer in buffers.items():
+                buffer.append(row.get(name) or 0)
+
+        with file_lock(self.lock_file):
+            for name in self.columns:
+                path = self._column_file(name)
+                if path.exists():
+                    os.remove(path)
+            self._write(buffers)
+
+    def size_on_disk(self) -> int:
+        """
+        Get the number of bytes used by the store
+
+        Returns:
+            Total size of the column files and string dictionary
+        """
+        return sum(path.stat().st_size for path in self.directory.iterdir() if path.is_file())
+
+    def _column_file(self, name: str) -> Path:
+        """Path of the file of a column"""
+        return self.directory / f"{name}.{self.columns[name]}.bin"
+
+    def _column_length(self, name: str) -> int:
+        """Number of values stored in a column file"""
+        path = self._column_file(name)
+        if not path.exists():
+            return 0
+        return path.stat().st_size // array(self.columns[name]).itemsize
+
+    def _map(self, name: str) -> "_MappedColumn":
+        """Memory-map a column for random access"""
+        return _MappedColumn(self._column_file(name), self.columns[name])
+
+    def _load_strings(self, reload: bool = False) -> None:
+        """
+        Load the string dictionary on first use
+
+        Args:
+            reload: Read the file again if it changed since it was loaded
+        """
+        state = _file_state(self.strings_file) if reload or self._strings is None else self._strings_state
+        if self._strings is not None and state == self._strings_state:
+            return
+
+        self._strings = []
+        if state is not None:
+            try:
+                self._strings = json_codec.load(self.strings_file)
+            except Exception as e:
+                print(f"Error loading column store strings {self.strings_file}: {e}")
+        self._string_ids = {value: i for i, value in enumerate(self._strings)}
+        self._strings_state = state
+
+    def _save_strings(self) -> None:
+        """Write the string dictionary (under the store lock)"""
+        # Readers do not take the lock, so replace the file in one step
+        temp = self.strings_file.with_name(self.strings_file.name + ".tmp")
+        json_codec.dump(self._strings, temp)
+        os.replace(temp, self.strings_file)
+        self._strings_state = _file_state(self.strings_file)
+
+
+def _file_state(path: Path) -> Optional[Tuple[int, int]]:
+    """Modification time and size of a file, None if it does not exist"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class _MappedColumn:
+    """Context manager exposing a memory-mapped column as a typed memoryview"""
+
+    def __init__(self, path: Path, typecode: str):
+        self.path = path
+        self.typecode = typecode
+        self._file = None
+        self._mmap = None
+        self._views = []
+
+    def __enter__(self) -> memoryview:
+        self._file = open(self.path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        itemsize = array(self.typecode).itemsize
+        usable = len(self._mmap) - len(self._mmap) % itemsize
+        base = memoryview(self._mmap)
+        window = base[:usable]
+        self._views = [window.cast(self.typecode), window, base]
+        return self._views[0]
+
+    def __exit__(self, *exc) -> None:
+        for view in self._views:
+            view.release()
+        self._mmap.close()
+        self._file.close()
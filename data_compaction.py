@@ -0,0 +1,370 @@
+"""
+Storage compaction and retention job for the data/ tree
+
+Rolls old fine-grained records (per-card review history, daily and weekly
+stats) into weekly or monthly aggregates, compresses old gamification event
+segments, rewrites the files compactly and reports the bytes reclaimed.
+Users active in the last ACTIVE_USER_MINUTES are skipped, and the others are
+compacted under their gamification lock. Run it from the command line or let
+the web app start it in a background thread:
+
+    python data_compaction.py [username ...]
+"""
+
+import datetime
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+from flashcard_system import FLASHCARDS_DIR, FlashcardManager
+from event_log import EventLog
+from gamification import GAMIFICATION_DIR, GAMIFICATION_EVENTS_DIR, get_leaderboard_index, user_lock
+from study_analytics import ANALYTICS_DIR, StudyAnalytics
+
+# Default retention (how long fine-grained records are kept before roll-up)
+DEFAULT_RETENTION = {
+    "card_history_days": 180,      # Entries of learning_data.history
+    "card_history_entries": 20,    # Entries of learning_data.history always kept
+    "daily_stats_days": 120,       # Keys of daily_stats
+    "weekly_stats_weeks": 104,     # Keys of weekly_stats
+    "event_segment_days": 365      # Archived gamification event segments (then compressed)
+}
+
+# Hours between two runs of the background job (0 disables it)
+COMPACTION_INTERVAL_HOURS = float(os.environ.get('FIREFLIES_COMPACTION_INTERVAL_HOURS', '24'))
+
+# Users whose files changed more recently than this are left for the next run
+ACTIVE_USER_MINUTES = float(os.environ.get('FIREFLIES_COMPACTION_ACTIVE_MINUTES', '30'))
+
+_compaction_thread = None
+
+
+def list_users() -> List[str]:
+    """
+    Get every username that has data on disk
+
+    Returns:
+        Sorted list of usernames
+    """
+    users = set()
+    if ANALYTICS_DIR.exists():
+        users.update(p.name for p in ANALYTICS_DIR.iterdir() if p.is_dir())
+    if FLASHCARDS_DIR.exists():
+        users.update(p.name for p in FLASHCARDS_DIR.iterdir() if p.is_dir())
+    if GAMIFICATION_DIR.exists():
+        users.update(p.stem for p in GAMIFICATION_DIR.glob("*.json"))
+    return sorted(users)
+
+
+def compact_all(retention: Optional[Dict[str, Any]] = None,
+                usernames: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Compact the data of every user
+
+    Args:
+        retention: Overrides of DEFAULT_RETENTION
+        usernames: Users to compact (defaults to every user)
+
+    Returns:
+        Dict with the total and per-user bytes reclaimed
+    """
+    report = {"users": {}, "bytes_before": 0, "bytes_after": 0, "bytes_reclaimed": 0}
+
+    for username in usernames or list_users():
+        try:
+            user_report = compact_user(username, retention)
+        except Exception as e:
+            print(f"Error compacting data for {username}: {e}")
+            continue
+
+        report["users"][username] = user_report
+        for key in ("bytes_before", "bytes_after", "bytes_reclaimed"):
+            report[key] += user_report[key]
+
+    # Drop the weekly and monthly leaderboard totals past their retention
+    try:
+        report["leaderboard_rows_pruned"] = get_leaderboard_index().prune()
+    except Exception as e:
+        print(f"Error pruning leaderboard index: {e}")
+
+    return report
+
+
+def compact_user(username: str, retention: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Compact the data of one user
+
+    Args:
+        username: The username of the user
+        retention: Overrides of DEFAULT_RETENTION
+
+    Returns:
+        Dict with the bytes reclaimed and the number of records rolled up
+        ("skipped" is True if the user was active)
+    """
+    policy = dict(DEFAULT_RETENTION)
+    policy.update(retention or {})
+    now = datetime.datetime.now()
+
+    paths = _user_paths(username)
+    before = _size(paths)
+
+    # Files a request may be writing right now are not rewritten
+    if _last_modified(paths) > time.time() - ACTIVE_USER_MINUTES * 60:
+        return {"bytes_before": before, "bytes_after": before, "bytes_reclaimed": 0,
+                "rolled_up": {}, "skipped": True}
+
+    rolled = {}
+    with user_lock(username):
+        rolled.update(_compact_analytics(username, policy, now))
+        rolled.update(_compact_flashcards(username, policy, now))
+        rolled.update(_compact_events(username, policy, now))
+
+    after = _size(_user_paths(username))
+    return {
+        "bytes_before": before,
+        "bytes_after": after,
+        "bytes_reclaimed": before - after,
+        "rolled_up": rolled,
+        "skipped": False
+    }
+
+
+def _compact_analytics(username: str, policy: Dict[str, Any], now: datetime.datetime) -> Dict[str, int]:
+    """
+    Roll old daily/weekly stats up
+
+    Args:
+        username: The username of the user
+        policy: The retention policy
+        now: Reference time
+
+    Returns:
+        Number of records rolled up, per kind
+    """
+    if not (ANALYTICS_DIR / username).exists():
+        return {}
+
+    analytics = StudyAnalytics(username)
+    data = analytics.data
+    rolled = {"daily_stats": 0, "weekly_stats": 0}
+
+    # Written by earlier versions
+    data.pop("review_rollups", None)
+
+    # Daily stats older than the retention are folded into their week
+    # (periods already present were updated together with the day)
+    daily_cutoff = (now - datetime.timedelta(days=policy["daily_stats_days"])).date().isoformat()
+    created = set()
+    for date_key in [key for key in data["daily_stats"] if key < daily_cutoff]:
+        stats = data["daily_stats"].pop(date_key)
+        year, week, _ = datetime.date.fromisoformat(date_key).isocalendar()
+        week_key = f"{year}-W{week:02d}"
+        if week_key not in data["weekly_stats"]:
+            data["weekly_stats"][week_key] = {
+                "study_time": 0, "cards_reviewed": 0, "correct_cards": 0, "sessions": 0, "days_studied": []
+            }
+            created.add(week_key)
+        if week_key in created:
+            _add_stats(data["weekly_stats"][week_key], stats, date_key)
+        rolled["daily_stats"] += 1
+
+    # Weekly stats older than the retention are folded into their month
+    weekly_cutoff = now.date() - datetime.timedelta(weeks=policy["weekly_stats_weeks"])
+    for week_key in list(data["weekly_stats"]):
+        year, week = week_key.split("-W")
+        week_start = datetime.date.fromisocalendar(int(year), int(week), 1)
+        if week_start >= weekly_cutoff:
+            continue
+
+        stats = data["weekly_stats"].pop(week_key)
+        month_key = f"{week_start.year}-{week_start.month:02d}"
+        if month_key not in data["monthly_stats"]:
+            data["monthly_stats"][month_key] = {
+                "study_time": 0, "cards_reviewed": 0, "correct_cards": 0, "sessions": 0, "days_studied": []
+            }
+            created.add(month_key)
+        if month_key in created:
+            _add_stats(data["monthly_stats"][month_key], stats)
+        rolled["weekly_stats"] += 1
+
+    # The list of days studied is replaced by its length once a month is closed
+    for month_key, stats in data["monthly_stats"].items():
+        if month_key < daily_cutoff[:7] and "days_studied" in stats:
+            stats["days_count"] = len(stats.pop("days_studied"))
+
+    analytics._save_data()
+    return rolled
+
+
+def _add_stats(target: Dict[str, Any], stats: Dict[str, Any], date_key: Optional[str] = None) -> None:
+    """Add the counters of a finer-grained stats entry to an aggregate"""
+    for key in ("study_time", "cards_reviewed", "correct_cards", "sessions"):
+        target[key] += stats.get(key, 0)
+
+    days = [date_key] if date_key else stats.get("days_studied", [])
+    for day in days:
+        if day not in target["days_studied"]:
+            target["days_studied"].append(day)
+
+
+def _compact_flashcards(username: str, policy: Dict[str, Any], now: datetime.datetime) -> Dict[str, int]:
+    """
+    Roll old per-card review history into a per-card summary
+
+    Args:
+        username: The username of the user
+        policy: The retention policy
+        now: Reference time
+
+    Returns:
+        Number of history entries rolled up
+    """
+    if not (FLASHCARDS_DIR / username).exists():
+        return {}
+
+    manager = FlashcardManager(username)
+    cutoff = (now - datetime.timedelta(days=policy["card_history_days"])).isoformat()
+    keep = policy["card_history_entries"]
+    rolled = 0
+
+    for set_id in [summary["id"] for summary in manager.get_set_summaries()]:
+        set_data = manager.get_set(set_id)
+        if not set_data:
+            continue
+
+        changed = False
+        for card in set_data.get("cards", []):
+            learning_data = card.get("learning_data") or {}
+            history = learning_data.get("history") or []
+            # Entries are selected by date: the history is not always in date order
+            rolled_indexes = {i for i, entry in enumerate(history[:-keep or None])
+                              if entry.get("date", "") < cutoff}
+            if not rolled_indexes:
+                continue
+            old = [history[i] for i in sorted(rolled_indexes)]
+            dates = [entry.get("date", "") for entry in old]
+
+            summary = learning_data.setdefault("history_summary", {
+                "reviews": 0, "quality_sum": 0, "first_review": None, "last_rolled": None
+            })
+            summary["reviews"] += len(old)
+            summary["quality_sum"] += sum(entry.get("quality", 0) for entry in old)
+            if summary["first_review"] is None or min(dates) < summary["first_review"]:
+                summary["first_review"] = min(dates)
+            if summary["last_rolled"] is None or max(dates) > summary["last_rolled"]:
+                summary["last_rolled"] = max(dates)
+            learning_data["history"] = [entry for i, entry in enumerate(history) if i not in rolled_indexes]
+            rolled += len(old)
+            changed = True
+
+        # Every set is rewritten so files written by older versions become compact
+        if changed or _is_indented(manager.user_dir / f"{set_id}.json"):
+            manager.save_set(set_data)
+
+    return {"card_history": rolled}
+
+
+def _compact_events(username: str, policy: Dict[str, Any], now: datetime.datetime) -> Dict[str, int]:
+    """
+    Move old archived gamification event segments to compressed cold storage
+
+    The segments stay readable by EventLog, so the activity pages and the
+    XP totals of the leaderboards still see the full history.
+
+    Args:
+        username: The username of the user
+        policy: The retention policy
+        now: Reference time
+
+    Returns:
+        Number of events moved to cold storage
+    """
+    events = EventLog(GAMIFICATION_EVENTS_DIR, username)
+    cutoff = (now - datetime.timedelta(days=policy["event_segment_days"])).isoformat()
+    compressed = 0
+
+    # The live segment is never in the archive, so only snapshotted history is compressed
+    for segment in [s for s in events.segments() if s != events.log_file and s.suffix == ".ndjson"]:
+        segment_events = list(events._read_segment(segment))
+        if not segment_events or segment_events[-1].get("ts", "") >= cutoff:
+            continue
+
+        if events.compress(segment):
+            compressed += len(segment_events)
+
+    return {"events": compressed}
+
+
+def _is_indented(path: Path) -> bool:
+    """Check whether a JSON file was written with indentation"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(2) == b'{\n'
+    except OSError:
+        return False
+
+
+def _user_paths(username: str) -> List[Path]:
+    """Get every file holding data of a user"""
+    paths = [GAMIFICATION_DIR / f"{username}.json"]
+    for directory in (ANALYTICS_DIR / username, FLASHCARDS_DIR / username, GAMIFICATION_EVENTS_DIR / username):
+        if directory.exists():
+            paths.extend(p for p in directory.rglob("*") if p.is_file())
+    live_log = GAMIFICATION_EVENTS_DIR / f"{username}.ndjson"
+    paths.append(live_log)
+    return paths
+
+
+def _last_modified(paths: List[Path]) -> float:
+    """Most recent modification time of the existing files of a list"""
+    return max((p.stat().st_mtime for p in paths if p.exists()), default=0.0)
+
+
+def _size(paths: List[Path]) -> int:
+    """Total size of the existing files of a list"""
+    return sum(p.stat().st_size for p in paths if p.exists())
+
+
+def start_background_compaction(interval_hours: float = COMPACTION_INTERVAL_HOURS,
+                                retention: Optional[Dict[str, Any]] = None) -> Optional[threading.Thread]:
+    """
+    Run the compaction job periodically in a daemon thread
+
+    Args:
+        interval_hours: Hours between two runs (0 disables the job)
+        retention: Overrides of DEFAULT_RETENTION
+
+    Returns:
+        The thread, or None if the job is disabled
+    """
+    global _compaction_thread
+
+    if interval_hours <= 0:
+        return None
+    if _compaction_thread is not None and _compaction_thread.is_alive():
+        return _compaction_thread
+
+    def run():
+        while True:
+            time.sleep(interval_hours * 3600)
+            report = compact_all(retention)
+            print(f"Data compaction reclaimed {report['bytes_reclaimed']} bytes "
+                  f"for {len(report['users'])} users")
+
+    _compaction_thread = threading.Thread(target=run, name="data-compaction", daemon=True)
+    _compaction_thread.start()
+    return _compaction_thread
+
+
+if __name__ == "__main__":
+    result = compact_all(usernames=sys.argv[1:] or None)
+    for name, user_report in result["users"].items():
+        if user_report["skipped"]:
+            print(f"{name}: skipped (active in the last {ACTIVE_USER_MINUTES:g} minutes)")
+            continue
+        print(f"{name}: {user_report['bytes_reclaimed']} bytes reclaimed, rolled up {user_report['rolled_up']}")
+    print(f"Total: {result['bytes_before']} -> {result['bytes_after']} bytes "
+          f"({result['bytes_reclaimed']} reclaimed)")
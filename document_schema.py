@@ -0,0 +1,108 @@
+"""
+Schema versioning for the per-user JSON documents stored under data/
+"""
+
+from pathlib import Path
+from typing import Dict, Any, Callable, Optional, Tuple
+import json_codec
+
+# Key holding the schema version of a document
+SCHEMA_VERSION_KEY = "schema_version"
+
+
+class DocumentSchema:
+    """
+    Versioned schema of a persisted document
+
+    Documents are migrated once, when they are loaded with an older version,
+    so the rest of the code can rely on every key of the defaults existing.
+    """
+
+    def __init__(self, name: str, version: int, defaults: Callable[[], Dict[str, Any]],
+                 migrations: Optional[Dict[int, Callable[[Dict[str, Any]], None]]] = None):
+        """
+        Initialize the schema
+
+        Args:
+            name: Name of the document type (used in error messages)
+            version: Current version of the schema
+            defaults: Function returning a new document with default values
+            migrations: Dict mapping a version to the function upgrading a
+                document from the previous version (applied in order)
+        """
+        self.name = name
+        self.version = version
+        self.defaults = defaults
+        self.migrations = migrations or {}
+
+    def new_document(self) -> Dict[str, Any]:
+        """
+        Create a document with default values
+
+        Returns:
+            The new document
+        """
+        document = self.defaults()
+        document[SCHEMA_VERSION_KEY] = self.version
+        return document
+
+    def load(self, path: Path, migrate: bool = True) -> Tuple[Dict[str, Any], bool]:
+        """
+        Load and migrate a document
+
+        Args:
+            path: Path of the document
+            migrate: Upgrade the document (callers rebuilding the document
+                from other sources first can call migrate themselves)
+
+        Returns:
+            Tuple of (document, migrated) where migrated tells the caller the
+            document changed and should be saved back
+        """
+        if not path.exists():
+            return self.new_document(), False
+
+        try:
+            document = json_codec.load(path)
+        except Exception as e:
+            print(f"Error loading {self.name} data: {e}")
+            return self.new_document(), False
+
+        return document, migrate and self.migrate(document)
+
+    def migrate(self, document: Dict[str, Any]) -> bool:
+        """
+        Upgrade a document to the current version in place
+
+        Args:
+            document: The document to upgrade
+
+        Returns:
+            True if the document was changed
+        """
+        current = document.get(SCHEMA_VERSION_KEY, 0)
+        if current >= self.version:
+            return False
+
+        for version in range(current + 1, self.version + 1):
+            if version in self.migrations:
+                self.migrations[version](document)
+
+        fill_defaults(document, self.defaults())
+        document[SCHEMA_VERSION_KEY] = self.version
+        return True
+
+
+def fill_defaults(document: Dict[str, Any], defaults: Dict[str, Any]) -> None:
+    """
+    Add the missing keys of nested dicts from their defaults
+
+    Args:
+        document: The document to complete in place
+        defaults: The default values
+    """
+    for key, value in defaults.items():
+        if key not in document or document[key] is None and value is not None:
+            document[key] = value
+        elif isinstance(value, dict) and isinstance(document[key], dict):
+            fill_defaults(document[key], value)
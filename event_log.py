@@ -0,0 +1,233 @@
+"""
+Append-only event log for per-user state stored under data/
+"""
+
+import datetime
+import gzip
+import os
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Iterator, Iterable
+import json_codec
+
+
+class EventLog:
+    """
+    Append-only NDJSON event log with archived segments
+
+    The live segment (``<name>.ndjson``) holds every event written since the
+    last snapshot of the owning document. When the owner writes a snapshot,
+    the live segment is rotated into ``<name>/<first_seq>.ndjson`` so the full
+    history stays available without being replayed on every load. Old
+    archived segments can be compressed into cold storage
+    (``<name>/<first_seq>.ndjson.gz``); they are still read like the others.
+    """
+
+    def __init__(self, directory: Path, name: str):
+        """
+        Initialize the event log
+
+        Args:
+            directory: Directory holding the live segment
+            name: Name of the log (usually the username)
+        """
+        self.directory = Path(directory)
+        self.name = name
+        self.log_file = self.directory / f"{name}.ndjson"
+        self.archive_dir = self.directory / name
+        self.seq = 0
+        self.pending = 0
+
+    def append(self, events: Iterable[Dict[str, Any]]) -> int:
+        """
+        Append events to the live segment in a single write
+
+        Args:
+            events: Events to append (a seq number and timestamp are added)
+
+        Returns:
+            Sequence number of the last event written (unchanged if the
+            write failed)
+        """
+        now = datetime.datetime.now().isoformat()
+        lines = []
+        seq = self.seq
+
+        for event in events:
+            seq += 1
+            record = {"seq": seq, "ts": now}
+            record.update(event)
+            lines.append(json_codec.dumps(record, pretty=False))
+
+        if not lines:
+            return self.seq
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+        except Exception as e:
+            print(f"Error appending to event log {self.log_file}: {e}")
+            return self.seq
+
+        # Only written events advance the sequence
+        self.seq = seq
+        self.pending += len(lines)
+        return self.seq
+
+    def read_tail(self, after_seq: int = 0) -> List[Dict[str, Any]]:
+        """
+        Read the events of the live segment newer than a snapshot
+
+        Args:
+            after_seq: Sequence number already included in the snapshot
+
+        Returns:
+            List of events in sequence order
+        """
+        events = list(self._read_segment(self.log_file, after_seq))
+        self.pending = len(events)
+        self.seq = max(after_seq, events[-1]["seq"] if events else 0)
+        return events
+
+    def rotate(self) -> None:
+        """Move the live segment to the archive once it has been snapshotted"""
+        if not self.log_file.exists():
+            self.pending = 0
+            return
+
+        try:
+            first_seq = next(self._read_segment(self.log_file), {}).get("seq", self.seq)
+            os.makedirs(self.archive_dir, exist_ok=True)
+            os.replace(self.log_file, self.archive_dir / f"{first_seq:012d}.ndjson")
+            self.pending = 0
+        except Exception as e:
+            print(f"Error rotating event log {self.log_file}: {e}")
+
+    def compress(self, segment: Path) -> bool:
+        """
+        Move an archived segment to cold storage (gzip next to the others)
+
+        Args:
+            segment: Path of an uncompressed archived segment
+
+        Returns:
+            True if the segment was compressed
+        """
+        if segment == self.log_file or segment.suffix != ".ndjson":
+            return False
+
+        target = segment.with_name(segment.name + ".gz")
+        temp = segment.with_name(segment.name + ".gz.tmp")
+        try:
+            with open(segment, 'rb') as source, gzip.open(temp, 'wb') as f:
+                while True:
+                    block = source.read(1024 * 1024)
+                    if not block:
+                        break
+                    f.write(block)
+            os.replace(temp, target)
+            os.remove(segment)
+            return True
+        except Exception as e:
+            print(f"Error compressing event log segment {segment}: {e}")
+            if temp.exists():
+                os.remove(temp)
+            return False
+
+    def segments(self) -> List[Path]:
+        """
+        Get every segment of the log, oldest first
+
+        Returns:
+            List of segment paths (archived segments, compressed or not,
+            then the live one)
+        """
+        archived = {}
+        if self.archive_dir.exists():
+            for segment in self.archive_dir.glob("*.ndjson*"):
+                if segment.name.endswith(".ndjson"):
+                    # A compressed copy left by an interrupted compress() wins
+                    archived.setdefault(_first_seq(segment), segment)
+                elif segment.name.endswith(".ndjson.gz"):
+                    archived[_first_seq(segment)] = segment
+
+        segments = [archived[first_seq] for first_seq in sorted(archived)]
+        if self.log_file.exists():
+            segments.append(self.log_file)
+        return segments
+
+    def iter_events(self, after_seq: int = 0, event_type: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the full history of the log
+
+        Args:
+            after_seq: Only yield events with a greater sequence number
+            event_type: Only yield events of this type
+
+        Yields:
+            Events in sequence order
+        """
+        for segment in self.segments():
+            for event in self._read_segment(segment, after_seq):
+                if event_type is None or event.get("type") == event_type:
+                    yield event
+
+    def iter_events_reverse(self, before_seq: Optional[int] = None,
+                            event_type: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the history of the log, newest first
+
+        Only the segments that can hold older events are read, so paging
+        through the history with before_seq reads one segment per page.
+
+        Args:
+            before_seq: Only yield events with a smaller sequence number
+            event_type: Only yield events of this type
+
+        Yields:
+            Events in reverse sequence order
+        """
+        for segment in reversed(self.segments()):
+            # Archived segments are named after their first sequence number
+            if before_seq is not None and segment != self.log_file and _first_seq(segment) >= before_seq:
+                continue
+
+            for event in reversed(list(self._read_segment(segment))):
+                if before_seq is not None and event.get("seq", 0) >= before_seq:
+                    continue
+                if event_type is None or event.get("type") == event_type:
+                    yield event
+
+    @staticmethod
+    def _read_segment(path: Path, after_seq: int = 0) -> Iterator[Dict[str, Any]]:
+        """
+        Read the events of one segment
+
+        Args:
+            path: Path of the segment
+            after_seq: Only yield events with a greater sequence number
+
+        Yields:
+            Events in file order
+        """
+        if not path.exists():
+            return
+
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json_codec.loads(line)
+                except ValueError:
+                    # A torn write leaves a partial last line, skip it
+                    continue
+                if event.get("seq", 0) > after_seq:
+                    yield event
+
+
+def _first_seq(segment: Path) -> int:
+    """Sequence number an archived segment is named after"""
+    return int(segment.name.split(".", 1)[0])
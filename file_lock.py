@@ -0,0 +1,55 @@
+"""
+Blocking inter-process locks on lock files under data/
+
+The lock is held on an open file (flock on POSIX, msvcrt on Windows), so it
+also excludes the other threads of the process, and the system releases it
+if the process dies while holding it.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """
+    Hold an exclusive lock on a file, waiting until it is free
+
+    Args:
+        path: Path of the lock file (created if needed, never removed)
+
+    Yields:
+        Nothing; the lock is released when the block exits
+    """
+    os.makedirs(Path(path).parent, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            # LK_LOCK gives up after about 10 seconds, keep waiting
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
@@ -0,0 +1,185 @@
+"""
+Streaming export of flashcard sets
+
+An export is produced as a sequence of text blocks, card by card, so a
+response can send a large deck without building the whole payload in
+memory. Formats:
+
+- "json": the set name, subject and description with a "cards" array
+- "jsonl": one card per line
+- "csv": one card per row, written with the csv module
+- "anki": tab-separated text with the header lines of Anki's text import
+
+The blocks can be gzip-compressed on the fly with gzip_stream.
+"""
+
+import csv
+import io
+import itertools
+import json
+import zlib
+from typing import Dict, List, Any, Optional, Iterable, Iterator
+
+# Fields a card export can include
+EXPORT_FIELDS = ("id", "question", "answer", "tags", "image_url", "audio_url", "created_at", "learning_data")
+
+# Fields exported when none are chosen
+DEFAULT_FIELDS = ("question", "answer", "tags", "image_url", "audio_url")
+
+# Content type of each format
+MIMETYPES = {
+    "json": "application/json",
+    "jsonl": "application/x-ndjson",
+    "csv": "text/csv",
+    "anki": "text/plain"
+}
+
+# File extension of each format
+EXTENSIONS = {"json": "json", "jsonl": "jsonl", "csv": "csv", "anki": "txt"}
+
+# Size of the text blocks yielded (characters)
+BLOCK_SIZE = 64 * 1024
+
+
+def parse_fields(value: Optional[str]) -> List[str]:
+    """
+    Read the fields of an export from a comma-separated list
+
+    Args:
+        value: Comma-separated field names (None or empty for the defaults)
+
+    Returns:
+        List of field names
+
+    Raises:
+        ValueError: If a field is unknown
+    """
+    if not value:
+        return list(DEFAULT_FIELDS)
+
+    fields = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in fields if name not in EXPORT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown export fields: {', '.join(unknown)}")
+    return fields
+
+
+def _select(card: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """Keep the chosen fields of a card"""
+    return {name: card.get(name, [] if name == "tags" else None) for name in fields}
+
+
+def _blocks(parts: Iterable[str]) -> Iterator[str]:
+    """Group small strings into blocks of about BLOCK_SIZE characters"""
+    block = []
+    size = 0
+    for part in parts:
+        block.append(part)
+        size += len(part)
+        if size >= BLOCK_SIZE:
+            yield "".join(block)
+            block = []
+            size = 0
+    if block:
+        yield "".join(block)
+
+
+def _json_parts(set_data: Dict[str, Any], fields: List[str]) -> Iterator[str]:
+    """Write a set as one JSON document, card by card"""
+    header = {key: set_data.get(key, "") for key in ("name", "subject", "description")}
+    yield json.dumps(header, ensure_ascii=False)[:-1] + ', "cards": ['
+    for i, card in enumerate(set_data.get("cards", [])):
+        yield ("," if i else "") + "\n" + json.dumps(_select(card, fields), ensure_ascii=False)
+    yield "\n]}\n"
+
+
+def _jsonl_parts(set_data: Dict[str, Any], fields: List[str]) -> Iterator[str]:
+    """Write the cards of a set as JSON lines"""
+    for card in set_data.get("cards", []):
+        yield json.dumps(_select(card, fields), ensure_ascii=False) + "\n"
+
+
+def _csv_value(value: Any) -> str:
+    """Write a card field as a CSV cell"""
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ";".join(str(item) for item in value)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def _rows(rows: Iterable[List[str]], **options) -> Iterator[str]:
+    """Write rows with the csv module, one line at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, **options)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _csv_parts(set_data: Dict[str, Any], fields: List[str]) -> Iterator[str]:
+    """Write the cards of a set as CSV with a header row"""
+    rows = ([_csv_value(card.get(name)) for name in fields] for card in set_data.get("cards", []))
+    yield from _rows(itertools.chain([[name.capitalize() for name in fields]], rows))
+
+
+def _anki_parts(set_data: Dict[str, Any], fields: List[str]) -> Iterator[str]:
+    """Write the cards of a set in Anki's tab-separated text import format"""
+    yield "#separator:tab\n#html:false\n#tags column:3\n"
+    rows = ([card.get("question", ""), card.get("answer", ""),
+             " ".join(tag.replace(" ", "_") for tag in card.get("tags", []))]
+            for card in set_data.get("cards", []))
+    yield from _rows(rows, delimiter="\t", lineterminator="\n")
+
+
+_WRITERS = {
+    "json": _json_parts,
+    "jsonl": _jsonl_parts,
+    "csv": _csv_parts,
+    "anki": _anki_parts
+}
+
+
+def iter_export(set_data: Dict[str, Any], export_format: str = "json",
+                fields: Optional[List[str]] = None) -> Iterator[str]:
+    """
+    Export a set as a stream of text blocks
+
+    Args:
+        set_data: The set data
+        export_format: "json", "jsonl", "csv" or "anki"
+        fields: Card fields to export (defaults to DEFAULT_FIELDS; the anki
+            format always has question, answer and tags)
+
+    Returns:
+        Iterator over the blocks of the export
+
+    Raises:
+        ValueError: If the format is unknown
+    """
+    writer = _WRITERS.get(export_format)
+    if writer is None:
+        raise ValueError(f"Unknown export format: {export_format}")
+    return _blocks(writer(set_data, list(fields or DEFAULT_FIELDS)))
+
+
+def gzip_stream(blocks: Iterable[str]) -> Iterator[bytes]:
+    """
+    Compress a stream of text blocks with gzip as it is produced
+
+    Args:
+        blocks: The text blocks
+
+    Yields:
+        The compressed bytes
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for block in blocks:
+        data = compressor.compress(block.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,629 @@
+"""
+Streaming import of flashcards from CSV, JSON and Anki files
+
+Uploaded files are read incrementally: CSV rows, JSON objects (JSON lines,
+one top-level array or the array of a {"cards": [...]} document) and the
+notes of an Anki .apkg package (a zip holding an SQLite collection) are
+parsed one at a time, validated, checked against the cards already in the
+set by a hash of their content, and added to the set in chunks of
+CHUNK_SIZE cards. Chunks grow with the set (up to as many cards as it
+already holds), so the set file is rewritten a logarithmic number of times
+and the bytes written stay linear in its size. The set stays loaded between
+chunks and is read again only if it was edited meanwhile. Besides the set
+itself, the memory used by an import does not depend on the size of the
+file.
+
+Imports run in a background thread; their progress is kept in memory and
+read with get_import.
+"""
+
+import codecs
+import csv
+import hashlib
+import html
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import uuid
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Iterator, Tuple, Callable
+from flashcard_system import FlashcardManager
+
+# Supported formats, by file extension
+FORMATS = {".csv": "csv", ".tsv": "csv", ".txt": "csv", ".json": "json", ".jsonl": "json",
+           ".ndjson": "json", ".apkg": "apkg"}
+
+# Number of cards added to the set per save
+CHUNK_SIZE = int(os.environ.get('FIREFLIES_IMPORT_CHUNK_SIZE', '1000'))
+
+# Longest question or answer accepted (characters)
+MAX_FIELD_LENGTH = 10000
+
+# Validation errors kept per import (the others are only counted)
+MAX_ERRORS = 20
+
+# Finished imports whose progress is kept
+IMPORTS_LIMIT = 100
+
+# Size of the blocks read from JSON files
+READ_SIZE = 64 * 1024
+
+# Largest JSON value (one card or one line) buffered while streaming (bytes)
+MAX_VALUE_SIZE = 1024 * 1024
+
+# Key of the cards array of a {"cards": [...]} document
+_CARDS_KEY = re.compile(rb'"cards"\s*:\s*\[')
+
+_imports: "OrderedDict[str, ImportJob]" = OrderedDict()
+_imports_lock = threading.Lock()
+
+
+def detect_format(filename: str) -> Optional[str]:
+    """
+    Get the import format of a file from its extension
+
+    Args:
+        filename: Name of the uploaded file
+
+    Returns:
+        "csv", "json" or "apkg", or None if the extension is not supported
+    """
+    return FORMATS.get(Path(filename or "").suffix.lower())
+
+
+def content_hash(question: str, answer: str) -> str:
+    """
+    Hash the content of a card, ignoring case and spacing
+
+    Args:
+        question: The question text
+        answer: The answer text
+
+    Returns:
+        Hex digest identifying the content
+    """
+    normalized = "\x1f".join(" ".join(text.split()).casefold() for text in (question, answer))
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _split_tags(value: Any) -> List[str]:
+    """Read tags given as a list or as a string separated by ; or , (or else spaces)"""
+    if isinstance(value, list):
+        return [str(tag).strip() for tag in value if str(tag).strip()]
+    value = str(value or "")
+    separator = r"[;,]" if ";" in value or "," in value else r"\s+"
+    return [tag.strip() for tag in re.split(separator, value) if tag.strip()]
+
+
+def validate(row: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Check a parsed row and turn it into card data
+
+    Args:
+        row: Parsed row with question, answer and optional tags, image_url
+            and audio_url
+
+    Returns:
+        Tuple of (card data, None) or (None, error message)
+    """
+    if not isinstance(row, dict):
+        return None, "not an object"
+
+    question = row.get("question")
+    answer = row.get("answer")
+    if not isinstance(question, str) or not isinstance(answer, str):
+        return None, "question and answer must be text"
+
+    question = question.strip()
+    answer = answer.strip()
+    if not question or not answer:
+        return None, "empty question or answer"
+    if len(question) > MAX_FIELD_LENGTH or len(answer) > MAX_FIELD_LENGTH:
+        return None, f"question or answer longer than {MAX_FIELD_LENGTH} characters"
+
+    return {
+        "question": question,
+        "answer": answer,
+        "tags": _split_tags(row.get("tags")),
+        "image_url": row.get("image_url") or None,
+        "audio_url": row.get("audio_url") or None
+    }, None
+
+
+def iter_csv(stream: io.BufferedReader, on_error: Callable[[str], None]) -> Iterator[Dict[str, Any]]:
+    """
+    Parse the rows of a CSV file one at a time
+
+    The first row is a header if it names a question and an answer column;
+    otherwise the columns are question, answer and tags. Tab-separated
+    files are detected. Rows the csv module cannot read (a cell over
+    csv.field_size_limit, for instance) are passed to on_error and skipped.
+
+    Args:
+        stream: The file opened in binary mode
+        on_error: Called with the error of each unreadable row
+
+    Yields:
+        Dicts with question, answer and tags (and any other header column)
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+    first_line = text.readline()
+    delimiter = "\t" if first_line.count("\t") > first_line.count(",") else ","
+
+    reader = _csv_rows(csv.reader(_chain_line(first_line, text), delimiter=delimiter), on_error)
+    header = next(reader, None)
+    if header is None:
+        return
+
+    columns = [name.strip().lower() for name in header]
+    if "question" in columns and "answer" in columns:
+        for values in reader:
+            yield dict(zip(columns, values))
+        return
+
+    for values in itertools.chain([header], reader):
+        yield {"question": values[0] if values else None,
+               "answer": values[1] if len(values) > 1 else None,
+               "tags": values[2] if len(values) > 2 else ""}
+
+
+def _csv_rows(reader: Iterator[List[str]], on_error: Callable[[str], None]) -> Iterator[List[str]]:
+    """Rows of a csv reader, reporting the unreadable ones instead of raising"""
+    while True:
+        try:
+            values = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            on_error(f"invalid CSV row ({e})")
+            continue
+        yield values
+
+
+def _chain_line(first_line: str, text: io.TextIOWrapper) -> Iterator[str]:
+    """Iterate the lines of a text stream after giving back its first line"""
+    yield first_line
+    yield from text
+
+
+def iter_json(stream: io.BufferedReader, on_error: Optional[Callable[[str], None]] = None) -> Iterator[Any]:
+    """
+    Parse the objects of a JSON file one at a time
+
+    Accepts JSON lines (one object per line), decoded line by line, a
+    top-level array of objects and a {"cards": [...]} document (the "json"
+    export format), whose array is decoded block by block. A malformed line
+    is passed to on_error and skipped.
+
+    Args:
+        stream: The file opened in binary mode
+        on_error: Called with the error of each skipped line
+
+    Yields:
+        The decoded objects
+
+    Raises:
+        ValueError: If an array is malformed or holds a value larger than
+            MAX_VALUE_SIZE
+    """
+    on_error = on_error or (lambda error: None)
+    first_line = stream.readline(MAX_VALUE_SIZE + 1)
+    text = first_line.decode("utf-8-sig", errors="replace").strip()
+    while not text and first_line:
+        first_line = stream.readline(MAX_VALUE_SIZE + 1)
+        text = first_line.decode("utf-8-sig", errors="replace").strip()
+
+    if text.startswith("["):
+        yield from _iter_json_array(stream, first_line)
+        return
+
+    try:
+        value = json.loads(text) if text else None
+    except json.JSONDecodeError as e:
+        # Not a complete line: a document spread over several lines, or a bad line
+        start = stream.tell()
+        cards = _find_cards_array(stream, first_line) if text.startswith("{") else None
+        if cards is not None:
+            yield from _iter_json_array(stream, cards)
+            return
+        stream.seek(start)
+        on_error(f"invalid JSON ({e.msg})")
+    else:
+        if text:
+            yield from _cards_of(value)
+
+    yield from _iter_json_lines(stream, on_error)
+
+
+def _find_cards_array(stream: io.BufferedReader, head: bytes) -> Optional[bytes]:
+    """
+    Read a {"cards": [...]} document up to its cards array
+
+    Only the first MAX_VALUE_SIZE bytes are searched.
+
+    Args:
+        stream: The file, positioned after head
+        head: The bytes already read from the start of the document
+
+    Returns:
+        The bytes read from the opening bracket of the array on, or None if
+        the document has no cards array
+    """
+    while True:
+        match = _CARDS_KEY.search(head)
+        if match:
+            return head[match.end() - 1:]
+        block = stream.read(READ_SIZE)
+        if not block or len(head) > MAX_VALUE_SIZE:
+            return None
+        head += block
+
+
+def _cards_of(value: Any) -> Iterator[Any]:
+    """Yield the cards of a {"cards": [...]} document, or the value itself"""
+    if isinstance(value, dict) and isinstance(value.get("cards"), list):
+        yield from value["cards"]
+    else:
+        yield value
+
+
+def _iter_json_lines(stream: io.BufferedReader, on_error: Callable[[str], None]) -> Iterator[Any]:
+    """Decode JSON lines one at a time, skipping the malformed ones"""
+    for line in iter(lambda: stream.readline(MAX_VALUE_SIZE + 1), b""):
+        if len(line) > MAX_VALUE_SIZE and not line.endswith(b"\n"):
+            # Skip the rest of an overlong line without buffering it
+            while not line.endswith(b"\n") and line:
+                line = stream.readline(MAX_VALUE_SIZE)
+            on_error(f"line longer than {MAX_VALUE_SIZE} bytes")
+            continue
+
+        text = line.decode("utf-8-sig", errors="replace").strip()
+        if not text:
+            continue
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError as e:
+            on_error(f"invalid JSON ({e.msg})")
+            continue
+        yield from _cards_of(value)
+
+
+def _iter_json_array(stream: io.BufferedReader, first_block: bytes) -> Iterator[Any]:
+    """
+    Decode the values of a JSON array block by block
+
+    Args:
+        stream: The file, positioned after first_block
+        first_block: The bytes read so far, starting with the opening bracket
+            (leading whitespace allowed)
+
+    Yields:
+        The values of the array; whatever follows its closing bracket is ignored
+    """
+    decoder = json.JSONDecoder()
+    reader = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buffer = reader.decode(first_block)
+    position = buffer.index("[") + 1
+    eof = False
+
+    while True:
+        # Skip the separators between values
+        while position < len(buffer) and (buffer[position].isspace() or buffer[position] == ","):
+            position += 1
+
+        if position < len(buffer):
+            if buffer[position] == "]":
+                return
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f"Malformed JSON array: {e.msg}")
+                if len(buffer) - position > MAX_VALUE_SIZE:
+                    raise ValueError(f"Malformed JSON array or value larger than {MAX_VALUE_SIZE} bytes")
+            else:
+                # A value ending the block may be cut (a number), read more first
+                if end < len(buffer) or eof:
+                    position = end
+                    yield value
+                    continue
+        elif eof:
+            raise ValueError("Malformed JSON array: missing closing bracket")
+
+        block = stream.read(READ_SIZE)
+        eof = not block
+        buffer = buffer[position:] + reader.decode(block, final=eof)
+        position = 0
+
+
+def _strip_html(text: str) -> str:
+    """Turn the HTML of an Anki field into plain text"""
+    text = re.sub(r"<br\s*/?>|</div>|</p>", "\n", text, flags=re.IGNORECASE)
+    text = re.sub(r"<[^>]+>|\[sound:[^\]]*\]", "", text)
+    return html.unescape(text).strip()
+
+
+def count_apkg_notes(path: Path) -> int:
+    """Number of notes in an Anki collection extracted from a package"""
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+        return conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+
+def iter_apkg(collection: Path) -> Iterator[Dict[str, Any]]:
+    """
+    Read the notes of an Anki collection one at a time
+
+    The first field of a note is the question and the second the answer.
+
+    Args:
+        collection: The SQLite collection extracted from the .apkg package
+
+    Yields:
+        Dicts with question, answer and tags
+    """
+    conn = sqlite3.connect(f"file:{collection}?mode=ro", uri=True)
+    try:
+        for fields, tags in conn.execute("SELECT flds, tags FROM notes ORDER BY id"):
+            values = fields.split("\x1f")
+            yield {
+                "question": _strip_html(values[0]),
+                "answer": _strip_html(values[1]) if len(values) > 1 else "",
+                "tags": tags.split()
+            }
+    finally:
+        conn.close()
+
+
+def extract_apkg(path: Path, directory: Path) -> Path:
+    """
+    Extract the SQLite collection of an Anki package
+
+    Args:
+        path: The .apkg file
+        directory: Directory to extract the collection to
+
+    Returns:
+        Path of the extracted collection
+
+    Raises:
+        ValueError: If the package has no readable collection
+    """
+    with zipfile.ZipFile(path) as package:
+        names = package.namelist()
+        name = next((n for n in ("collection.anki21", "collection.anki2") if n in names), None)
+        if name is None:
+            raise ValueError("No Anki collection in the package (only .anki2/.anki21 collections are supported)")
+
+        collection = directory / name
+        with package.open(name) as source, open(collection, "wb") as target:
+            shutil.copyfileobj(source, target)
+    return collection
+
+
+class ImportJob:
+    """Progress of one import"""
+
+    def __init__(self, username: str, filename: str, file_format: str, total: int):
+        """
+        Initialize the progress of an import
+
+        Args:
+            username: The user importing
+            filename: Name of the uploaded file
+            file_format: "csv", "json" or "apkg"
+            total: Size of the file in bytes
+        """
+        self.id = uuid.uuid4().hex
+        self.username = username
+        self.filename = filename
+        self.format = file_format
+        self.status = "running"
+        self.message = ""
+        self.set_id = None
+        self.total = total
+        self.done = 0
+        self.rows = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors: List[str] = []
+
+    def reject(self, error: str) -> None:
+        """Count an invalid row"""
+        self.invalid += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(f"Row {self.rows}: {error}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Get the progress as a dict
+
+        Returns:
+            Dict with the status, counters and progress (0-100)
+        """
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "format": self.format,
+            "status": self.status,
+            "message": self.message,
+            "set_id": self.set_id,
+            "progress": 100 if self.status != "running" else min(99, self.done * 100 // self.total) if self.total else 0,
+            "rows": self.rows,
+            "imported": self.imported,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "errors": list(self.errors)
+        }
+
+
+def _file_state(path: Path) -> Optional[Tuple[int, int]]:
+    """Modification time and size of a file, None if it does not exist"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def run_import(manager: FlashcardManager, path: Path, job: ImportJob, set_id: Optional[str] = None,
+               set_name: str = "", subject: str = "", description: str = "") -> Dict[str, Any]:
+    """
+    Import a file into a set, committing chunks of at least CHUNK_SIZE cards
+
+    Args:
+        manager: FlashcardManager of the user
+        path: The file to import
+        job: Progress of the import (updated as rows are read)
+        set_id: Set to add the cards to (a new set is created if None)
+        set_name: Name of the new set (defaults to the file name)
+        subject: Subject of the new set
+        description: Description of the new set
+
+    Returns:
+        The progress of the finished import
+    """
+    if set_id:
+        set_data = manager.get_set(set_id)
+        if not set_data:
+            job.status = "failed"
+            job.message = "Flashcard set not found"
+            return job.to_dict()
+    else:
+        set_data = manager.create_set(set_name or Path(job.filename).stem or "Import", subject, description)
+    job.set_id = set_data["id"]
+
+    seen = {content_hash(card.get("question", ""), card.get("answer", "")) for card in set_data.get("cards", [])}
+
+    def reject_line(error: str) -> None:
+        job.rows += 1
+        job.reject(error)
+
+    set_file = manager.user_dir / f"{job.set_id}.json"
+    saved = _file_state(set_file)
+
+    def commit(chunk: List[Dict[str, Any]]) -> None:
+        nonlocal set_data, saved
+        # Read the set again only if it was edited since the last chunk
+        if _file_state(set_file) != saved:
+            set_data = manager.get_set(job.set_id)
+            if not set_data:
+                raise ValueError("The flashcard set was deleted during the import")
+        job.imported += len(manager.extend_set(set_data, chunk))
+        saved = _file_state(set_file)
+
+    try:
+        chunk = []
+        with tempfile.TemporaryDirectory() as directory, open(path, "rb") as stream:
+            if job.format == "apkg":
+                collection = extract_apkg(path, Path(directory))
+                job.total = count_apkg_notes(collection)
+                rows = iter_apkg(collection)
+            elif job.format == "csv":
+                rows = iter_csv(stream, on_error=reject_line)
+            else:
+                rows = iter_json(stream, on_error=reject_line)
+
+            for row in rows:
+                job.rows += 1
+                job.done = job.rows if job.format == "apkg" else stream.tell()
+
+                card_data, error = validate(row)
+                if error:
+                    job.reject(error)
+                    continue
+
+                digest = content_hash(card_data["question"], card_data["answer"])
+                if digest in seen:
+                    job.duplicates += 1
+                    continue
+                seen.add(digest)
+
+                chunk.append(card_data)
+                if len(chunk) >= max(CHUNK_SIZE, len(set_data.get("cards", []))):
+                    commit(chunk)
+                    chunk = []
+
+        if chunk:
+            commit(chunk)
+    except Exception as e:
+        print(f"Error importing flashcards from {job.filename}: {e}")
+        job.status = "failed"
+        job.message = str(e)
+        # Do not leave an empty set behind
+        if not set_id and not job.imported:
+            manager.delete_set(job.set_id)
+            job.set_id = None
+        return job.to_dict()
+
+    job.status = "completed"
+    job.message = f"{job.imported} cards imported"
+    return job.to_dict()
+
+
+def start_import(username: str, path: Path, filename: str, file_format: str, **options) -> Dict[str, Any]:
+    """
+    Import an uploaded file in a background thread
+
+    The file is deleted once the import is over.
+
+    Args:
+        username: The user importing
+        path: The uploaded file, saved to disk
+        filename: Original name of the file
+        file_format: "csv", "json" or "apkg"
+        **options: set_id, set_name, subject and description (see run_import)
+
+    Returns:
+        The initial progress of the import, with its id
+    """
+    job = ImportJob(username, filename, file_format, os.path.getsize(path))
+    with _imports_lock:
+        _imports[job.id] = job
+        while len(_imports) > IMPORTS_LIMIT:
+            oldest = next((key for key, value in _imports.items() if value.status != "running"), None)
+            if oldest is None:
+                break
+            del _imports[oldest]
+
+    def run():
+        try:
+            run_import(FlashcardManager(username), Path(path), job, **options)
+        except Exception as e:
+            print(f"Error importing flashcards from {filename}: {e}")
+            job.status = "failed"
+            job.message = str(e)
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    threading.Thread(target=run, name=f"flashcard-import-{job.id}", daemon=True).start()
+    return job.to_dict()
+
+
+def get_import(username: str, import_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the progress of an import
+
+    Args:
+        username: The user who started the import
+        import_id: Id returned by start_import
+
+    Returns:
+        The progress of the import, or None if it is unknown
+    """
+    with _imports_lock:
+        job = _imports.get(import_id)
+    if job is None or job.username != username:
+        return None
+    return job.to_dict()
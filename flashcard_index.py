@@ -0,0 +1,411 @@
+"""
+Flashcard index for the flashcard system
+
+Each user has a small SQLite database next to their set files holding the
+manifest of their sets (name, subject, card count, mastery and update time)
+and the due index of their cards: one (next review, set id, card id) row per
+card, ordered by a B-tree index on the review time. Both are written with
+every set save, so listing pages and review queues read index rows instead
+of parsing every card and its review history; the next k due cards, in one
+set or across all sets, cost O(k log n).
+"""
+
+import datetime
+import os
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Iterator, Iterable
+
+# Version of the tables, the index is rebuilt when it changes
+INDEX_VERSION = 3
+
+# Interval (days) from which a card counts as mastered
+MASTERY_INTERVAL = 7
+
+
+def review_timestamp(card: Dict[str, Any]) -> float:
+    """
+    Get the next review time of a card
+
+    Args:
+        card: The card
+
+    Returns:
+        POSIX timestamp of the next review (0 if the card is due now)
+    """
+    try:
+        return datetime.datetime.fromisoformat(card["learning_data"]["next_review"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        # Cards without valid learning data are due
+        return 0.0
+
+
+def _timestamp(value: Optional[str]) -> Optional[float]:
+    """Convert an ISO date to a POSIX timestamp (None if missing or invalid)"""
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def summarize_set(set_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the manifest row of a set
+
+    Args:
+        set_data: The full set data
+
+    Returns:
+        Dict with the set metadata
+    """
+    cards = set_data.get("cards", [])
+    mastered = sum(1 for card in cards
+                   if card.get("learning_data", {}).get("interval", 0) >= MASTERY_INTERVAL)
+
+    return {
+        "id": set_data.get("id"),
+        "name": set_data.get("name") or "",
+        "subject": set_data.get("subject") or "",
+        "description": set_data.get("description") or "",
+        "card_count": len(cards),
+        "mastery": round((mastered / len(cards)) * 100) if cards else 0,
+        "created_at": set_data.get("created_at"),
+        "updated_at": set_data.get("updated_at")
+    }
+
+
+class FlashcardIndex:
+    """SQLite manifest of the flashcard sets of a user"""
+
+    _COLUMNS = ("id", "name", "subject", "description", "card_count",
+                "mastery", "created_at", "updated_at")
+
+    _UPSERT_SET = f"""
+        INSERT OR REPLACE INTO sets ({", ".join(_COLUMNS)})
+        VALUES ({", ".join("?" for _ in _COLUMNS)})
+    """
+
+    def __init__(self, db_path: Path):
+        """
+        Initialize the flashcard index
+
+        Args:
+            db_path: Path of the SQLite database
+        """
+        self.db_path = Path(db_path)
+        os.makedirs(self.db_path.parent, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if version is None or int(version[0]) != INDEX_VERSION:
+                conn.execute("DROP TABLE IF EXISTS sets")
+                conn.execute("DROP TABLE IF EXISTS cards")
+                conn.execute("DELETE FROM meta")
+                conn.execute("INSERT INTO meta (key, value) VALUES ('version', ?)", (str(INDEX_VERSION),))
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sets (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL DEFAULT '',
+                    subject TEXT NOT NULL DEFAULT '',
+                    description TEXT NOT NULL DEFAULT '',
+                    card_count INTEGER NOT NULL DEFAULT 0,
+                    mastery INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT,
+                    updated_at TEXT
+                )
+            """)
+            # Next review time (POSIX timestamp) of every card
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cards (
+                    set_id TEXT NOT NULL,
+                    card_id TEXT NOT NULL,
+                    due REAL NOT NULL,
+                    reviews INTEGER NOT NULL DEFAULT 0,
+                    first_review REAL,
+                    last_review REAL,
+                    PRIMARY KEY (set_id, card_id)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS cards_due ON cards (due, set_id, card_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cards_set_due ON cards (set_id, due)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cards_last_review ON cards (last_review)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a short-lived connection committed and closed on exit"""
+        conn = sqlite3.connect(str(self.db_path), timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def is_built(self) -> bool:
+        """
+        Check if the index was filled from the existing set files
+
+        Returns:
+            True if the index is complete
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'built'").fetchone()
+        return row is not None
+
+    def rebuild(self, sets: Iterable[Dict[str, Any]]) -> None:
+        """
+        Replace the content of the index
+
+        Args:
+            sets: Full data of every set of the user
+        """
+        sets = list(sets)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sets")
+            conn.execute("DELETE FROM cards")
+            conn.executemany(self._UPSERT_SET, [self._row(summarize_set(s)) for s in sets])
+            conn.executemany(self._UPSERT_CARD, [row for s in sets for row in self._card_rows(s)])
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', ?)",
+                         (datetime.datetime.now().isoformat(),))
+
+    def _row(self, summary: Dict[str, Any]) -> tuple:
+        """Convert a manifest row to the parameters of _UPSERT_SET"""
+        return tuple(summary.get(column) for column in self._COLUMNS)
+
+    _UPSERT_CARD = """
+        INSERT OR REPLACE INTO cards (set_id, card_id, due, reviews, first_review, last_review)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+
+    @staticmethod
+    def _card_row(set_id: str, card: Dict[str, Any]) -> tuple:
+        """Get the due index row of a card"""
+        learning_data = card.get("learning_data") or {}
+        history = learning_data.get("history") or []
+        first_review = (learning_data.get("history_summary") or {}).get("first_review") or \
+            (history[0].get("date") if history else learning_data.get("last_review"))
+        return (set_id, card["id"], review_timestamp(card), learning_data.get("reviews", 0),
+                _timestamp(first_review), _timestamp(learning_data.get("last_review")))
+
+    @classmethod
+    def _card_rows(cls, set_data: Dict[str, Any]) -> List[tuple]:
+        """Get the due index rows of the cards of a set"""
+        return [cls._card_row(set_data.get("id"), card)
+                for card in set_data.get("cards", []) if card.get("id")]
+
+    def update_set(self, set_data: Dict[str, Any],
+                   changed_cards: Optional[Iterable[Dict[str, Any]]] = None,
+                   removed_cards: Iterable[str] = ()) -> Dict[str, Any]:
+        """
+        Insert or update the manifest row and the due index of a set
+
+        Args:
+            set_data: The full set data
+            changed_cards: Cards added or reviewed since the last save (None
+                replaces the due rows of every card of the set)
+            removed_cards: IDs of the cards deleted since the last save
+
+        Returns:
+            The manifest row
+        """
+        summary = summarize_set(set_data)
+        set_id = set_data.get("id")
+
+        with self._connect() as conn:
+            conn.execute(self._UPSERT_SET, self._row(summary))
+            if changed_cards is None:
+                conn.execute("DELETE FROM cards WHERE set_id = ?", (set_id,))
+                rows = self._card_rows(set_data)
+            else:
+                rows = [self._card_row(set_id, card) for card in changed_cards]
+            conn.executemany("DELETE FROM cards WHERE set_id = ? AND card_id = ?",
+                             [(set_id, card_id) for card_id in removed_cards])
+            conn.executemany(self._UPSERT_CARD, rows)
+        return summary
+
+    def remove_set(self, set_id: str) -> None:
+        """
+        Remove the manifest row and the due index of a set
+
+        Args:
+            set_id: The ID of the set
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sets WHERE id = ?", (set_id,))
+            conn.execute("DELETE FROM cards WHERE set_id = ?", (set_id,))
+
+    def list_sets(self, subject: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Get the manifest rows, most recently updated first
+
+        Args:
+            subject: Only return the sets of this subject
+
+        Returns:
+            List of manifest rows
+        """
+        now = datetime.datetime.now().timestamp()
+        query = """
+            SELECT sets.*, (SELECT COUNT(*) FROM cards WHERE cards.set_id = sets.id AND cards.due <= ?) AS due_count
+            FROM sets
+        """
+        params = (now,)
+        if subject is not None:
+            query += " WHERE subject = ?"
+            params += (subject,)
+        query += " ORDER BY updated_at DESC"
+
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def due_cards(self, limit: Optional[int] = None, set_id: Optional[str] = None,
+                  subject: Optional[str] = None, until: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Get the cards due for review, most overdue first
+
+        Args:
+            limit: Maximum number of cards (None for all)
+            set_id: Only return the cards of this set
+            subject: Only return the cards of the sets of this subject
+            until: POSIX timestamp the cards are due by (defaults to now)
+
+        Returns:
+            List of dicts with set_id, card_id and due (POSIX timestamp)
+        """
+        until = until if until is not None else datetime.datetime.now().timestamp()
+        query = "SELECT cards.set_id, cards.card_id, cards.due FROM cards"
+        conditions = ["cards.due <= ?"]
+        params = [until]
+        if subject is not None:
+            query += " JOIN sets ON sets.id = cards.set_id"
+            conditions.append("sets.subject = ?")
+            params.append(subject)
+        if set_id is not None:
+            conditions.append("cards.set_id = ?")
+            params.append(set_id)
+        query += " WHERE " + " AND ".join(conditions) + " ORDER BY cards.due, cards.set_id, cards.card_id"
+        if limit is not None and limit > 0:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def due_count(self, set_id: Optional[str] = None, until: Optional[float] = None) -> int:
+        """
+        Count the cards due for review
+
+        Args:
+            set_id: Only count the cards of this set
+            until: POSIX timestamp the cards are due by (defaults to now)
+
+        Returns:
+            Number of due cards
+        """
+        until = until if until is not None else datetime.datetime.now().timestamp()
+        query = "SELECT COUNT(*) FROM cards WHERE due <= ?"
+        params = [until]
+        if set_id is not None:
+            query += " AND set_id = ?"
+            params.append(set_id)
+
+        with self._connect() as conn:
+            return conn.execute(query, params).fetchone()[0]
+
+    def due_histogram(self, boundaries: List[float], set_id: Optional[str] = None) -> Dict[str, List[int]]:
+        """
+        Count the cards falling due in consecutive periods, per set
+
+        A card counts in the first period whose end is after its due time,
+        so cards already overdue count in the first period.
+
+        Args:
+            boundaries: POSIX timestamps of the end of each period, increasing
+            set_id: Only count the cards of this set
+
+        Returns:
+            Dict mapping set_id to the number of cards due in each period
+        """
+        if not boundaries:
+            return {}
+
+        bucket = "CASE " + " ".join(f"WHEN due < ? THEN {i}" for i in range(len(boundaries))) + " END"
+        query = f"SELECT set_id, {bucket} AS bucket, COUNT(*) FROM cards WHERE due < ?"
+        params = list(boundaries) + [boundaries[-1]]
+        if set_id is not None:
+            query += " AND set_id = ?"
+            params.append(set_id)
+        query += " GROUP BY set_id, bucket"
+
+        histogram: Dict[str, List[int]] = {}
+        with self._connect() as conn:
+            for row_set_id, index, count in conn.execute(query, params):
+                histogram.setdefault(row_set_id, [0] * len(boundaries))[index] = count
+        return histogram
+
+    def subjects(self) -> List[str]:
+        """
+        Get the distinct subjects of the sets
+
+        Returns:
+            Sorted list of subjects
+        """
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT DISTINCT subject FROM sets WHERE subject != '' ORDER BY subject")]
+
+    def reviewed_since(self, since: float) -> Dict[str, int]:
+        """
+        Count the cards reviewed since a time
+
+        Args:
+            since: POSIX timestamp (usually the start of the day)
+
+        Returns:
+            Dict with the number of new cards (first reviewed since then) and
+            of review cards (reviewed again since then)
+        """
+        with self._connect() as conn:
+            row = conn.execute("""
+                SELECT COALESCE(SUM(first_review >= ?), 0) AS new,
+                       COALESCE(SUM(first_review < ? AND last_review >= ?), 0) AS review
+                FROM cards WHERE last_review >= ?
+            """, (since, since, since, since)).fetchone()
+        return {"new": row["new"], "review": row["review"]}
+
+    def review_queue(self, review_limit: int, new_limit: int, subject: Optional[str] = None,
+                     until: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Get the cards of a review session across sets, most urgent first
+
+        Args:
+            review_limit: Maximum number of cards already studied
+            new_limit: Maximum number of cards never studied
+            subject: Only return the cards of the sets of this subject
+            until: POSIX timestamp the cards are due by (defaults to now)
+
+        Returns:
+            List of dicts with set_id, card_id, due and new, ordered by due time
+        """
+        until = until if until is not None else datetime.datetime.now().timestamp()
+        query = "SELECT cards.set_id, cards.card_id, cards.due, cards.reviews = 0 AS new FROM cards"
+        if subject is not None:
+            query += " JOIN sets ON sets.id = cards.set_id AND sets.subject = :subject"
+        query += """
+            WHERE cards.due <= :until AND (cards.reviews = 0) = :new
+            ORDER BY cards.due, cards.set_id, cards.card_id LIMIT :limit
+        """
+
+        queue = []
+        with self._connect() as conn:
+            for new, limit in ((0, review_limit), (1, new_limit)):
+                if limit > 0:
+                    queue.extend(dict(row) for row in conn.execute(
+                        query, {"subject": subject, "until": until, "new": new, "limit": limit}))
+
+        queue.sort(key=lambda entry: (entry["due"], entry["set_id"], entry["card_id"]))
+        return queue
@@ -5,10 +5,15 @@ Enhanced Flashcard System with Spaced Repetition
 import json
 import datetime
 import os
-import math
 import random
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Tuple, Iterator, Iterable
+import json_codec
+from file_lock import file_lock
+from flashcard_index import FlashcardIndex
+from ids import new_id, is_id
+import flashcard_export
+from schedulers import SM2Scheduler, FSRSScheduler, get_scheduler
 
 # Path for flashcard data
 BASE_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
@@ -16,6 +21,35 @@ FLASHCARDS_DIR = BASE_DIR / 'data' / 'flashcards'
 os.makedirs(FLASHCARDS_DIR, exist_ok=True)
 print(f"Flashcards directory: {FLASHCARDS_DIR}")
 
+# Default daily limits of the cross-set review session
+DAILY_NEW_LIMIT = 20
+DAILY_REVIEW_LIMIT = 200
+
+# Longest review forecast (days)
+MAX_FORECAST_DAYS = 365
+
+# Quality (0-5) of each quiz rating (0=failed, 1=hard, 2=good, 3=easy)
+RATING_QUALITY = {0: 0, 1: 3, 2: 4, 3: 5}
+
+def load_legacy_ids(username: str) -> Dict[str, str]:
+    """
+    Get the ids the sets of a user had before the id migration
+    
+    Args:
+        username: The username of the user
+        
+    Returns:
+        Dict mapping old set ids to new set ids (empty if none were migrated)
+    """
+    legacy_ids_file = FLASHCARDS_DIR / username / "legacy_ids"
+    if not legacy_ids_file.exists():
+        return {}
+    try:
+        return json_codec.load(legacy_ids_file)
+    except Exception as e:
+        print(f"Error loading legacy flashcard ids: {e}")
+        return {}
+
 class SpacedRepetitionSystem:
     """
     Implements the SuperMemo-2 algorithm for spaced repetition
@@ -37,25 +71,7 @@ class SpacedRepetitionSystem:
         Returns:
             Tuple of (new_interval, new_ease_factor)
         """
-        if quality < 3:
-            # If response was incorrect, reset interval to 1
-            return 1, max(1.3, ease_factor - 0.2)
-        
-        # If first time or incorrect last time
-        if interval == 0:
-            new_interval = 1
-        elif interval == 1:
-            new_interval = 6
-        else:
-            new_interval = math.ceil(interval * ease_factor)
-            
-        # Adjust ease factor based on quality
-        new_ease_factor = ease_factor + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
-        
-        # Keep ease factor within reasonable bounds
-        new_ease_factor = max(1.3, min(new_ease_factor, 2.5))
-        
-        return new_interval, new_ease_factor
+        return SM2Scheduler.next_review(ease_factor, interval, quality)
 
 class FlashcardManager:
     """Class to manage flashcards with spaced repetition"""
@@ -80,6 +96,17 @@ class FlashcardManager:
             print(f"Error creating user directory: {e}")
             import traceback
             traceback.print_exc()
+
+        self.index = FlashcardIndex(self.user_dir / "index.db")
+        # Position of every card in set_data["cards"], by set and card id
+        self._card_positions: Dict[str, Dict[str, int]] = {}
+        # Old set ids mapped to their new ids (not *.json, so it is not read as a set)
+        self.legacy_ids_file = self.user_dir / "legacy_ids"
+        self._legacy_ids = None
+        if not self.legacy_ids_file.exists():
+            self.migrate_ids()
+        elif not self.index.is_built():
+            self.index.rebuild(set_data for _, set_data in self._iter_set_files())
         
     def create_set(self, name: str, subject: str, description: str = "") -> Dict[str, Any]:
         """
@@ -94,7 +121,7 @@ class FlashcardManager:
             Dict containing the created set information
         """
         # Generate a unique ID
-        set_id = f"{int(datetime.datetime.now().timestamp())}"
+        set_id = new_id()
         
         # Create the set data
         set_data = {
@@ -130,7 +157,7 @@ class FlashcardManager:
         """
         # Ensure the set has an ID
         if "id" not in set_data:
-            set_data["id"] = f"{int(datetime.datetime.now().timestamp())}"
+            set_data["id"] = new_id()
         
         # Ensure created_at and updated_at are present
         if "created_at" not in set_data:
@@ -139,7 +166,8 @@ class FlashcardManager:
         if "updated_at" not in set_data:
             set_data["updated_at"] = datetime.datetime.now().isoformat()
         
-        # Ensure stats are present
+        # Ensure stats are present (the ease sum is computed again from the cards)
+        set_data.get("stats", {}).pop("ease_count", None)
         if "stats" not in set_data:
             set_data["stats"] = {
                 "total_reviews": 0,
@@ -165,6 +193,11 @@ class FlashcardManager:
         """
         set_file = self.user_dir / f"{set_id}.json"
         
+        # Links made before the id migration use the old set id
+        if not set_file.exists() and not is_id(set_id):
+            set_id = self.legacy_ids().get(set_id, set_id)
+            set_file = self.user_dir / f"{set_id}.json"
+        
         print(f"Looking for flashcard set at: {set_file}")
         print(f"User directory: {self.user_dir}")
         print(f"Set ID: {set_id}")
@@ -174,10 +207,10 @@ class FlashcardManager:
             return None
         
         try:
-            with open(set_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                print(f"Successfully loaded flashcard set: {set_id}")
-                return data
+            data = json_codec.load(set_file)
+            self._index_cards(set_id, data)
+            print(f"Successfully loaded flashcard set: {set_id}")
+            return data
         except Exception as e:
             print(f"Error loading flashcard set: {e}")
             # Print more detailed error information
@@ -185,56 +218,136 @@ class FlashcardManager:
             traceback.print_exc()
             return None
     
-    def get_all_sets(self) -> Dict[str, Dict[str, Any]]:
+    def legacy_ids(self) -> Dict[str, str]:
         """
-        Get all flashcard sets for the user
+        Get the ids the sets had before the id migration
         
         Returns:
-            Dict mapping set_id to set data
+            Dict mapping old set ids to new set ids
         """
-        sets = {}
+        if self._legacy_ids is None:
+            self._legacy_ids = load_legacy_ids(self.username)
+        return self._legacy_ids
+    
+    def migrate_ids(self) -> Dict[str, str]:
+        """
+        Give every set and card made before sortable ids a new id (run once)
         
-        for set_file in self.user_dir.glob("*.json"):
+        The new ids encode the creation date of the set or card, so they sort
+        like the records they replace. Set files are renamed; the old set ids
+        are kept in legacy_ids so earlier links still resolve.
+        
+        Only one migration runs at a time: the others wait for its result.
+        
+        Returns:
+            Dict mapping old set ids to new set ids
+        """
+        # The lock is released by the system if the process dies midway
+        with file_lock(self.user_dir / "legacy_ids.lock"):
+            if self.legacy_ids_file.exists():
+                # Migrated by another request while this one waited
+                self._legacy_ids = None
+                return self.legacy_ids()
+            return self._migrate_ids()
+    
+    def _migrate_ids(self) -> Dict[str, str]:
+        """Migrate the ids of the sets and cards (see migrate_ids)"""
+        legacy_ids = self.legacy_ids()
+        
+        for set_file, set_data in list(self._iter_set_files()):
+            old_id = set_data.get("id") or set_file.stem
             try:
-                with open(set_file, 'r', encoding='utf-8') as f:
-                    set_data = json.load(f)
-                    # Add card count for convenience
-                    set_data["card_count"] = len(set_data.get("cards", []))
-                    sets[set_data.get("id")] = set_data
+                changed = False
+                for card in set_data.get("cards", []):
+                    if not is_id(card.get("id")):
+                        card["id"] = new_id(self._created_at(card))
+                        changed = True
+                
+                if not is_id(old_id):
+                    set_data["id"] = new_id(self._created_at(set_data))
+                    new_file = self.user_dir / f"{set_data['id']}.json"
+                    # Rename first, so a concurrent migration cannot copy the set twice
+                    os.rename(set_file, new_file)
+                    set_file = new_file
+                    legacy_ids[old_id] = set_data["id"]
+                    changed = True
+                
+                if changed:
+                    json_codec.dump(set_data, set_file)
             except Exception as e:
-                print(f"Error loading flashcard set {set_file}: {e}")
+                print(f"Error migrating flashcard set {old_id}: {e}")
         
-        return sets
+        try:
+            json_codec.dump(legacy_ids, self.legacy_ids_file)
+        except Exception as e:
+            print(f"Error saving legacy flashcard ids: {e}")
         
-    def get_all_sets_list(self) -> List[Dict[str, Any]]:
+        self._card_positions.clear()
+        self.index.rebuild(set_data for _, set_data in self._iter_set_files())
+        return legacy_ids
+    
+    @staticmethod
+    def _created_at(record: Dict[str, Any]) -> Optional[datetime.datetime]:
+        """Get the creation time of a set or card, if it is readable"""
+        try:
+            return datetime.datetime.fromisoformat(record["created_at"])
+        except (KeyError, TypeError, ValueError):
+            return None
+    
+    def _iter_set_files(self) -> Iterator[Tuple[Path, Dict[str, Any]]]:
         """
-        Get all flashcard sets for the user as a sorted list
+        Load every set file of the user
+
+        Yields:
+            Tuples of (set file, set data)
+        """
+        for set_file in self.user_dir.glob("*.json"):
+            try:
+                yield set_file, json_codec.load(set_file)
+            except Exception as e:
+                print(f"Error loading flashcard set {set_file}: {e}")
+
+    def get_all_sets(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get all flashcard sets for the user, with every card
+
+        Listing pages should use get_set_summaries, which does not load the
+        set files.
         
         Returns:
-            List of dicts containing set data, sorted by most recently updated
+            Dict mapping set_id to set data
         """
-        sets_dict = self.get_all_sets()
-        sets_list = list(sets_dict.values())
+        sets = {}
         
-        # Sort by most recently updated
-        return sorted(sets_list, key=lambda x: x.get("updated_at", ""), reverse=True)
+        for _, set_data in self._iter_set_files():
+            # Add card count for convenience
+            set_data["card_count"] = len(set_data.get("cards", []))
+            sets[set_data.get("id")] = set_data
         
-    def get_subjects(self) -> List[str]:
+        return sets
+
+    def get_set_summaries(self, subject: Optional[str] = None) -> List[Dict[str, Any]]:
         """
-        Get a list of all unique subjects used in flashcard sets
-        
+        Get the metadata of the user's sets from the manifest
+
+        Args:
+            subject: Only return the sets of this subject
+
         Returns:
-            List of unique subject names
+            List of dicts with id, name, subject, description, card_count,
+            due_count, mastery, created_at and updated_at, most recently
+            updated first
         """
-        sets_dict = self.get_all_sets()
-        subjects = set()
+        return self.index.list_sets(subject)
         
-        for set_data in sets_dict.values():
-            subject = set_data.get("subject")
-            if subject:
-                subjects.add(subject)
+    def get_all_sets_list(self) -> List[Dict[str, Any]]:
+        """
+        Get all flashcard sets for the user as a sorted list
         
-        return sorted(list(subjects))
+        Returns:
+            List of set metadata (see get_set_summaries), sorted by most recently updated
+        """
+        return self.get_set_summaries()
     
     def update_set(self, set_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """
@@ -257,6 +370,10 @@ class FlashcardManager:
             if key != "id" and key != "created_at":  # Don't allow changing ID or creation date
                 set_data[key] = value
         
+        # Replaced cards get their ease sum computed again
+        if "cards" in data:
+            set_data.get("stats", {}).pop("ease_count", None)
+        
         # Update the updated_at timestamp
         set_data["updated_at"] = datetime.datetime.now().isoformat()
         
@@ -275,6 +392,7 @@ class FlashcardManager:
         Returns:
             bool: True if deleted, False if not found
         """
+        set_id = self.legacy_ids().get(set_id, set_id)
         set_file = self.user_dir / f"{set_id}.json"
         
         if not set_file.exists():
@@ -282,6 +400,7 @@ class FlashcardManager:
         
         try:
             os.remove(set_file)
+            self.index.remove_set(set_id)
             return True
         except Exception as e:
             print(f"Error deleting flashcard set: {e}")
@@ -311,7 +430,7 @@ class FlashcardManager:
         
         # Create the card
         card = {
-            "id": f"card_{len(set_data.get('cards', []))}_" + str(int(datetime.datetime.now().timestamp())),
+            "id": new_id(),
             "question": question,
             "answer": answer,
             "created_at": datetime.datetime.now().isoformat(),
@@ -332,13 +451,15 @@ class FlashcardManager:
         if "cards" not in set_data:
             set_data["cards"] = []
         
+        self._add_ease(set_data, [card])
         set_data["cards"].append(card)
+        self._card_positions.setdefault(set_id, {})[card["id"]] = len(set_data["cards"]) - 1
         
         # Update the updated_at timestamp
         set_data["updated_at"] = datetime.datetime.now().isoformat()
         
         # Save the updated set
-        self._save_set(set_id, set_data)
+        self._save_set(set_id, set_data, changed_cards=[card])
         
         return set_data
     
@@ -360,25 +481,23 @@ class FlashcardManager:
             return None
         
         # Find the card
-        for i, card in enumerate(set_data["cards"]):
-            if card.get("id") == card_id:
-                # Update fields
-                for key, value in data.items():
-                    if key != "id" and key != "created_at":  # Don't allow changing ID or creation date
-                        card[key] = value
-                
-                # Update the card in the set
-                set_data["cards"][i] = card
-                
-                # Update the updated_at timestamp
-                set_data["updated_at"] = datetime.datetime.now().isoformat()
-                
-                # Save the updated set
-                self._save_set(set_id, set_data)
-                
-                return set_data
+        i = self._find_card(set_id, set_data, card_id)
+        if i is None:
+            return None
         
-        return None
+        # Update fields
+        card = set_data["cards"][i]
+        for key, value in data.items():
+            if key != "id" and key != "created_at":  # Don't allow changing ID or creation date
+                card[key] = value
+        
+        # Update the updated_at timestamp
+        set_data["updated_at"] = datetime.datetime.now().isoformat()
+        
+        # Save the updated set
+        self._save_set(set_id, set_data, changed_cards=[card])
+        
+        return set_data
     
     def delete_card(self, set_id: str, card_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -397,23 +516,24 @@ class FlashcardManager:
             return None
         
         # Find and remove the card
-        for i, card in enumerate(set_data["cards"]):
-            if card.get("id") == card_id:
-                set_data["cards"].pop(i)
-                
-                # Update the updated_at timestamp
-                set_data["updated_at"] = datetime.datetime.now().isoformat()
-                
-                # Save the updated set
-                self._save_set(set_id, set_data)
-                
-                return set_data
+        i = self._find_card(set_id, set_data, card_id)
+        if i is None:
+            return None
+        
+        self._add_ease(set_data, [set_data["cards"][i]], sign=-1)
+        self._remove_card_at(set_id, set_data, i)
+        
+        # Update the updated_at timestamp
+        set_data["updated_at"] = datetime.datetime.now().isoformat()
         
-        return None
+        # Save the updated set
+        self._save_set(set_id, set_data, removed_cards=[card_id])
+        
+        return set_data
     
     def get_due_cards(self, set_id: str, limit: int = None) -> List[Dict[str, Any]]:
         """
-        Get cards that are due for review
+        Get cards that are due for review, most overdue first
         
         Args:
             set_id: The ID of the set
@@ -422,32 +542,136 @@ class FlashcardManager:
         Returns:
             List of cards due for review
         """
+        # The due index gives the ids; only this set's file is loaded for the cards
+        due = self.index.due_cards(limit=limit, set_id=set_id)
+        if not due:
+            return []
+        
         set_data = self.get_set(set_id)
         
         if not set_data or "cards" not in set_data:
             return []
         
-        now = datetime.datetime.now()
-        due_cards = []
-        
-        for card in set_data["cards"]:
-            if "learning_data" in card and "next_review" in card["learning_data"]:
-                try:
-                    next_review = datetime.datetime.fromisoformat(card["learning_data"]["next_review"])
-                    if next_review <= now:
-                        due_cards.append(card)
-                except (ValueError, TypeError):
-                    # If there's an error parsing the date, consider the card due
-                    due_cards.append(card)
-            else:
-                # If learning data is not initialized, consider the card due
-                due_cards.append(card)
+        cards_by_id = {card.get("id"): card for card in set_data["cards"]}
+        return [cards_by_id[entry["card_id"]] for entry in due if entry["card_id"] in cards_by_id]
+    
+    def get_review_session(self, subject: Optional[str] = None, cursor: Optional[str] = None,
+                           page_size: int = 20, new_limit: int = DAILY_NEW_LIMIT,
+                           review_limit: int = DAILY_REVIEW_LIMIT) -> Dict[str, Any]:
+        """
+        Get a page of the cards due today across all sets, most urgent first
+
+        The session is built from the due index: new and review cards are
+        capped by what is left of today's limits, merged by due time, and
+        only the sets of the cards on the page are loaded.
+        
+        Args:
+            subject: Only review the sets of this subject
+            cursor: Cursor returned with the previous page
+            page_size: Number of cards per page
+            new_limit: Cards never studied allowed per day
+            review_limit: Cards already studied allowed per day
+            
+        Returns:
+            Dict with the cards of the page (each with its set_id, set_name
+            and subject), the cursor of the next page (None on the last
+            page) and the number of cards left after this page
+        """
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time()).timestamp()
+        done = self.index.reviewed_since(today)
+        queue = self.index.review_queue(max(0, review_limit - done["review"]),
+                                        max(0, new_limit - done["new"]), subject=subject)
+        
+        # Reviewed cards leave the queue, so the cursor is a position, not an offset
+        if cursor:
+            due, set_id, card_id = cursor.split("|", 2)
+            after = (float(due), set_id, card_id)
+            queue = [entry for entry in queue if (entry["due"], entry["set_id"], entry["card_id"]) > after]
+        page = queue[:max(1, page_size)]
+        
+        # Load each set of the page once
+        sets = {}
+        cards = []
+        for entry in page:
+            if entry["set_id"] not in sets:
+                set_data = self.get_set(entry["set_id"]) or {}
+                sets[entry["set_id"]] = (set_data, {card.get("id"): card for card in set_data.get("cards", [])})
+            set_data, cards_by_id = sets[entry["set_id"]]
+            card = cards_by_id.get(entry["card_id"])
+            if card:
+                cards.append(dict(card, set_id=entry["set_id"], set_name=set_data.get("name", ""),
+                                  subject=set_data.get("subject", ""), new=bool(entry["new"])))
+        
+        last = page[-1] if page else None
+        return {
+            "cards": cards,
+            "next_cursor": f"{last['due']!r}|{last['set_id']}|{last['card_id']}" if last and len(queue) > len(page) else None,
+            "remaining": len(queue) - len(page),
+            "new_done": done["new"],
+            "review_done": done["review"]
+        }
+    
+    def get_forecast(self, days: int = 30, set_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Forecast the number of reviews due on each of the next days
         
-        # Limit the number of cards if requested
-        if limit is not None and limit > 0:
-            due_cards = due_cards[:limit]
+        Read from the due index only; cards already overdue count today.
         
-        return due_cards
+        Args:
+            days: Number of days to forecast, today included (1-365)
+            set_id: Only forecast the cards of this set
+            
+        Returns:
+            Dict with the dates ("days"), the total per day ("total") and
+            the counts per day of each set with reviews ("sets": list of
+            dicts with id, name, subject and counts)
+        """
+        days = max(1, min(days, MAX_FORECAST_DAYS))
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        dates = [today + datetime.timedelta(days=i) for i in range(days)]
+        histogram = self.index.due_histogram(
+            [(date + datetime.timedelta(days=1)).timestamp() for date in dates], set_id
+        )
+        
+        summaries = {summary["id"]: summary for summary in self.get_set_summaries()}
+        sets = []
+        for histogram_set_id, counts in histogram.items():
+            summary = summaries.get(histogram_set_id, {})
+            sets.append({
+                "id": histogram_set_id,
+                "name": summary.get("name", ""),
+                "subject": summary.get("subject", ""),
+                "counts": counts
+            })
+        sets.sort(key=lambda item: (-sum(item["counts"]), item["name"]))
+        
+        return {
+            "days": [date.date().isoformat() for date in dates],
+            "total": [sum(counts) for counts in zip(*histogram.values())] if histogram else [0] * days,
+            "sets": sets
+        }
+    
+    def rate_card(self, set_id: str, card_id: str, rating: int) -> Dict[str, Any]:
+        """
+        Record a quiz rating for a card
+        
+        Args:
+            set_id: The ID of the set
+            card_id: The ID of the card
+            rating: The rating (0=failed, 1=hard, 2=good, 3=easy)
+            
+        Returns:
+            Dict with success, and the reviewed card or an error message
+        """
+        if rating not in RATING_QUALITY:
+            return {"success": False, "message": f"Invalid rating: {rating}"}
+        
+        set_data = self.record_review(set_id, card_id, RATING_QUALITY[rating])
+        
+        if not set_data:
+            return {"success": False, "message": "Card not found"}
+        
+        return {"success": True, "card": set_data["cards"][self._find_card(set_id, set_data, card_id)]}
     
     def record_review(self, set_id: str, card_id: str, quality: int) -> Optional[Dict[str, Any]]:
         """
@@ -464,100 +688,284 @@ class FlashcardManager:
         Returns:
             Dict containing the updated set data or None if not found
         """
+        result = self.record_reviews(set_id, [(card_id, quality, None)])
+        
+        if not result or not result["reviewed"]:
+            return None
+        
+        return result["set"]
+    
+    def record_reviews(self, set_id: str, reviews: List[Tuple[str, int, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Record the reviews of a whole quiz with one load and one save of the set
+        
+        Args:
+            set_id: The ID of the set
+            reviews: Tuples of (card_id, quality 0-5, review time as a datetime,
+                an ISO string or None for now), applied in order
+            
+        Returns:
+            Dict with the updated set data ("set"), the reviewed cards
+            ("reviewed") and the ids of the cards not found ("missing"), or
+            None if the set was not found
+        """
         set_data = self.get_set(set_id)
         
         if not set_data or "cards" not in set_data:
             return None
         
-        # Find the card
-        for i, card in enumerate(set_data["cards"]):
-            if card.get("id") == card_id:
-                # Initialize learning data if it doesn't exist
-                if "learning_data" not in card:
-                    card["learning_data"] = {
-                        "ease_factor": 2.5,
-                        "interval": 0,
-                        "reviews": 0,
-                        "last_review": None,
-                        "next_review": datetime.datetime.now().isoformat(),
-                        "history": []
-                    }
-                
-                # Get current learning data
+        stats = self._set_stats(set_data)
+        scheduler = get_scheduler(set_data.get("scheduler"), set_data.get("retention"))
+        reviewed = {}
+        missing = []
+        
+        for card_id, quality, reviewed_at in reviews:
+            i = self._find_card(set_id, set_data, card_id)
+            if i is None:
+                missing.append(card_id)
+                continue
+            card = set_data["cards"][i]
+            
+            if isinstance(reviewed_at, str):
+                reviewed_at = datetime.datetime.fromisoformat(reviewed_at.replace("Z", "+00:00"))
+            if reviewed_at is not None and reviewed_at.tzinfo is not None:
+                # Learning data holds server-local naive times
+                reviewed_at = reviewed_at.astimezone().replace(tzinfo=None)
+            now = reviewed_at or datetime.datetime.now()
+            
+            # Initialize learning data if it doesn't exist
+            if "learning_data" not in card:
+                card["learning_data"] = {
+                    "interval": 0,
+                    "reviews": 0,
+                    "last_review": None,
+                    "next_review": now.isoformat(),
+                    "history": []
+                }
+            
+            # Get current learning data
+            learning_data = card["learning_data"]
+            if "ease_factor" not in learning_data:
+                # The card enters the running ease sum with the default ease
+                learning_data["ease_factor"] = 2.5
+                stats["ease_sum"] += 2.5
+                stats["ease_count"] += 1
+            ease_factor = learning_data["ease_factor"]
+            
+            # Calculate new interval (and the scheduler's own fields)
+            new_interval = scheduler.review(learning_data, quality, now)
+            new_ease_factor = learning_data["ease_factor"]
+            
+            # Update learning data
+            next_review = now + datetime.timedelta(days=new_interval)
+            
+            learning_data["reviews"] = learning_data.get("reviews", 0) + 1
+            learning_data["last_review"] = now.isoformat()
+            learning_data["next_review"] = next_review.isoformat()
+            
+            # Add to history
+            history = learning_data.setdefault("history", [])
+            history.append({
+                "date": now.isoformat(),
+                "quality": quality,
+                "ease_factor": new_ease_factor,
+                "interval": new_interval
+            })
+            
+            # Limit history to last 100 entries
+            if len(history) > 100:
+                del history[:-100]
+            
+            # Update set stats (the average ease is kept as a running sum)
+            stats["total_reviews"] = stats.get("total_reviews", 0) + 1
+            
+            if quality >= 3:
+                stats["correct_reviews"] = stats.get("correct_reviews", 0) + 1
+            else:
+                stats["incorrect_reviews"] = stats.get("incorrect_reviews", 0) + 1
+            
+            stats["ease_sum"] += new_ease_factor - ease_factor
+            reviewed[card_id] = card
+        
+        if reviewed:
+            if stats["ease_count"]:
+                stats["average_ease"] = stats["ease_sum"] / stats["ease_count"]
+            
+            # Update the updated_at timestamp
+            set_data["updated_at"] = datetime.datetime.now().isoformat()
+            
+            # Save the updated set
+            self._save_set(set_id, set_data, changed_cards=list(reviewed.values()))
+        
+        return {"set": set_data, "reviewed": list(reviewed.values()), "missing": missing}
+    
+    def set_scheduler(self, set_id: str, name: str, retention: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Choose the scheduler of a set and reschedule its reviewed cards
+        
+        With the FSRS scheduler the next review of every reviewed card is
+        computed again from its memory state (derived from the SM-2 state for
+        cards never reviewed with FSRS), in one batch over the whole set.
+        
+        Args:
+            set_id: The ID of the set
+            name: Name of the scheduler ("sm2" or "fsrs")
+            retention: Desired retention for FSRS (0-1, defaults to 0.9)
+            
+        Returns:
+            Dict containing the updated set data or None if not found
+            
+        Raises:
+            ValueError: If the scheduler or the retention is invalid
+        """
+        scheduler = get_scheduler(name, retention)
+        set_data = self.get_set(set_id)
+        
+        if not set_data:
+            return None
+        
+        set_data["scheduler"] = name
+        if retention is not None:
+            set_data["retention"] = retention
+        else:
+            set_data.pop("retention", None)
+        
+        changed = []
+        if isinstance(scheduler, FSRSScheduler):
+            cards = []
+            stabilities = []
+            for card in set_data.get("cards", []):
+                learning_data = card.get("learning_data", {})
+                stability, difficulty = scheduler.seed(learning_data)
+                if stability is None or not learning_data.get("last_review"):
+                    continue
+                learning_data["stability"] = stability
+                learning_data["difficulty"] = difficulty
+                cards.append(card)
+                stabilities.append(stability)
+            
+            for card, interval in zip(cards, scheduler.intervals(stabilities)):
                 learning_data = card["learning_data"]
-                ease_factor = learning_data.get("ease_factor", 2.5)
-                interval = learning_data.get("interval", 0)
-                
-                # Calculate new interval and ease factor
-                new_interval, new_ease_factor = SpacedRepetitionSystem.calculate_next_review(
-                    ease_factor, interval, quality
-                )
-                
-                # Update learning data
-                now = datetime.datetime.now()
-                next_review = now + datetime.timedelta(days=new_interval)
-                
-                learning_data["ease_factor"] = new_ease_factor
-                learning_data["interval"] = new_interval
-                learning_data["reviews"] = learning_data.get("reviews", 0) + 1
-                learning_data["last_review"] = now.isoformat()
-                learning_data["next_review"] = next_review.isoformat()
-                
-                # Add to history
-                if "history" not in learning_data:
-                    learning_data["history"] = []
-                
-                learning_data["history"].append({
-                    "date": now.isoformat(),
-                    "quality": quality,
-                    "ease_factor": new_ease_factor,
-                    "interval": new_interval
-                })
-                
-                # Limit history to last 100 entries
-                if len(learning_data["history"]) > 100:
-                    learning_data["history"] = learning_data["history"][-100:]
-                
-                # Update card in set
-                card["learning_data"] = learning_data
-                set_data["cards"][i] = card
-                
-                # Update set stats
-                if "stats" not in set_data:
-                    set_data["stats"] = {
-                        "total_reviews": 0,
-                        "correct_reviews": 0,
-                        "incorrect_reviews": 0,
-                        "average_ease": 2.5
-                    }
-                
-                set_data["stats"]["total_reviews"] = set_data["stats"].get("total_reviews", 0) + 1
-                
-                if quality >= 3:
-                    set_data["stats"]["correct_reviews"] = set_data["stats"].get("correct_reviews", 0) + 1
-                else:
-                    set_data["stats"]["incorrect_reviews"] = set_data["stats"].get("incorrect_reviews", 0) + 1
-                
-                # Calculate average ease factor
-                total_ease = 0
-                card_count = 0
-                for card in set_data["cards"]:
-                    if "learning_data" in card and "ease_factor" in card["learning_data"]:
-                        total_ease += card["learning_data"]["ease_factor"]
-                        card_count += 1
-                
-                if card_count > 0:
-                    set_data["stats"]["average_ease"] = total_ease / card_count
-                
-                # Update the updated_at timestamp
-                set_data["updated_at"] = datetime.datetime.now().isoformat()
-                
-                # Save the updated set
-                self._save_set(set_id, set_data)
-                
-                return set_data
+                last_review = datetime.datetime.fromisoformat(learning_data["last_review"])
+                learning_data["interval"] = int(interval)
+                learning_data["next_review"] = (last_review + datetime.timedelta(days=int(interval))).isoformat()
+            changed = cards
+        
+        # Update the updated_at timestamp
+        set_data["updated_at"] = datetime.datetime.now().isoformat()
+        
+        # Save the updated set
+        self._save_set(set_id, set_data, changed_cards=changed)
+        
+        return set_data
+    
+    def _index_cards(self, set_id: str, set_data: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Build the map from card id to position in set_data["cards"]
+        
+        Args:
+            set_id: The ID of the set
+            set_data: The set data
+            
+        Returns:
+            Dict mapping card_id to its index in the cards list
+        """
+        positions = {card.get("id"): i for i, card in enumerate(set_data.get("cards", []))}
+        self._card_positions[set_id] = positions
+        return positions
+    
+    def _find_card(self, set_id: str, set_data: Dict[str, Any], card_id: str) -> Optional[int]:
+        """
+        Find the position of a card in O(1) with the map built at load
+        
+        The map is built again if the cards list was replaced since.
         
-        return None
+        Args:
+            set_id: The ID of the set
+            set_data: The set data
+            card_id: The ID of the card
+            
+        Returns:
+            Index of the card in set_data["cards"] or None if not found
+        """
+        cards = set_data.get("cards", [])
+        positions = self._card_positions.get(set_id)
+        if positions is None:
+            positions = self._index_cards(set_id, set_data)
+        
+        i = positions.get(card_id)
+        if i is None and len(positions) == len(cards):
+            return None
+        if i is None or i >= len(cards) or cards[i].get("id") != card_id:
+            i = self._index_cards(set_id, set_data).get(card_id)
+        return i
+    
+    def _remove_card_at(self, set_id: str, set_data: Dict[str, Any], i: int) -> Dict[str, Any]:
+        """
+        Remove a card, keeping the order of the deck
+        
+        Only the positions of the cards after it are updated.
+        
+        Args:
+            set_id: The ID of the set
+            set_data: The set data (updated in place)
+            i: Index of the card to remove
+            
+        Returns:
+            The removed card
+        """
+        cards = set_data["cards"]
+        positions = self._card_positions.setdefault(set_id, {})
+        card = cards.pop(i)
+        positions.pop(card.get("id"), None)
+        for j in range(i, len(cards)):
+            positions[cards[j].get("id")] = j
+        return card
+    
+    def _add_ease(self, set_data: Dict[str, Any], cards: List[Dict[str, Any]], sign: int = 1) -> None:
+        """
+        Add (or with sign=-1 remove) cards to the running ease sum of a set
+        
+        Call it before the cards are added to or removed from set_data["cards"].
+        
+        Args:
+            set_data: The set data (updated in place)
+            cards: The cards added or removed
+            sign: 1 for added cards, -1 for removed cards
+        """
+        stats = self._set_stats(set_data)
+        for card in cards:
+            if "ease_factor" in card.get("learning_data", {}):
+                stats["ease_sum"] += sign * card["learning_data"]["ease_factor"]
+                stats["ease_count"] += sign
+        stats["average_ease"] = stats["ease_sum"] / stats["ease_count"] if stats["ease_count"] else 2.5
+    
+    def _set_stats(self, set_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Get the stats of a set, with the running sum of the card ease factors
+        
+        Sets saved before the running sum existed get it computed once here.
+        
+        Args:
+            set_data: The set data (updated in place)
+            
+        Returns:
+            The stats dict of the set
+        """
+        stats = set_data.setdefault("stats", {
+            "total_reviews": 0,
+            "correct_reviews": 0,
+            "incorrect_reviews": 0,
+            "average_ease": 2.5
+        })
+        
+        if "ease_count" not in stats:
+            eases = [card["learning_data"]["ease_factor"] for card in set_data.get("cards", [])
+                     if "ease_factor" in card.get("learning_data", {})]
+            stats["ease_sum"] = sum(eases)
+            stats["ease_count"] = len(eases)
+        
+        return stats
     
     def import_cards(self, set_id: str, cards_data: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
         """
@@ -575,16 +983,43 @@ class FlashcardManager:
         if not set_data:
             return None
         
+        self.extend_set(set_data, cards_data)
+        
+        return set_data
+    
+    def extend_set(self, set_data: Dict[str, Any], cards_data: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Add new cards to a loaded set and save it
+        
+        Used by the importers to commit a chunk of cards at a time, the set
+        staying loaded between chunks.
+        
+        Args:
+            set_data: The set data (updated in place)
+            cards_data: Card data dictionaries; those without question and
+                answer fields are skipped
+            
+        Returns:
+            List of the cards added
+            
+        Raises:
+            OSError: If the set could not be saved
+        """
+        set_id = set_data["id"]
+        
         # Initialize cards list if it doesn't exist
         if "cards" not in set_data:
             set_data["cards"] = []
         
         # Add each card
+        self._set_stats(set_data)
+        positions = self._card_positions.setdefault(set_id, {})
+        imported = []
         for card_data in cards_data:
             if "question" in card_data and "answer" in card_data:
                 # Create the card
                 card = {
-                    "id": f"card_{len(set_data['cards'])}_" + str(int(datetime.datetime.now().timestamp())),
+                    "id": new_id(),
                     "question": card_data["question"],
                     "answer": card_data["answer"],
                     "created_at": datetime.datetime.now().isoformat(),
@@ -602,22 +1037,30 @@ class FlashcardManager:
                 }
                 
                 set_data["cards"].append(card)
+                positions[card["id"]] = len(set_data["cards"]) - 1
+                imported.append(card)
+        
+        self._add_ease(set_data, imported)
         
         # Update the updated_at timestamp
         set_data["updated_at"] = datetime.datetime.now().isoformat()
         
         # Save the updated set
-        self._save_set(set_id, set_data)
+        if not self._save_set(set_id, set_data, changed_cards=imported):
+            raise OSError(f"Could not save flashcard set {set_id}")
         
-        return set_data
+        return imported
     
     def export_cards(self, set_id: str, format: str = "json") -> Optional[str]:
         """
         Export cards from a flashcard set
         
+        Responses should stream flashcard_export.iter_export instead, which
+        this joins into one string.
+        
         Args:
             set_id: The ID of the set
-            format: The export format ("json" or "csv")
+            format: The export format ("json", "jsonl", "csv" or "anki")
             
         Returns:
             String containing the exported data or None if not found
@@ -627,57 +1070,11 @@ class FlashcardManager:
         if not set_data or "cards" not in set_data:
             return None
         
-        if format.lower() == "json":
-            # Export as JSON
-            export_data = {
-                "name": set_data.get("name", ""),
-                "subject": set_data.get("subject", ""),
-                "description": set_data.get("description", ""),
-                "cards": []
-            }
-            
-            for card in set_data["cards"]:
-                export_data["cards"].append({
-                    "question": card.get("question", ""),
-                    "answer": card.get("answer", ""),
-                    "image_url": card.get("image_url"),
-                    "audio_url": card.get("audio_url"),
-                    "tags": card.get("tags", [])
-                })
-            
-            return json.dumps(export_data, indent=2)
-        
-        elif format.lower() == "csv":
-            # Export as CSV
-            csv_lines = ["Question,Answer,Tags"]
-            
-            for card in set_data["cards"]:
-                question = card.get("question", "").replace('"', '""').replace(',', '","')
-                answer = card.get("answer", "").replace('"', '""').replace(',', '","')
-                tags = ",".join(card.get("tags", []))
-                
-                csv_lines.append(f'"{question}","{answer}","{tags}"')
-            
-            return "\n".join(csv_lines)
-        
-        return None
-    
-    def _save_set(self, set_id: str, data: Dict[str, Any]) -> None:
-        """
-        Save a flashcard set to file
-        
-        Args:
-            set_id: The ID of the set
-            data: The set data to save
-        """
-        set_file = self.user_dir / f"{set_id}.json"
-        
         try:
-            with open(set_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, default=str)
-        except Exception as e:
-            print(f"Error saving flashcard set: {e}")
-            
+            return "".join(flashcard_export.iter_export(set_data, format.lower()))
+        except ValueError:
+            return None
+    
     def get_card(self, set_id: str, card_id: str) -> Optional[Dict[str, Any]]:
         """
         Get a specific card from a flashcard set
@@ -695,11 +1092,8 @@ class FlashcardManager:
             return None
         
         # Find the card
-        for card in set_data.get("cards", []):
-            if card.get("id") == card_id:
-                return card
-        
-        return None
+        i = self._find_card(set_id, set_data, card_id)
+        return set_data["cards"][i] if i is not None else None
         
     def get_cards(self, set_id: str) -> List[Dict[str, Any]]:
         """
@@ -725,16 +1119,7 @@ class FlashcardManager:
         Returns:
             List of unique subjects
         """
-        subjects = set()
-        
-        # Get all sets
-        sets = self.get_all_sets()
-        
-        # Extract subjects
-        for set_data in sets.values():
-            subject = set_data.get("subject")
-            if subject:
-                subjects.add(subject)
+        subjects = set(self.index.subjects())
         
         # Add some default subjects if none exist
         if not subjects:
@@ -743,14 +1128,23 @@ class FlashcardManager:
         # Return sorted list
         return sorted(list(subjects))
         
-    def _save_set(self, set_id: str, set_data: Dict[str, Any]) -> None:
+    def _save_set(self, set_id: str, set_data: Dict[str, Any],
+                  changed_cards: Optional[List[Dict[str, Any]]] = None,
+                  removed_cards: List[str] = ()) -> bool:
         """
-        Save a flashcard set to disk
+        Save a flashcard set to disk and update its index rows
         
         Args:
             set_id: The ID of the set
             set_data: The set data to save
+            changed_cards: Cards added or reviewed (None reindexes every card)
+            removed_cards: IDs of the deleted cards
+            
+        Returns:
+            True if the set was saved
         """
+        # Sets opened with an id from before the migration are saved under the new one
+        set_id = set_data.get("id") or set_id
         set_file = self.user_dir / f"{set_id}.json"
         
         print(f"Saving flashcard set to: {set_file}")
@@ -758,11 +1152,13 @@ class FlashcardManager:
         print(f"Set ID: {set_id}")
         
         try:
-            with open(set_file, 'w', encoding='utf-8') as f:
-                json.dump(set_data, f, indent=2, ensure_ascii=False)
+            json_codec.dump(set_data, set_file)
+            self.index.update_set(set_data, changed_cards, removed_cards)
             print(f"Successfully saved flashcard set: {set_id}")
+            return True
         except Exception as e:
             print(f"Error saving flashcard set: {e}")
             # Print more detailed error information
             import traceback
-            traceback.print_exc()
\ No newline at end of file
+            traceback.print_exc()
+            return False
\ No newline at end of file
@@ -2,18 +2,416 @@
 Gamification module for the Pronote Web App
 """
 
-import json
+import copy
 import datetime
+import functools
+import hashlib
 import os
 import random
 import math
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterator, Iterable
+import json_codec
+from document_schema import DocumentSchema
+from event_log import EventLog
+from flashcard_system import load_legacy_ids
+import achievements
+import quests
+from leaderboard_index import LeaderboardIndex, period_keys, subject_key, xp_totals
+from streaks import StreakService
 
 # Path for gamification data
 GAMIFICATION_DIR = Path('data/gamification')
 os.makedirs(GAMIFICATION_DIR, exist_ok=True)
 
+# Path for the per-user append-only event logs
+GAMIFICATION_EVENTS_DIR = GAMIFICATION_DIR / 'events'
+os.makedirs(GAMIFICATION_EVENTS_DIR, exist_ok=True)
+
+# Number of logged events after which the full document is snapshotted
+SNAPSHOT_INTERVAL = 200
+
+# Capacity of the activity ring buffer kept in the document (the log keeps everything)
+ACTIVITY_HISTORY_LIMIT = int(os.environ.get('FIREFLIES_ACTIVITY_HISTORY_SIZE', '100'))
+
+# Number of ingested client event ids remembered for deduplication
+PROCESSED_EVENTS_LIMIT = 500
+
+# Keys of the document that are not tracked as "set" events
+UNTRACKED_KEYS = ("activity_history", "processed_events", "event_seq")
+
+# Event types accepted by process_events: method, required and optional fields
+EVENT_TYPES = {
+    "login": ("update_login_streak", (), ()),
+    "profile": ("set_profile", ("school",), ("class_name", "timezone")),
+    "homework": ("track_homework_completion", (), ()),
+    "grade_view": ("track_grade_view", (), ()),
+    "timetable_view": ("track_timetable_view", (), ()),
+    "message_sent": ("track_message_sent", (), ()),
+    "flashcard_quiz": ("track_flashcard_quiz_completion", (), ()),
+    "flashcard_session": ("track_flashcard_completion", ("set_id", "stats"), ("subject",)),
+    "exercise": ("track_exercise_completion", ("plan_id",), ()),
+}
+
+# Type of the fields of the events (process_events rejects the others)
+EVENT_FIELD_TYPES = {
+    "school": str,
+    "class_name": str,
+    "timezone": str,
+    "set_id": str,
+    "subject": str,
+    "plan_id": str,
+    "stats": dict,
+}
+
+# Counters of the stats of a flashcard_session event
+SESSION_STATS_FIELDS = ("failed", "hard", "good", "easy", "total")
+
+# Event types only the server submits (login and profile come from the Pronote session)
+SERVER_EVENT_TYPES = ("login", "profile")
+
+# Event types clients may send to the batch endpoint
+CLIENT_EVENT_TYPES = tuple(event_type for event_type in EVENT_TYPES if event_type not in SERVER_EVENT_TYPES)
+
+# Maximum number of events in one process_events batch
+MAX_EVENT_BATCH = 100
+
+# SQLite index of the ranking columns of every user
+LEADERBOARD_DB = GAMIFICATION_DIR / 'leaderboard.db'
+
+# Scopes of get_leaderboard: all-time ranks by level and XP, and rolling XP totals
+LEADERBOARD_SCOPES = ("global", "school", "class", "week", "month", "subject")
+
+_leaderboard_index = None
+_leaderboard_lock = threading.Lock()
+
+# Lock of each user, held while a document is loaded, changed and saved
+_user_locks = {}
+_user_locks_guard = threading.Lock()
+
+# Number of saves of each user's document by this process, to spot stale copies
+_user_versions = {}
+
+# Top-level fields each section of the get_stats view is computed from
+STATS_SECTIONS = {
+    "progress": ("points", "xp", "level", "next_level_xp", "streak"),
+    "achievements": ("achievements",),
+    "badges": ("badges",),
+    "activity": ("completed_homework", "viewed_grades", "checked_timetable", "sent_messages"),
+    "inventory": ("inventory",),
+    "study_plans": ("study_plans",),
+}
+
+# Number of users whose get_stats sections are cached (least recently used first out)
+STATS_CACHE_SIZE = int(os.environ.get('FIREFLIES_STATS_CACHE_SIZE', '1000'))
+
+# Cached get_stats sections of each user, with the fields changed since
+_stats_cache = OrderedDict()
+_stats_cache_lock = threading.Lock()
+
+
+def _default_data() -> Dict[str, Any]:
+    """
+    Build the gamification data of a new user
+
+    Returns:
+        Dict containing default gamification data
+    """
+    return {
+        "points": 0,
+        "xp": 0,
+        "level": 1,
+        "next_level_xp": 100,  # XP needed for next level
+        "streak": {
+            "current": 0,
+            "max": 0,
+            "last_login": None,
+            "flame_level": 0,  # 0-5 flame level based on streak
+            "multiplier": 1.0  # Point multiplier based on streak
+        },
+        "achievements": [],
+        "completed_homework": 0,
+        "viewed_grades": 0,
+        "checked_timetable": 0,
+        "sent_messages": 0,
+        "completed_flashcards": 0,
+        "flashcard_stats": {
+            "total_reviews": 0,
+            "correct_reviews": 0,
+            "sets_studied": {},
+            "study_sessions": 0,
+            "perfect_sessions": 0,
+            "study_streak": 0,
+            "last_study_date": None
+        },
+        "last_points_update": {},  # Last day points were given, per action
+        "activity_history": [],
+        "processed_events": [],  # Ids of the last ingested client events
+        "badges": [],  # Special badges earned
+        "inventory": {  # Virtual items earned
+            "boosters": [],
+            "avatars": ["default"],
+            "themes": ["default"]
+        },
+        "quests": {  # Daily and weekly quests
+            "daily": [],
+            "weekly": [],
+            "last_refresh": None,  # Day of the daily quests
+            "week": None  # ISO week of the weekly quests
+        },
+        "study_plans": [],
+        "profile": {  # School and class used by the scoped leaderboards
+            "school": None,
+            "class_name": None
+        },
+        "stats": {  # Additional stats for achievements
+            "login_days": 0,
+            "perfect_weeks": 0,
+            "early_bird_logins": 0,
+            "night_owl_logins": 0
+        }
+    }
+
+
+def _migrate_v1(data: Dict[str, Any]) -> None:
+    """Recompute the XP threshold of documents created before it was stored"""
+    if "next_level_xp" not in data:
+        data["next_level_xp"] = int(100 * (data.get("level", 1) ** 1.5))
+
+
+def _migrate_v4(data: Dict[str, Any]) -> None:
+    """Drop the quests generated before progress was tracked, they are drawn again"""
+    data["quests"] = _default_data()["quests"]
+
+
+# Versioned schema of the gamification document
+GAMIFICATION_SCHEMA = DocumentSchema("gamification", 4, _default_data, {1: _migrate_v1, 4: _migrate_v4})
+
+
+def leaderboard_entry(username: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Get the ranking columns of a gamification document
+
+    Args:
+        username: The username of the user
+        data: The gamification data of the user
+
+    Returns:
+        Leaderboard entry of the user
+    """
+    streak = data.get("streak") or {}
+    profile = data.get("profile") or {}
+    return {
+        "username": username,
+        "points": data.get("points", 0),
+        "xp": data.get("xp", 0),
+        "level": data.get("level", 1),
+        "streak": streak.get("current", 0),
+        "flame_level": streak.get("flame_level", 0),
+        "school": profile.get("school"),
+        "class_name": profile.get("class_name")
+    }
+
+
+def _read_leaderboard_entry(username: str) -> Dict[str, Any]:
+    """
+    Read the ranking columns and XP totals of a user from the files
+
+    The snapshot and the event log are read directly, without taking the
+    user's lock, so the index can be built while a user lock is held.
+
+    Args:
+        username: The username of the user
+
+    Returns:
+        Leaderboard entry of the user with its "xp_totals"
+    """
+    data = json_codec.load(GAMIFICATION_DIR / f"{username}.json")
+    events = EventLog(GAMIFICATION_EVENTS_DIR, username)
+
+    # The fields set since the snapshot count too
+    for event in events.read_tail(data.get("event_seq", 0)):
+        if event.get("type") == "set":
+            data.update(event.get("fields", {}))
+            for key in event.get("unset", []):
+                data.pop(key, None)
+
+    entry = leaderboard_entry(username, data)
+    entry["xp_totals"] = xp_totals(event["entry"] for event in events.iter_events(event_type="activity"))
+    return entry
+
+
+def get_leaderboard_index() -> LeaderboardIndex:
+    """
+    Get the leaderboard index, filling it from the user files the first time
+
+    Returns:
+        The shared leaderboard index
+    """
+    global _leaderboard_index
+    if _leaderboard_index is not None:
+        return _leaderboard_index
+
+    with _leaderboard_lock:
+        if _leaderboard_index is None:
+            index = LeaderboardIndex(LEADERBOARD_DB)
+            if not index.is_built():
+                entries = []
+                for file in GAMIFICATION_DIR.glob("*.json"):
+                    try:
+                        entries.append(_read_leaderboard_entry(file.stem))
+                    except Exception as e:
+                        print(f"Error loading leaderboard data for {file}: {e}")
+                index.rebuild(entries)
+                index.prune()
+            _leaderboard_index = index
+    return _leaderboard_index
+
+
+def user_lock(username: str) -> threading.RLock:
+    """
+    Get the lock of a user's gamification data
+
+    Every writer (routes, the event queue, the compaction job) holds it
+    around loading, changing and saving the data, so two copies of the same
+    document are never saved over each other.
+
+    Args:
+        username: The username of the user
+
+    Returns:
+        The user's reentrant lock
+    """
+    with _user_locks_guard:
+        lock = _user_locks.get(username)
+        if lock is None:
+            lock = _user_locks[username] = threading.RLock()
+        return lock
+
+
+def _transactional(method):
+    """Run a public method of GamificationSystem in a transaction (a single save)"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.transaction():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _check_event(event: Dict[str, Any]) -> float:
+    """
+    Check the type and fields of a process_events event
+
+    Args:
+        event: The event sent by the client
+
+    Returns:
+        POSIX time of its timestamp (naive times are server-local), -inf if
+        it has none
+
+    Raises:
+        ValueError: With the message reported to the client
+    """
+    event_type = event.get("type")
+    if not isinstance(event_type, str) or event_type not in EVENT_TYPES:
+        raise ValueError(f"Type d'événement inconnu : {event_type}")
+
+    _, required, optional = EVENT_TYPES[event_type]
+    missing = [field for field in required if not event.get(field)]
+    if missing:
+        raise ValueError(f"Champs manquants : {', '.join(missing)}")
+
+    invalid = [field for field in required + optional
+               if event.get(field) is not None and not isinstance(event[field], EVENT_FIELD_TYPES[field])]
+    stats = event.get("stats")
+    if isinstance(stats, dict) and any(
+            not isinstance(stats.get(field, 0), int) or isinstance(stats.get(field, 0), bool) or stats.get(field, 0) < 0
+            for field in SESSION_STATS_FIELDS):
+        invalid.append("stats")
+    if invalid:
+        raise ValueError(f"Champs invalides : {', '.join(invalid)}")
+
+    timestamp = event.get("timestamp")
+    if timestamp is None:
+        return -math.inf
+    try:
+        if not isinstance(timestamp, str):
+            raise TypeError
+        return datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+    except (TypeError, ValueError):
+        raise ValueError(f"Horodatage invalide : {timestamp}")
+
+
+# Backup value of the keys that did not exist when a transaction started
+_MISSING = object()
+
+
+class _TrackedData(dict):
+    """
+    Gamification document that records which top-level keys were accessed
+
+    Any key read or written since the last save may have been changed in
+    place, so only those keys are serialized and compared when saving.
+    While a transaction records a backup, the value of each key is copied
+    the first time the key is accessed, so a failed transaction restores
+    only the keys it could have changed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.touched = set()
+        self.backup = None
+
+    def _touch(self, key) -> None:
+        self.touched.add(key)
+        if self.backup is not None and key not in self.backup:
+            value = super().get(key, _MISSING)
+            self.backup[key] = value if value is _MISSING else copy.deepcopy(value)
+
+    def __getitem__(self, key):
+        self._touch(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._touch(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._touch(key)
+        super().__delitem__(key)
+
+    def get(self, key, default=None):
+        self._touch(key)
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self._touch(key)
+        return super().setdefault(key, default)
+
+    def pop(self, key, *default):
+        self._touch(key)
+        return super().pop(key, *default)
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        for key in other:
+            self._touch(key)
+        super().update(other)
+
+    def restore(self) -> None:
+        """Put back the keys backed up since the backup started, and stop it"""
+        for key, value in self.backup.items():
+            if value is _MISSING:
+                super().pop(key, None)
+            else:
+                super().__setitem__(key, value)
+        self.backup = None
+
+
 class GamificationSystem:
     """Class to handle gamification features"""
     
@@ -26,107 +424,335 @@ class GamificationSystem:
         """
         self.username = username
         self.data_file = GAMIFICATION_DIR / f"{username}.json"
-        self.data = self._load_data()
-        
+        self._transaction_depth = 0
+        self._save_requested = False
+        # Build the shared index before taking a user lock (the first save needs it)
+        get_leaderboard_index()
+        with user_lock(username):
+            self._load()
+
+    def _load(self) -> None:
+        """Load the data and the indexes built from it (under the user's lock)"""
+        self.events = EventLog(GAMIFICATION_EVENTS_DIR, self.username)
+        self._version = _user_versions.get(self.username, 0)
+        self._pending_activity = []
+        self._pending_processed = []
+        self.data = _TrackedData(self._load_data())
+        self._replay_events()
+        migrated = GAMIFICATION_SCHEMA.migrate(self.data)
+        self._legacy_set_ids = load_legacy_ids(self.username)
+        migrated = self._remap_set_ids() or migrated
+        self._persisted = self._fingerprint(self.data)
+        self._earned = {a["id"] for a in self.data["achievements"]}
+        self._badge_ids = {b["id"] for b in self.data["badges"]}
+        self._processed_ids = set(self.data["processed_events"])
+        self._quest_index = {}
+        self._index_quests()
+        self._streaks = None
+        self._ranked = self.get_leaderboard_entry()
+        self.data.touched.clear()
+
+        # Persist a migration once instead of patching keys on every request
+        if migrated and self.data_file.exists():
+            self._write_snapshot()
+
+    def _remap_set_ids(self) -> bool:
+        """
+        Move the per-set flashcard stats of migrated sets to their new id
+
+        Returns:
+            True if any set was remapped
+        """
+        sets_studied = self.data["flashcard_stats"]["sets_studied"]
+        old_ids = [set_id for set_id in sets_studied if set_id in self._legacy_set_ids]
+        for old_id in old_ids:
+            stats = sets_studied.pop(old_id)
+            new_stats = sets_studied.setdefault(self._legacy_set_ids[old_id], stats)
+            if new_stats is not stats:
+                # Studied under both ids
+                for key in ("total_reviews", "correct_reviews", "study_sessions"):
+                    new_stats[key] = new_stats.get(key, 0) + stats.get(key, 0)
+                new_stats["last_study_date"] = max(
+                    filter(None, (new_stats.get("last_study_date"), stats.get("last_study_date"))), default=None)
+        return bool(old_ids)
+
     def _load_data(self) -> Dict[str, Any]:
         """
-        Load gamification data from file
+        Load gamification data from file (migrated later, once the log is replayed)
 
         Returns:
             Dict containing gamification data
         """
-        if not self.data_file.exists():
-            # Initialize with default data
-            return {
-                "points": 0,
-                "xp": 0,
-                "level": 1,
-                "next_level_xp": 100,  # XP needed for next level
-                "streak": {
-                    "current": 0,
-                    "max": 0,
-                    "last_login": None,
-                    "flame_level": 0,  # 0-5 flame level based on streak
-                    "multiplier": 1.0  # Point multiplier based on streak
-                },
-                "achievements": [],
-                "completed_homework": 0,
-                "viewed_grades": 0,
-                "checked_timetable": 0,
-                "sent_messages": 0,
-                "completed_flashcards": 0,  # New field for flashcard tracking
-                "last_points_update": None,
-                "activity_history": [],
-                "badges": [],  # Special badges earned
-                "inventory": {  # Virtual items earned
-                    "boosters": [],
-                    "avatars": ["default"],
-                    "themes": ["default"]
-                },
-                "quests": {  # Daily and weekly quests
-                    "daily": [],
-                    "weekly": [],
-                    "last_refresh": None
-                },
-                "stats": {  # Additional stats for achievements
-                    "login_days": 0,
-                    "perfect_weeks": 0,
-                    "early_bird_logins": 0,
-                    "night_owl_logins": 0
-                }
-            }
-        
-        try:
-            with open(self.data_file, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading gamification data: {e}")
-            return {
-                "points": 0,
-                "xp": 0,
-                "level": 1,
-                "next_level_xp": 100,  # XP needed for next level
-                "streak": {
-                    "current": 0,
-                    "max": 0,
-                    "last_login": None,
-                    "flame_level": 0,  # 0-5 flame level based on streak
-                    "multiplier": 1.0  # Point multiplier based on streak
-                },
-                "achievements": [],
-                "completed_homework": 0,
-                "viewed_grades": 0,
-                "checked_timetable": 0,
-                "sent_messages": 0,
-                "last_points_update": None,
-                "activity_history": [],
-                "badges": [],  # Special badges earned
-                "inventory": {  # Virtual items earned
-                    "boosters": [],
-                    "avatars": ["default"],
-                    "themes": ["default"]
-                },
-                "quests": {  # Daily and weekly quests
-                    "daily": [],
-                    "weekly": [],
-                    "last_refresh": None
-                },
-                "stats": {  # Additional stats for achievements
-                    "login_days": 0,
-                    "perfect_weeks": 0,
-                    "early_bird_logins": 0,
-                    "night_owl_logins": 0
-                }
-            }
+        return GAMIFICATION_SCHEMA.load(self.data_file, migrate=False)[0]
     
+    def _replay_events(self) -> None:
+        """Apply the events logged since the last snapshot to the loaded data"""
+        # The activity history is a ring buffer: appends evict the oldest entry in place
+        self.data["activity_history"] = deque(self.data.get("activity_history") or [], maxlen=ACTIVITY_HISTORY_LIMIT)
+
+        for event in self.events.read_tail(self.data.get("event_seq", 0)):
+            if event.get("type") == "activity":
+                self.data["activity_history"].append(event["entry"])
+            elif event.get("type") == "processed":
+                self.data.setdefault("processed_events", []).extend(event.get("ids", []))
+            elif event.get("type") == "set":
+                self.data.update(event.get("fields", {}))
+                for key in event.get("unset", []):
+                    self.data.pop(key, None)
+
+        if len(self.data.get("processed_events", [])) > PROCESSED_EVENTS_LIMIT:
+            self.data["processed_events"] = self.data["processed_events"][-PROCESSED_EVENTS_LIMIT:]
+
+    def _fingerprint(self, keys: Iterable[str]) -> Dict[str, str]:
+        """
+        Serialize tracked top-level keys of the data
+
+        Args:
+            keys: Keys to serialize (those missing from the data are skipped)
+
+        Returns:
+            Dict mapping keys to their serialized value
+        """
+        return {
+            key: json_codec.dumps(dict.__getitem__(self.data, key), sort_keys=True)
+            for key in keys
+            if key not in UNTRACKED_KEYS and key in self.data
+        }
+
+    def _log_activity(self, entry: Dict[str, Any]) -> None:
+        """
+        Add an entry to the activity history
+
+        Args:
+            entry: The activity entry
+        """
+        # The ring buffer keeps the last entries, the event log keeps the full history
+        self.data["activity_history"].append(entry)
+        self._pending_activity.append(entry)
+
+    @contextmanager
+    def transaction(self) -> Iterator["GamificationSystem"]:
+        """
+        Group the changes of one event into a single save
+
+        Saves requested inside the transaction are deferred to its end, so
+        points, level ups, achievements and badges triggered by one action are
+        written once. Transactions nest; only the outermost one saves. If an
+        exception escapes, the in-memory data is restored and nothing is saved.
+
+        The outermost transaction holds the user's lock, and reloads the data
+        first if another copy saved it since this one was loaded.
+
+        Yields:
+            The gamification system
+        """
+        outermost = self._transaction_depth == 0
+        if outermost:
+            lock = user_lock(self.username)
+            lock.acquire()
+            try:
+                if _user_versions.get(self.username, 0) != self._version:
+                    self._load()
+            except Exception:
+                lock.release()
+                raise
+            # Keys are backed up as they are accessed, not the whole document
+            self.data.backup = {}
+            backup = (set(self.data.touched), list(self._pending_activity), list(self._pending_processed),
+                      set(self._earned), set(self._badge_ids), set(self._processed_ids))
+
+        self._transaction_depth += 1
+        try:
+            yield self
+        except Exception:
+            self._transaction_depth -= 1
+            if outermost:
+                (self.data.touched, self._pending_activity, self._pending_processed,
+                 self._earned, self._badge_ids, self._processed_ids) = backup
+                self.data.restore()
+                self._index_quests()
+                self._save_requested = False
+                lock.release()
+            raise
+
+        self._transaction_depth -= 1
+        if outermost:
+            self.data.backup = None
+            try:
+                if self._save_requested:
+                    self._save_requested = False
+                    self._save_data()
+            finally:
+                lock.release()
+
     def _save_data(self) -> None:
-        """Save gamification data to file"""
+        """Append the changes since the last save to the event log"""
+        if self._transaction_depth:
+            self._save_requested = True
+            return
+
+        # Only the keys accessed since the last save can have changed
+        touched = set(self.data.touched)
+        current = self._fingerprint(touched)
+        changed = {key: dict.__getitem__(self.data, key) for key, value in current.items()
+                   if self._persisted.get(key) != value}
+        removed = [key for key in touched if key in self._persisted and key not in self.data]
+
+        events = [{"type": "activity", "entry": entry} for entry in self._pending_activity]
+        if self._pending_processed:
+            events.append({"type": "processed", "ids": self._pending_processed})
+        if changed or removed:
+            events.append({"type": "set", "fields": changed, "unset": removed})
+
+        xp_deltas = xp_totals(self._pending_activity)
+        previous_seq = self.events.seq
+        if self.events.append(events) == previous_seq and events:
+            # Nothing was written: keep the changes for the next save
+            return
+        self._version = _user_versions[self.username] = _user_versions.get(self.username, 0) + 1
+        self._mark_stats_dirty(list(changed) + removed, previous_seq)
+        self._pending_activity = []
+        self._pending_processed = []
+        self._persisted.update(current)
+        for key in removed:
+            del self._persisted[key]
+        self.data.touched -= touched
+
+        # Keep the leaderboard index in step with the ranking columns
+        entry = self.get_leaderboard_entry()
+        if entry != self._ranked or xp_deltas or not self.data_file.exists():
+            try:
+                get_leaderboard_index().update(entry, xp_deltas)
+                self._ranked = entry
+            except Exception as e:
+                print(f"Error updating leaderboard index: {e}")
+
+        if self.events.pending >= SNAPSHOT_INTERVAL or not self.data_file.exists():
+            self._write_snapshot()
+
+    def _write_snapshot(self) -> None:
+        """Write the full document and rotate the event log"""
+        self.data["event_seq"] = self.events.seq
+        snapshot = dict(self.data)
+        snapshot["activity_history"] = list(self.data["activity_history"])
+        tmp_file = self.data_file.with_suffix(".json.tmp")
         try:
-            with open(self.data_file, 'w') as f:
-                json.dump(self.data, f, indent=2, default=str)
+            json_codec.dump(snapshot, tmp_file)
+            os.replace(tmp_file, self.data_file)
+            self.events.rotate()
         except Exception as e:
             print(f"Error saving gamification data: {e}")
+
+    def iter_activity_events(self) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the full activity history of the user
+
+        Yields:
+            Activity entries, oldest first
+        """
+        for event in self.events.iter_events(event_type="activity"):
+            yield event["entry"]
+
+    @_transactional
+    def set_profile(self, school: Optional[str], class_name: Optional[str] = None,
+                    timezone: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Set the school and class used by the scoped leaderboards
+
+        Args:
+            school: Identifier of the school (the host of its Pronote URL)
+            class_name: Name of the class of the user
+            timezone: IANA timezone of the day boundaries of the streaks (unchanged if None)
+
+        Returns:
+            Dict with the profile
+        """
+        profile = {"school": school or None, "class_name": class_name or None}
+        if self.data["profile"] != profile:
+            self.data["profile"] = profile
+            self._save_data()
+
+        if timezone:
+            self._get_streaks().set_timezone(timezone)
+
+        return {"points_earned": 0, "profile": profile}
     
+    def set_timezone(self, timezone: str) -> bool:
+        """
+        Set the timezone of the day boundaries of the streaks
+
+        Args:
+            timezone: IANA timezone name
+
+        Returns:
+            True if the timezone was valid and saved
+        """
+        return self._get_streaks().set_timezone(timezone)
+
+    def process_events(self, events: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Apply a batch of client events in one load/save cycle
+
+        The events are checked before the transaction: those with an unknown
+        type, a missing or mistyped field or an unreadable timestamp are
+        reported in "errors" and the others are applied in timestamp order.
+
+        Args:
+            events: Events with a "type" (see EVENT_TYPES), an optional client
+                "id" used for deduplication, an ISO 8601 "timestamp" and the
+                fields required by their type
+
+        Returns:
+            Dict with the result of each event and the aggregated points
+        """
+        summary = {"processed": 0, "duplicates": 0, "points_earned": 0, "results": [], "errors": []}
+
+        accepted = []
+        for position, event in enumerate(events):
+            event_id = str(event.get("id") or hashlib.sha1(
+                json_codec.dumps(event, pretty=False, sort_keys=True).encode("utf-8")).hexdigest()[:16])
+            try:
+                timestamp = _check_event(event)
+            except ValueError as e:
+                summary["errors"].append({"id": event_id, "message": str(e)})
+                continue
+            accepted.append((timestamp, position, event_id, event))
+
+        # Apply in timestamp order, keeping the batch order for equal timestamps
+        accepted.sort(key=lambda item: item[:2])
+
+        with self.transaction():
+            for _, _, event_id, event in accepted:
+                if event_id in self._processed_ids:
+                    summary["duplicates"] += 1
+                    continue
+
+                event_type = event["type"]
+                method_name, required, optional = EVENT_TYPES[event_type]
+                args = [event[field] for field in required]
+                kwargs = {field: event.get(field) for field in optional}
+                result = getattr(self, method_name)(*args, **kwargs)
+
+                self._processed_ids.add(event_id)
+                self._pending_processed.append(event_id)
+                self.data["processed_events"].append(event_id)
+
+                summary["processed"] += 1
+                summary["points_earned"] += result.get("points_earned", 0)
+                summary["results"].append({"id": event_id, "type": event_type, "result": result})
+
+            if len(self.data["processed_events"]) > PROCESSED_EVENTS_LIMIT:
+                self.data["processed_events"] = self.data["processed_events"][-PROCESSED_EVENTS_LIMIT:]
+
+            if summary["processed"]:
+                self._save_data()
+
+            summary["points"] = self.data["points"]
+            summary["xp"] = self.data["xp"]
+            summary["level"] = self.data["level"]
+        return summary
+
+    @_transactional
     def update_login_streak(self) -> Dict[str, Any]:
         """
         Update login streak when user logs in
@@ -134,14 +760,15 @@ class GamificationSystem:
         Returns:
             Dict with streak information
         """
-        today = datetime.date.today().isoformat()
-        last_login = self.data["streak"]["last_login"]
+        self._advance_quests("login")
+
+        streaks = self._get_streaks()
+        today = streaks.today().isoformat()
+        gap = streaks.gap("login")
         
         # If first login or login date is not set
-        if not last_login:
-            self.data["streak"]["current"] = 1
-            self.data["streak"]["max"] = 1
-            self.data["streak"]["last_login"] = today
+        if gap is None:
+            self._record_login(today)
             self.add_points(10, "Première connexion")
             self._save_data()
             return {
@@ -151,12 +778,8 @@ class GamificationSystem:
                 "message": "Bienvenue ! Vous avez gagné 10 points pour votre première connexion."
             }
         
-        # Convert string date to datetime.date object
-        last_login_date = datetime.date.fromisoformat(last_login)
-        today_date = datetime.date.today()
-        
         # If already logged in today
-        if last_login_date == today_date:
+        if gap <= 0:
             return {
                 "current": self.data["streak"]["current"],
                 "max": self.data["streak"]["max"],
@@ -164,13 +787,9 @@ class GamificationSystem:
                 "message": "Vous vous êtes déjà connecté aujourd'hui."
             }
         
-        # If logged in yesterday, increment streak
-        if (today_date - last_login_date).days == 1:
-            self.data["streak"]["current"] += 1
-            
-            # Update max streak if current is higher
-            if self.data["streak"]["current"] > self.data["streak"]["max"]:
-                self.data["streak"]["max"] = self.data["streak"]["current"]
+        # If logged in yesterday (or within the grace days), increment streak
+        if gap <= 1 + streaks.grace_days:
+            self._record_login(today)
             
             # Update flame level based on streak
             self._update_flame_level()
@@ -180,33 +799,20 @@ class GamificationSystem:
             points_result = self.add_points(points_earned, f"Série de connexion: {self.data['streak']['current']} jours")
 
             # Check for streak achievements
-            self._check_streak_achievements()
-
-            self.data["streak"]["last_login"] = today
+            self._check_achievements("streak")
 
             # Update stats
-            if "stats" not in self.data:
-                self.data["stats"] = {"login_days": 0}
-            if "login_days" not in self.data["stats"]:
-                self.data["stats"]["login_days"] = 0
             self.data["stats"]["login_days"] += 1
 
             # Check if it's an early bird login (before 8 AM)
             current_hour = datetime.datetime.now().hour
             if current_hour < 8:
-                if "early_bird_logins" not in self.data["stats"]:
-                    self.data["stats"]["early_bird_logins"] = 0
                 self.data["stats"]["early_bird_logins"] += 1
 
             # Check if it's a night owl login (after 10 PM)
             elif current_hour >= 22:
-                if "night_owl_logins" not in self.data["stats"]:
-                    self.data["stats"]["night_owl_logins"] = 0
                 self.data["stats"]["night_owl_logins"] += 1
 
-            # Generate daily quests if needed
-            self._refresh_quests()
-
             self._save_data()
 
             # Prepare response
@@ -230,16 +836,13 @@ class GamificationSystem:
             shield_active = self._check_streak_shield()
 
             if shield_active:
-                # Streak shield is active, don't reset streak
-                self.data["streak"]["last_login"] = today
+                # Streak shield is active, the missed days count as active
+                self._record_login(today, bridge=True)
                 points_result = self.add_points(10, "Connexion protégée par le Bouclier de Série")
 
                 # Update flame level
                 self._update_flame_level()
 
-                # Generate daily quests if needed
-                self._refresh_quests()
-
                 self._save_data()
 
                 flame_emoji = self._get_flame_emoji()
@@ -257,8 +860,7 @@ class GamificationSystem:
             else:
                 # No shield, reset streak
                 old_streak = self.data["streak"]["current"]
-                self.data["streak"]["current"] = 1
-                self.data["streak"]["last_login"] = today
+                self._record_login(today)
 
                 # Reset flame level and multiplier
                 self.data["streak"]["flame_level"] = 0
@@ -266,9 +868,6 @@ class GamificationSystem:
 
                 points_result = self.add_points(5, "Connexion après une pause")
 
-                # Generate daily quests if needed
-                self._refresh_quests()
-
                 self._save_data()
 
                 return {
@@ -281,13 +880,73 @@ class GamificationSystem:
                     "message": f"Bon retour ! Votre série a été réinitialisée (était {old_streak}). Vous avez gagné {points_result['points_earned']} points."
                 }
 
-    def add_points(self, points: int, reason: str) -> Dict[str, Any]:
+    def _get_streaks(self) -> StreakService:
+        """
+        Get the streak service of the user
+
+        The first time, streaks stored only in the gamification data are
+        copied into it, and the login and study streaks of the data are
+        refreshed from it (a batch recompute may have changed them).
+
+        Returns:
+            The streak service
+        """
+        if self._streaks is None:
+            streaks = StreakService(self.username)
+            streaks.seed("login", self.data["streak"].get("last_login"),
+                         self.data["streak"]["current"], self.data["streak"]["max"])
+            streaks.seed("study", self.data["flashcard_stats"].get("last_study_date"),
+                         self.data["flashcard_stats"].get("study_streak", 0))
+
+            if streaks.last_day("login") is not None:
+                self.data["streak"]["current"] = streaks.run("login")
+                self.data["streak"]["max"] = streaks.max("login")
+            if streaks.last_day("study") is not None:
+                self.data["flashcard_stats"]["study_streak"] = streaks.run("study")
+            self._streaks = streaks
+        return self._streaks
+
+    def _record_login(self, today: str, bridge: bool = False) -> None:
+        """
+        Record today's login in the streak service and the gamification data
+
+        Args:
+            today: ISO date of today for the user
+            bridge: Count the missed days as logged in (streak shield)
+        """
+        result = self._get_streaks().record("login", bridge=bridge)
+        self.data["streak"]["current"] = result["current"]
+        self.data["streak"]["max"] = result["max"]
+        self.data["streak"]["last_login"] = today
+
+    @_transactional
+    def add_points(self, points: int, reason: str, subject: Optional[str] = None) -> Dict[str, Any]:
         """
         Add points to the user's account
 
         Args:
             points: Number of points to add
             reason: Reason for adding points
+            subject: Subject the points were earned in (for the subject leaderboards)
+
+        Returns:
+            Dict with information about points and XP gained
+        """
+        result = self._grant_points(points, reason, subject)
+
+        # Save changes
+        self._save_data()
+
+        return result
+
+    def _grant_points(self, points: int, reason: str, subject: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Add points to the user's account without saving
+
+        Args:
+            points: Number of points to add
+            reason: Reason for adding points
+            subject: Subject the points were earned in
 
         Returns:
             Dict with information about points and XP gained
@@ -301,28 +960,22 @@ class GamificationSystem:
 
         # Add XP (1 point = 5 XP)
         xp_gained = adjusted_points * 5
-        if "xp" not in self.data:
-            self.data["xp"] = 0
         self.data["xp"] += xp_gained
 
         # Add to activity history
-        self.data["activity_history"].append({
+        entry = {
             "date": datetime.datetime.now().isoformat(),
             "action": reason,
             "points": adjusted_points,
             "xp": xp_gained
-        })
-
-        # Limit history to last 100 entries
-        if len(self.data["activity_history"]) > 100:
-            self.data["activity_history"] = self.data["activity_history"][-100:]
+        }
+        if subject:
+            entry["subject"] = subject
+        self._log_activity(entry)
 
         # Update level
         level_up_info = self._update_level()
 
-        # Save changes
-        self._save_data()
-
         return {
             "points_earned": adjusted_points,
             "xp_gained": xp_gained,
@@ -339,12 +992,8 @@ class GamificationSystem:
         """
         old_level = self.data["level"]
 
-        # Initialize next_level_xp if it doesn't exist
-        if "next_level_xp" not in self.data:
-            self.data["next_level_xp"] = int(100 * (self.data["level"] ** 1.5))
-
         # Check if we have enough XP to level up
-        while self.data.get("xp", 0) >= self.data["next_level_xp"]:
+        while self.data["xp"] >= self.data["next_level_xp"]:
             self.data["level"] += 1
 
             # Calculate XP needed for next level (increases with each level)
@@ -355,7 +1004,7 @@ class GamificationSystem:
             booster = self._award_random_booster()
 
             # Add level up to activity history
-            self.data["activity_history"].append({
+            self._log_activity({
                 "date": datetime.datetime.now().isoformat(),
                 "action": f"Niveau supérieur ! {old_level} → {self.data['level']}",
                 "points": 0,
@@ -391,22 +1040,17 @@ class GamificationSystem:
         booster = random.choice(boosters)
         booster["expires"] = (datetime.datetime.now() + datetime.timedelta(days=booster["duration"])).isoformat()
 
-        # Initialize inventory if needed
-        if "inventory" not in self.data:
-            self.data["inventory"] = {"boosters": []}
-        elif "boosters" not in self.data["inventory"]:
-            self.data["inventory"]["boosters"] = []
-
         self.data["inventory"]["boosters"].append(booster)
 
         return booster
 
     def _get_last_booster(self) -> Optional[Dict[str, Any]]:
         """Get the most recently awarded booster"""
-        if "inventory" in self.data and "boosters" in self.data["inventory"] and self.data["inventory"]["boosters"]:
+        if self.data["inventory"]["boosters"]:
             return self.data["inventory"]["boosters"][-1]
         return None
     
+    @_transactional
     def track_homework_completion(self) -> Dict[str, Any]:
         """
         Track when user completes homework
@@ -414,6 +1058,8 @@ class GamificationSystem:
         Returns:
             Dict with points information
         """
+        self._advance_quests("homework")
+
         self.data["completed_homework"] += 1
         points_earned = 15
         
@@ -429,7 +1075,7 @@ class GamificationSystem:
         self.add_points(total_points, f"Devoir terminé ({self.data['completed_homework']} au total)")
 
         # Check for homework achievements
-        self._check_homework_achievements()
+        self._check_achievements("completed_homework")
 
         return {
             "points_earned": total_points,
@@ -437,7 +1083,9 @@ class GamificationSystem:
                       (f" {milestone_message}" if milestone_message else "")
         }
         
-    def track_flashcard_completion(self, set_id: str, stats: Dict[str, Any]) -> Dict[str, Any]:
+    @_transactional
+    def track_flashcard_completion(self, set_id: str, stats: Dict[str, Any],
+                                   subject: Optional[str] = None) -> Dict[str, Any]:
         """
         Track when user completes a flashcard study session
         
@@ -449,26 +1097,15 @@ class GamificationSystem:
                 - good: Number of cards rated as good
                 - easy: Number of cards rated as easy
                 - total: Total number of cards reviewed
+            subject: Subject of the flashcard set
                 
         Returns:
             Dict with points information
         """
-        # Initialize completed_flashcards if it doesn't exist
-        if "completed_flashcards" not in self.data:
-            self.data["completed_flashcards"] = 0
-            
-        # Initialize flashcard_stats if it doesn't exist
-        if "flashcard_stats" not in self.data:
-            self.data["flashcard_stats"] = {
-                "total_reviews": 0,
-                "correct_reviews": 0,
-                "sets_studied": {},
-                "study_sessions": 0,
-                "perfect_sessions": 0,
-                "study_streak": 0,
-                "last_study_date": None
-            }
-            
+        self._advance_quests("flashcard_session")
+        # Links made before the id migration use the old set id
+        set_id = self._legacy_set_ids.get(set_id, set_id)
+
         # Update flashcard stats
         self.data["completed_flashcards"] += 1
         self.data["flashcard_stats"]["total_reviews"] += stats.get("total", 0)
@@ -480,26 +1117,9 @@ class GamificationSystem:
             self.data["flashcard_stats"]["perfect_sessions"] += 1
         
         # Update study streak
-        today = datetime.date.today().isoformat()
-        last_study_date = self.data["flashcard_stats"].get("last_study_date")
-        
-        if last_study_date:
-            last_date = datetime.date.fromisoformat(last_study_date)
-            today_date = datetime.date.today()
-            
-            if last_date == today_date:
-                # Already studied today, no streak update
-                pass
-            elif (today_date - last_date).days == 1:
-                # Studied yesterday, increment streak
-                self.data["flashcard_stats"]["study_streak"] += 1
-            else:
-                # Missed a day, reset streak
-                self.data["flashcard_stats"]["study_streak"] = 1
-        else:
-            # First study session
-            self.data["flashcard_stats"]["study_streak"] = 1
-            
+        streaks = self._get_streaks()
+        today = streaks.today().isoformat()
+        self.data["flashcard_stats"]["study_streak"] = streaks.record("study")["current"]
         self.data["flashcard_stats"]["last_study_date"] = today
         
         # Track study for this specific set
@@ -552,13 +1172,11 @@ class GamificationSystem:
         total_points = base_points + performance_bonus + streak_bonus + milestone_bonus
         
         # Add points to user's account
-        self.add_points(total_points, f"Session d'étude de cartes mémoire terminée ({stats.get('total', 0)} cartes)")
+        self.add_points(total_points, f"Session d'étude de cartes mémoire terminée ({stats.get('total', 0)} cartes)",
+                        subject=subject)
         
         # Check for flashcard achievements
-        self._check_flashcard_achievements()
-        
-        # Save data
-        self._save_data()
+        self._check_achievements(*achievements.FLASHCARD_COUNTERS)
         
         return {
             "points_earned": total_points,
@@ -571,6 +1189,7 @@ class GamificationSystem:
                       (f" {milestone_message}" if milestone_message else "")
         }
     
+    @_transactional
     def track_grade_view(self) -> Dict[str, Any]:
         """
         Track when user views grades
@@ -578,13 +1197,11 @@ class GamificationSystem:
         Returns:
             Dict with points information
         """
+        self._advance_quests("grade_view")
+
         # Only award points once per day
         today = datetime.date.today().isoformat()
 
-        # Initialize last_points_update if it doesn't exist or is None
-        if "last_points_update" not in self.data or self.data["last_points_update"] is None:
-            self.data["last_points_update"] = {}
-
         # Get the last update date for viewed_grades
         last_update = self.data["last_points_update"].get("viewed_grades")
 
@@ -601,13 +1218,14 @@ class GamificationSystem:
         self.add_points(points_earned, "Consultation des notes")
 
         # Check for grade view achievements
-        self._check_grade_view_achievements()
+        self._check_achievements("viewed_grades")
 
         return {
             "points_earned": points_earned,
             "message": f"Vous avez gagné {points_earned} points pour avoir consulté vos notes."
         }
     
+    @_transactional
     def track_timetable_view(self) -> Dict[str, Any]:
         """
         Track when user views timetable
@@ -615,13 +1233,11 @@ class GamificationSystem:
         Returns:
             Dict with points information
         """
+        self._advance_quests("timetable_view")
+
         # Only award points once per day
         today = datetime.date.today().isoformat()
 
-        # Initialize last_points_update if it doesn't exist or is None
-        if "last_points_update" not in self.data or self.data["last_points_update"] is None:
-            self.data["last_points_update"] = {}
-
         # Get the last update date for checked_timetable
         last_update = self.data["last_points_update"].get("checked_timetable")
 
@@ -634,20 +1250,18 @@ class GamificationSystem:
         self.data["checked_timetable"] += 1
         points_earned = 5
 
-        if not "last_points_update" in self.data:
-            self.data["last_points_update"] = {}
-
         self.data["last_points_update"]["checked_timetable"] = today
         self.add_points(points_earned, "Consultation de l'emploi du temps")
 
         # Check for timetable achievements
-        self._check_timetable_achievements()
+        self._check_achievements("checked_timetable")
 
         return {
             "points_earned": points_earned,
             "message": f"Vous avez gagné {points_earned} points pour avoir consulté votre emploi du temps."
         }
     
+    @_transactional
     def track_message_sent(self) -> Dict[str, Any]:
         """
         Track when user sends a message
@@ -655,6 +1269,8 @@ class GamificationSystem:
         Returns:
             Dict with points information
         """
+        self._advance_quests("message_sent")
+
         self.data["sent_messages"] += 1
         points_earned = 10
 
@@ -670,7 +1286,7 @@ class GamificationSystem:
         self.add_points(total_points, f"Message envoyé ({self.data['sent_messages']} au total)")
 
         # Check for message achievements
-        self._check_message_achievements()
+        self._check_achievements("sent_messages")
 
         return {
             "points_earned": total_points,
@@ -678,16 +1294,15 @@ class GamificationSystem:
                       (f" {milestone_message}" if milestone_message else "")
         }
 
-    def track_flashcard_completion(self) -> Dict[str, Any]:
+    @_transactional
+    def track_flashcard_quiz_completion(self) -> Dict[str, Any]:
         """
         Track when user completes a flashcard quiz
 
         Returns:
             Dict with points information
         """
-        # Initialize if not exists
-        if "completed_flashcards" not in self.data:
-            self.data["completed_flashcards"] = 0
+        self._advance_quests("flashcard_quiz")
 
         self.data["completed_flashcards"] += 1
         points_earned = 20  # More points than homework as it requires active learning
@@ -704,7 +1319,7 @@ class GamificationSystem:
         self.add_points(total_points, f"Flashcard quiz completed ({self.data['completed_flashcards']} total)")
 
         # Check for flashcard achievements
-        self._check_flashcard_achievements()
+        self._check_achievements("completed_flashcards")
 
         return {
             "points_earned": total_points,
@@ -712,241 +1327,43 @@ class GamificationSystem:
                       (f" {milestone_message}" if milestone_message else "")
         }
     
-    def _check_streak_achievements(self) -> None:
-        """Check and award streak-based achievements"""
-        streak = self.data["streak"]["current"]
-        achievements = self.data["achievements"]
-
-        # Define streak achievements
-        streak_achievements = [
-            {"id": "streak_3", "name": "Série de 3 jours", "description": "Connexion pendant 3 jours consécutifs", "threshold": 3, "points": 20, "category": "streak"},
-            {"id": "streak_7", "name": "Guerrier Hebdomadaire", "description": "Connexion pendant 7 jours consécutifs", "threshold": 7, "points": 50, "category": "streak"},
-            {"id": "streak_14", "name": "Combattant de la Quinzaine", "description": "Connexion pendant 14 jours consécutifs", "threshold": 14, "points": 100, "category": "streak"},
-            {"id": "streak_30", "name": "Maître du Mois", "description": "Connexion pendant 30 jours consécutifs", "threshold": 30, "points": 200, "category": "streak"},
-            {"id": "streak_60", "name": "Guerrier Saisonnier", "description": "Connexion pendant 60 jours consécutifs", "threshold": 60, "points": 300, "category": "streak"},
-            {"id": "streak_100", "name": "Légende de l'Assiduité", "description": "Connexion pendant 100 jours consécutifs", "threshold": 100, "points": 500, "category": "streak"},
-        ]
-
-        # Check each achievement
-        for achievement in streak_achievements:
-            if streak >= achievement["threshold"] and not any(a["id"] == achievement["id"] for a in achievements):
-                # Award achievement
-                achievement["date_earned"] = datetime.datetime.now().isoformat()
-                self.data["achievements"].append(achievement)
-
-                # Award points
-                self.add_points(achievement["points"], f"Succès : {achievement['name']}")
-
-                # Award badge for special achievements
-                if achievement["threshold"] >= 30:
-                    self._award_badge(achievement["id"], achievement["name"], achievement["description"])
-
-    def _check_homework_achievements(self) -> None:
-        """Check and award homework-based achievements"""
-        completed = self.data["completed_homework"]
-        achievements = self.data["achievements"]
-
-        # Define homework achievements
-        homework_achievements = [
-            {"id": "hw_5", "name": "Débutant des Devoirs", "description": "Terminer 5 devoirs", "threshold": 5, "points": 25, "category": "homework"},
-            {"id": "hw_20", "name": "Héros des Devoirs", "description": "Terminer 20 devoirs", "threshold": 20, "points": 75, "category": "homework"},
-            {"id": "hw_50", "name": "Maître des Devoirs", "description": "Terminer 50 devoirs", "threshold": 50, "points": 150, "category": "homework"},
-            {"id": "hw_100", "name": "Légende des Devoirs", "description": "Terminer 100 devoirs", "threshold": 100, "points": 300, "category": "homework"},
-            {"id": "hw_200", "name": "Érudit des Devoirs", "description": "Terminer 200 devoirs", "threshold": 200, "points": 500, "category": "homework"},
-        ]
-
-        # Check each achievement
-        for achievement in homework_achievements:
-            if completed >= achievement["threshold"] and not any(a["id"] == achievement["id"] for a in achievements):
-                # Award achievement
-                achievement["date_earned"] = datetime.datetime.now().isoformat()
-                self.data["achievements"].append(achievement)
-
-                # Award points
-                self.add_points(achievement["points"], f"Succès : {achievement['name']}")
-
-                # Award badge for special achievements
-                if achievement["threshold"] >= 50:
-                    self._award_badge(achievement["id"], achievement["name"], achievement["description"])
-
-    def _check_flashcard_achievements(self) -> None:
-        """Check and award flashcard-based achievements"""
-        completed = self.data.get("completed_flashcards", 0)
-        achievements = self.data["achievements"]
-
-        # Initialize flashcard_stats if it doesn't exist
-        if "flashcard_stats" not in self.data:
-            self.data["flashcard_stats"] = {
-                "total_reviews": 0,
-                "correct_reviews": 0,
-                "sets_studied": {},
-                "study_sessions": 0,
-                "perfect_sessions": 0,
-                "study_streak": 0,
-                "last_study_date": None
-            }
-            
-        # Get stats
-        sessions_count = self.data["flashcard_stats"].get("study_sessions", 0)
-        perfect_sessions = self.data["flashcard_stats"].get("perfect_sessions", 0)
-        total_reviews = self.data["flashcard_stats"].get("total_reviews", 0)
-        study_streak = self.data["flashcard_stats"].get("study_streak", 0)
-        sets_studied = len(self.data["flashcard_stats"].get("sets_studied", {}))
-
-        # Define flashcard achievements
-        flashcard_achievements = [
-            # Basic completion achievements
-            {"id": "fc_5", "name": "Apprenti des Flashcards", "description": "Terminer 5 quiz de flashcards", "threshold": 5, "points": 30, "category": "flashcards", "stat": completed},
-            {"id": "fc_20", "name": "Étudiant Assidu", "description": "Terminer 20 quiz de flashcards", "threshold": 20, "points": 80, "category": "flashcards", "stat": completed},
-            {"id": "fc_50", "name": "Maître de la Mémorisation", "description": "Terminer 50 quiz de flashcards", "threshold": 50, "points": 200, "category": "flashcards", "stat": completed},
-            {"id": "fc_100", "name": "Génie des Flashcards", "description": "Terminer 100 quiz de flashcards", "threshold": 100, "points": 350, "category": "flashcards", "stat": completed},
-            {"id": "fc_200", "name": "Sage de la Connaissance", "description": "Terminer 200 quiz de flashcards", "threshold": 200, "points": 600, "category": "flashcards", "stat": completed},
-            
-            # Perfect session achievements
-            {"id": "fc_perfect_5", "name": "Mémoire Photographique", "description": "Obtenir 5 sessions parfaites", "threshold": 5, "points": 50, "category": "flashcards_perfect", "stat": perfect_sessions},
-            {"id": "fc_perfect_25", "name": "Mémoire d'Éléphant", "description": "Obtenir 25 sessions parfaites", "threshold": 25, "points": 150, "category": "flashcards_perfect", "stat": perfect_sessions},
-            
-            # Card review achievements
-            {"id": "fc_reviews_100", "name": "Centenaire", "description": "Réviser 100 cartes", "threshold": 100, "points": 40, "category": "flashcards_reviews", "stat": total_reviews},
-            {"id": "fc_reviews_500", "name": "Réviseur Assidu", "description": "Réviser 500 cartes", "threshold": 500, "points": 100, "category": "flashcards_reviews", "stat": total_reviews},
-            {"id": "fc_reviews_1000", "name": "Maître de la Révision", "description": "Réviser 1000 cartes", "threshold": 1000, "points": 250, "category": "flashcards_reviews", "stat": total_reviews},
-            
-            # Study streak achievements
-            {"id": "fc_streak_3", "name": "Habitude Naissante", "description": "Maintenir une série d'étude de 3 jours", "threshold": 3, "points": 25, "category": "flashcards_streak", "stat": study_streak},
-            {"id": "fc_streak_7", "name": "Habitude Hebdomadaire", "description": "Maintenir une série d'étude de 7 jours", "threshold": 7, "points": 60, "category": "flashcards_streak", "stat": study_streak},
-            {"id": "fc_streak_30", "name": "Habitude Mensuelle", "description": "Maintenir une série d'étude de 30 jours", "threshold": 30, "points": 200, "category": "flashcards_streak", "stat": study_streak},
-            
-            # Sets studied achievements
-            {"id": "fc_sets_3", "name": "Explorateur", "description": "Étudier 3 ensembles de cartes différents", "threshold": 3, "points": 30, "category": "flashcards_sets", "stat": sets_studied},
-            {"id": "fc_sets_10", "name": "Polymathe", "description": "Étudier 10 ensembles de cartes différents", "threshold": 10, "points": 80, "category": "flashcards_sets", "stat": sets_studied}
-        ]
-
-        # Check each achievement
-        for achievement in flashcard_achievements:
-            if achievement["stat"] >= achievement["threshold"] and not any(a["id"] == achievement["id"] for a in achievements):
-                # Award achievement
-                achievement["date_earned"] = datetime.datetime.now().isoformat()
-                self.data["achievements"].append(achievement)
-
-                # Award points
-                self.add_points(achievement["points"], f"Succès : {achievement['name']}")
-
-                # Award badge for special achievements
-                if "flashcards_perfect" in achievement["category"] or "flashcards_streak" in achievement["category"] or achievement["threshold"] >= 50:
-                    self._award_badge(achievement["id"], achievement["name"], achievement["description"])
-
-    def _check_grade_view_achievements(self) -> None:
-        """Check and award grade view-based achievements"""
-        views = self.data["viewed_grades"]
-        achievements = self.data["achievements"]
-
-        # Define grade view achievements
-        grade_achievements = [
-            {"id": "grades_5", "name": "Observateur de Notes", "description": "Consulter ses notes 5 fois", "threshold": 5, "points": 20, "category": "grades"},
-            {"id": "grades_15", "name": "Analyste de Notes", "description": "Consulter ses notes 15 fois", "threshold": 15, "points": 50, "category": "grades"},
-            {"id": "grades_30", "name": "Expert en Notes", "description": "Consulter ses notes 30 fois", "threshold": 30, "points": 100, "category": "grades"},
-            {"id": "grades_50", "name": "Maître des Notes", "description": "Consulter ses notes 50 fois", "threshold": 50, "points": 150, "category": "grades"},
-        ]
-
-        # Check each achievement
-        for achievement in grade_achievements:
-            if views >= achievement["threshold"] and not any(a["id"] == achievement["id"] for a in achievements):
-                # Award achievement
-                achievement["date_earned"] = datetime.datetime.now().isoformat()
-                self.data["achievements"].append(achievement)
-
-                # Award points
-                self.add_points(achievement["points"], f"Succès : {achievement['name']}")
-
-    def _check_timetable_achievements(self) -> None:
-        """Check and award timetable view-based achievements"""
-        views = self.data["checked_timetable"]
-        achievements = self.data["achievements"]
-
-        # Define timetable view achievements
-        timetable_achievements = [
-            {"id": "timetable_5", "name": "Planificateur Débutant", "description": "Consulter son emploi du temps 5 fois", "threshold": 5, "points": 20, "category": "timetable"},
-            {"id": "timetable_15", "name": "Organisateur", "description": "Consulter son emploi du temps 15 fois", "threshold": 15, "points": 50, "category": "timetable"},
-            {"id": "timetable_30", "name": "Maître du Temps", "description": "Consulter son emploi du temps 30 fois", "threshold": 30, "points": 100, "category": "timetable"},
-            {"id": "timetable_50", "name": "Chronométreur Suprême", "description": "Consulter son emploi du temps 50 fois", "threshold": 50, "points": 150, "category": "timetable"},
-        ]
-
-        # Check each achievement
-        for achievement in timetable_achievements:
-            if views >= achievement["threshold"] and not any(a["id"] == achievement["id"] for a in achievements):
-                # Award achievement
-                achievement["date_earned"] = datetime.datetime.now().isoformat()
-                self.data["achievements"].append(achievement)
-
-                # Award points
-                self.add_points(achievement["points"], f"Succès : {achievement['name']}")
-
-    def _check_message_achievements(self) -> None:
-        """Check and award message-based achievements"""
-        messages = self.data["sent_messages"]
-        achievements = self.data["achievements"]
-
-        # Define message achievements
-        message_achievements = [
-            {"id": "msg_5", "name": "Communicateur Débutant", "description": "Envoyer 5 messages", "threshold": 5, "points": 25, "category": "messages"},
-            {"id": "msg_15", "name": "Communicateur Actif", "description": "Envoyer 15 messages", "threshold": 15, "points": 50, "category": "messages"},
-            {"id": "msg_30", "name": "Communicateur Expert", "description": "Envoyer 30 messages", "threshold": 30, "points": 100, "category": "messages"},
-            {"id": "msg_50", "name": "Maître de la Communication", "description": "Envoyer 50 messages", "threshold": 50, "points": 150, "category": "messages"},
-        ]
-
-        # Check each achievement
-        for achievement in message_achievements:
-            if messages >= achievement["threshold"] and not any(a["id"] == achievement["id"] for a in achievements):
-                # Award achievement
-                achievement["date_earned"] = datetime.datetime.now().isoformat()
-                self.data["achievements"].append(achievement)
-
-                # Award points
-                self.add_points(achievement["points"], f"Succès : {achievement['name']}")
+    def _check_achievements(self, *counters: str) -> List[Dict[str, Any]]:
+        """
+        Award the achievements reached for the counters an event changed
 
-                # Award badge for special achievements
-                if achievement["threshold"] >= 30:
-                    self._award_badge(achievement["id"], achievement["name"], achievement["description"])
+        Args:
+            counters: Names of the changed counters (see achievements.COUNTERS)
 
-    def _check_study_plan_achievements(self) -> None:
-        """Check and award study plan-based achievements"""
-        if "study_plans" not in self.data:
-            return
+        Returns:
+            List of the achievements awarded
+        """
+        awarded = []
+        now = datetime.datetime.now().isoformat()
 
-        total_plans = len(self.data["study_plans"])
-        completed_plans = len([p for p in self.data["study_plans"] if p.get("completed", False)])
-        achievements = self.data["achievements"]
+        for rule in achievements.evaluate(self.data, self._earned, counters):
+            achievement = {key: value for key, value in rule.items() if key not in ("counter", "badge")}
+            achievement["date_earned"] = now
+            self.data["achievements"].append(achievement)
+            self._earned.add(achievement["id"])
+            awarded.append(achievement)
 
-        # Define study plan achievements
-        study_plan_achievements = [
-            {"id": "plan_create_3", "name": "Planificateur Débutant", "description": "Créer 3 plans d'étude", "threshold": 3, "points": 30, "category": "study_plans", "check": total_plans},
-            {"id": "plan_create_10", "name": "Planificateur Expert", "description": "Créer 10 plans d'étude", "threshold": 10, "points": 75, "category": "study_plans", "check": total_plans},
-            {"id": "plan_complete_3", "name": "Étudiant Discipliné", "description": "Compléter 3 plans d'étude", "threshold": 3, "points": 50, "category": "study_plans", "check": completed_plans},
-            {"id": "plan_complete_10", "name": "Maître de l'Étude", "description": "Compléter 10 plans d'étude", "threshold": 10, "points": 150, "category": "study_plans", "check": completed_plans},
-        ]
+            # Award points
+            self._grant_points(achievement["points"], f"Succès : {achievement['name']}")
 
-        # Check each achievement
-        for achievement in study_plan_achievements:
-            check_value = achievement["check"]
-            if check_value >= achievement["threshold"] and not any(a["id"] == achievement["id"] for a in achievements):
-                # Award achievement
-                achievement["date_earned"] = datetime.datetime.now().isoformat()
-                self.data["achievements"].append(achievement)
+            # Award badge for special achievements
+            if rule.get("badge"):
+                self._award_badge(achievement["id"], achievement["name"], achievement["description"])
 
-                # Award points
-                self.add_points(achievement["points"], f"Succès : {achievement['name']}")
+        # Persist every award of the event at once
+        if awarded:
+            self._save_data()
 
-                # Award badge for completing 10 study plans
-                if achievement["id"] == "plan_complete_10":
-                    self._award_badge(achievement["id"], achievement["name"], achievement["description"])
+        return awarded
 
     def _award_badge(self, badge_id: str, name: str, description: str) -> None:
         """Award a badge to the user"""
-        if "badges" not in self.data:
-            self.data["badges"] = []
-
         # Check if badge already exists
-        if any(b["id"] == badge_id for b in self.data["badges"]):
+        if badge_id in self._badge_ids:
             return
 
         # Create badge with additional properties
@@ -961,9 +1378,10 @@ class GamificationSystem:
 
         # Add badge
         self.data["badges"].append(badge)
+        self._badge_ids.add(badge_id)
 
         # Add to activity history
-        self.data["activity_history"].append({
+        self._log_activity({
             "date": datetime.datetime.now().isoformat(),
             "action": f"Badge obtenu : {name}",
             "points": 0,
@@ -971,8 +1389,6 @@ class GamificationSystem:
         })
 
         # Add XP
-        if "xp" not in self.data:
-            self.data["xp"] = 0
         self.data["xp"] += 50
 
         # Update level
@@ -1027,19 +1443,13 @@ class GamificationSystem:
 
         reward = rewards[badge_id]
 
-        # Initialize inventory if needed
-        if "inventory" not in self.data:
-            self.data["inventory"] = {"boosters": [], "avatars": ["default"], "themes": ["default"]}
-
         # Award the reward based on type
         if reward["type"] == "avatar":
-            if "avatars" not in self.data["inventory"]:
-                self.data["inventory"]["avatars"] = ["default"]
             if reward["id"] not in self.data["inventory"]["avatars"]:
                 self.data["inventory"]["avatars"].append(reward["id"])
 
                 # Add to activity history
-                self.data["activity_history"].append({
+                self._log_activity({
                     "date": datetime.datetime.now().isoformat(),
                     "action": f"Avatar débloqué : {reward['name']}",
                     "points": 0,
@@ -1047,13 +1457,11 @@ class GamificationSystem:
                 })
 
         elif reward["type"] == "theme":
-            if "themes" not in self.data["inventory"]:
-                self.data["inventory"]["themes"] = ["default"]
             if reward["id"] not in self.data["inventory"]["themes"]:
                 self.data["inventory"]["themes"].append(reward["id"])
 
                 # Add to activity history
-                self.data["activity_history"].append({
+                self._log_activity({
                     "date": datetime.datetime.now().isoformat(),
                     "action": f"Thème débloqué : {reward['name']}",
                     "points": 0,
@@ -1061,9 +1469,6 @@ class GamificationSystem:
                 })
 
         elif reward["type"] == "booster":
-            if "boosters" not in self.data["inventory"]:
-                self.data["inventory"]["boosters"] = []
-
             # Create booster
             booster = {
                 "id": reward["id"],
@@ -1076,7 +1481,7 @@ class GamificationSystem:
             self.data["inventory"]["boosters"].append(booster)
 
             # Add to activity history
-            self.data["activity_history"].append({
+            self._log_activity({
                 "date": datetime.datetime.now().isoformat(),
                 "action": f"Booster débloqué : {reward['name']}",
                 "points": 0,
@@ -1087,14 +1492,6 @@ class GamificationSystem:
         """Update flame level based on streak"""
         streak = self.data["streak"]["current"]
 
-        # Initialize flame level if it doesn't exist
-        if "flame_level" not in self.data["streak"]:
-            self.data["streak"]["flame_level"] = 0
-
-        # Initialize multiplier if it doesn't exist
-        if "multiplier" not in self.data["streak"]:
-            self.data["streak"]["multiplier"] = 1.0
-
         # Update flame level based on streak
         if streak >= 30:
             self.data["streak"]["flame_level"] = 5  # Max flame
@@ -1139,9 +1536,6 @@ class GamificationSystem:
         Returns:
             True if shield is active and used, False otherwise
         """
-        if "inventory" not in self.data or "boosters" not in self.data["inventory"]:
-            return False
-
         now = datetime.datetime.now()
 
         # Check for active streak shield
@@ -1154,7 +1548,7 @@ class GamificationSystem:
                     self.data["inventory"]["boosters"].pop(i)
 
                     # Add to activity history
-                    self.data["activity_history"].append({
+                    self._log_activity({
                         "date": now.isoformat(),
                         "action": "Bouclier de Série utilisé",
                         "points": 0,
@@ -1165,147 +1559,230 @@ class GamificationSystem:
 
         return False
 
-    def _refresh_quests(self) -> None:
-        """Refresh daily and weekly quests if needed"""
+    def _refresh_quests(self) -> bool:
+        """
+        Draw new daily and weekly quests when their period is over
+
+        Returns:
+            True if quests were drawn
+        """
         today = datetime.date.today()
+        refreshed = False
+
+        if self.data["quests"].get("last_refresh") != quests.period_key("daily", today):
+            self.data["quests"]["daily"] = quests.generate("daily")
+            self.data["quests"]["last_refresh"] = quests.period_key("daily", today)
+            refreshed = True
+
+        if self.data["quests"].get("week") != quests.period_key("weekly", today):
+            self.data["quests"]["weekly"] = quests.generate("weekly")
+            self.data["quests"]["week"] = quests.period_key("weekly", today)
+            refreshed = True
+
+        if refreshed:
+            self._index_quests()
+        return refreshed
+
+    def _index_quests(self) -> None:
+        """Index the active quests by the event types they subscribe to"""
+        self._quest_index = {}
+        for period in ("daily", "weekly"):
+            for quest in self.data["quests"].get(period, []):
+                template = quests.TEMPLATES_BY_ID.get(quest.get("id"))
+                if template is None:
+                    continue
+                for event_type in template["events"]:
+                    self._quest_index.setdefault(event_type, []).append(quest)
+
+    def _advance_quests(self, event_type: str) -> None:
+        """
+        Count an event for the quests subscribed to it
 
-        # Initialize quests if needed
-        if "quests" not in self.data:
-            self.data["quests"] = {
-                "daily": [],
-                "weekly": [],
-                "last_refresh": None
-            }
+        Args:
+            event_type: Event type (see gamification.EVENT_TYPES)
+        """
+        changed = self._refresh_quests()
+        today = datetime.date.today().isoformat()
 
-        last_refresh = self.data["quests"].get("last_refresh")
-
-        # If never refreshed or last refresh was not today
-        if not last_refresh or datetime.date.fromisoformat(last_refresh) < today:
-            # Generate new daily quests
-            self.data["quests"]["daily"] = self._generate_daily_quests()
-            self.data["quests"]["last_refresh"] = today.isoformat()
-
-            # Check if we need to refresh weekly quests (Monday)
-            if not last_refresh or today.weekday() == 0 and datetime.date.fromisoformat(last_refresh).weekday() != 0:
-                self.data["quests"]["weekly"] = self._generate_weekly_quests()
-
-    def _generate_daily_quests(self) -> List[Dict[str, Any]]:
-        """Generate random daily quests"""
-        possible_quests = [
-            {"id": "login", "name": "Connexion Quotidienne", "description": "Connectez-vous aujourd'hui", "xp": 20, "completed": True},
-            {"id": "check_grades", "name": "Vérifier les Notes", "description": "Consultez vos notes aujourd'hui", "xp": 30, "completed": False},
-            {"id": "check_timetable", "name": "Vérifier l'Emploi du Temps", "description": "Consultez votre emploi du temps aujourd'hui", "xp": 30, "completed": False},
-            {"id": "complete_homework", "name": "Terminer un Devoir", "description": "Marquez un devoir comme terminé", "xp": 50, "completed": False},
-            {"id": "send_message", "name": "Envoyer un Message", "description": "Envoyez un message à un enseignant ou camarade", "xp": 40, "completed": False}
-        ]
+        for quest in self._quest_index.get(event_type, ()):
+            if quest["completed"]:
+                continue
+            changed = True
+            # The index holds the quests themselves, mark the key they live in
+            self.data.touched.add("quests")
+            if quests.advance(quest, today):
+                self._complete_quest(quest)
 
-        # Always include login quest and 2 random others
-        quests = [possible_quests[0]]
-        quests.extend(random.sample(possible_quests[1:], 2))
+        if changed:
+            self._save_data()
 
-        return quests
+    def _complete_quest(self, quest: Dict[str, Any]) -> None:
+        """
+        Award the XP of a completed quest
 
-    def _generate_weekly_quests(self) -> List[Dict[str, Any]]:
-        """Generate random weekly quests"""
-        possible_quests = [
-            {"id": "login_streak_5", "name": "Série de 5 Jours", "description": "Connectez-vous 5 jours cette semaine", "target": 5, "progress": 0, "xp": 100, "completed": False},
-            {"id": "complete_5_homework", "name": "5 Devoirs", "description": "Terminez 5 devoirs cette semaine", "target": 5, "progress": 0, "xp": 150, "completed": False},
-            {"id": "check_grades_3", "name": "Vérifier les Notes 3 Fois", "description": "Consultez vos notes 3 jours différents", "target": 3, "progress": 0, "xp": 80, "completed": False},
-            {"id": "send_3_messages", "name": "Envoyer 3 Messages", "description": "Envoyez 3 messages cette semaine", "target": 3, "progress": 0, "xp": 120, "completed": False}
-        ]
+        Args:
+            quest: The completed quest
+        """
+        quest["completed_at"] = datetime.datetime.now().isoformat()
 
-        # Select 3 random weekly quests
-        return random.sample(possible_quests, 3)
+        # Add to activity history
+        self._log_activity({
+            "date": quest["completed_at"],
+            "action": f"Quête terminée : {quest['name']}",
+            "points": 0,
+            "xp": quest["xp"]
+        })
 
-    def get_stats(self) -> Dict[str, Any]:
+        # Add XP
+        self.data["xp"] += quest["xp"]
+
+        # Update level
+        self._update_level()
+
+    def _mark_stats_dirty(self, fields: List[str], previous_seq: int) -> None:
         """
-        Get user's gamification stats
+        Flag changed fields so the stats sections built from them are recomputed
+
+        Args:
+            fields: Top-level keys of the data that changed
+            previous_seq: Sequence number of the event log before the save
+        """
+        with _stats_cache_lock:
+            cached = _stats_cache.get(self.username)
+            if cached is None:
+                return
+            if cached["seq"] != previous_seq:
+                # Another process wrote in between: the cache may miss other changes
+                _stats_cache.pop(self.username, None)
+                return
+            cached["dirty"].update(fields)
+            cached["seq"] = self.events.seq
+
+    def _compute_stats_section(self, name: str) -> Dict[str, Any]:
+        """
+        Build one section of the stats view
+
+        Args:
+            name: Section name (see STATS_SECTIONS)
 
         Returns:
-            Dict with user stats
+            Dict with the section values
         """
-        # Ensure we have all the required fields
-        if "xp" not in self.data:
-            self.data["xp"] = 0
+        if name == "progress":
+            return {
+                "points": self.data["points"],
+                "xp": self.data["xp"],
+                "level": self.data["level"],
+                "next_level_xp": self.data["next_level_xp"],
+                "xp_progress": min(100, int((self.data["xp"] / self.data["next_level_xp"]) * 100)),
+                "streak": {
+                    "current": self.data["streak"]["current"],
+                    "max": self.data["streak"]["max"],
+                    "flame_level": self.data["streak"]["flame_level"],
+                    "flame_emoji": self._get_flame_emoji(),
+                    "multiplier": self.data["streak"]["multiplier"]
+                }
+            }
 
-        if "next_level_xp" not in self.data:
-            self.data["next_level_xp"] = int(100 * (self.data["level"] ** 1.5))
+        if name == "achievements":
+            return {"achievements": {
+                "total": len(self.data["achievements"]),
+                "recent": self.data["achievements"][-3:]
+            }}
 
-        if "flame_level" not in self.data["streak"]:
-            self._update_flame_level()
+        if name == "badges":
+            return {"badges": {
+                "total": len(self.data["badges"]),
+                "recent": self.data["badges"][-3:],
+                "all": list(self.data["badges"])
+            }}
 
-        # Initialize badges if needed
-        if "badges" not in self.data:
-            self.data["badges"] = []
+        if name == "activity":
+            return {"activity": {field: self.data[field] for field in STATS_SECTIONS["activity"]}}
 
-        # Get active boosters
-        active_boosters = []
-        if "inventory" in self.data and "boosters" in self.data["inventory"]:
+        if name == "inventory":
+            # Active boosters stay valid until the first of them expires
             now = datetime.datetime.now()
+            active_boosters = []
+            next_expiry = None
             for booster in self.data["inventory"]["boosters"]:
                 expires = datetime.datetime.fromisoformat(booster["expires"])
                 if expires > now:
                     active_boosters.append(booster)
+                    next_expiry = expires if next_expiry is None else min(next_expiry, expires)
 
-        # Get quests
-        quests = self.data.get("quests", {"daily": [], "weekly": []})
-
-        # Ensure study_plans exists
-        if "study_plans" not in self.data:
-            self.data["study_plans"] = []
+            return {
+                "boosters": active_boosters,
+                "inventory": {
+                    "avatars": list(self.data["inventory"]["avatars"]),
+                    "themes": list(self.data["inventory"]["themes"])
+                },
+                "_valid_until": next_expiry
+            }
 
-        # Get available avatars and themes
-        avatars = self.data.get("inventory", {}).get("avatars", ["default"])
-        themes = self.data.get("inventory", {}).get("themes", ["default"])
+        if name == "study_plans":
+            # Upcoming tests stay valid until the day changes
+            today = datetime.date.today()
+            active = [p for p in self.data["study_plans"] if not p.get("completed", False)]
+            upcoming = sorted(
+                [p for p in active if datetime.date.fromisoformat(p.get("test_date")) >= today],
+                key=lambda x: x.get("test_date")
+            )
 
-        return {
-            "points": self.data["points"],
-            "xp": self.data["xp"],
-            "level": self.data["level"],
-            "next_level_xp": self.data["next_level_xp"],
-            "xp_progress": min(100, int((self.data["xp"] / self.data["next_level_xp"]) * 100)),
-            "streak": {
-                "current": self.data["streak"]["current"],
-                "max": self.data["streak"]["max"],
-                "flame_level": self.data["streak"].get("flame_level", 0),
-                "flame_emoji": self._get_flame_emoji(),
-                "multiplier": self.data["streak"].get("multiplier", 1.0)
-            },
-            "achievements": {
-                "total": len(self.data["achievements"]),
-                "recent": self.data["achievements"][-3:] if self.data["achievements"] else []
-            },
-            "badges": {
-                "total": len(self.data["badges"]),
-                "recent": self.data["badges"][-3:] if self.data["badges"] else [],
-                "all": self.data["badges"]
-            },
-            "activity": {
-                "completed_homework": self.data["completed_homework"],
-                "viewed_grades": self.data["viewed_grades"],
-                "checked_timetable": self.data["checked_timetable"],
-                "sent_messages": self.data["sent_messages"]
-            },
-            "recent_activity": self.data["activity_history"][-5:] if self.data["activity_history"] else [],
-            "boosters": active_boosters,
-            "quests": quests,
-            "inventory": {
-                "avatars": avatars,
-                "themes": themes
-            },
-            "study_plans": {
-                "total": len(self.data.get("study_plans", [])),
-                "active": len([p for p in self.data.get("study_plans", []) if not p.get("completed", False)]),
-                "completed": len([p for p in self.data.get("study_plans", []) if p.get("completed", False)]),
-                "upcoming_tests": sorted(
-                    [p for p in self.data.get("study_plans", [])
-                     if not p.get("completed", False) and
-                     datetime.date.fromisoformat(p.get("test_date")) >= datetime.date.today()],
-                    key=lambda x: x.get("test_date")
-                )[:3]  # Get the next 3 upcoming tests
+            return {
+                "study_plans": {
+                    "total": len(self.data["study_plans"]),
+                    "active": len(active),
+                    "completed": len(self.data["study_plans"]) - len(active),
+                    "upcoming_tests": upcoming[:3]  # Get the next 3 upcoming tests
+                },
+                "_valid_until": datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time())
             }
-        }
-    
+
+        raise ValueError(f"Unknown stats section: {name}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get user's gamification stats
+
+        Sections are cached per user and only recomputed when a field they
+        are built from changed, or when a time-dependent section (active
+        boosters, upcoming tests) reaches its next expiry.
+
+        Returns:
+            Dict with user stats
+        """
+        # Get quests (drawn again when their period is over)
+        with self.transaction():
+            if self._refresh_quests():
+                self._save_data()
+
+        with _stats_cache_lock:
+            cached = _stats_cache.get(self.username)
+            if cached is None or cached["seq"] != self.events.seq:
+                cached = {"seq": self.events.seq, "dirty": set(), "sections": {}}
+                _stats_cache[self.username] = cached
+            _stats_cache.move_to_end(self.username)
+            while len(_stats_cache) > STATS_CACHE_SIZE:
+                _stats_cache.popitem(last=False)
+
+        # Take the dirty flags before computing, so changes made meanwhile are kept
+        dirty, cached["dirty"] = cached["dirty"], set()
+        now = datetime.datetime.now()
+
+        stats = {}
+        for name, fields in STATS_SECTIONS.items():
+            section = cached["sections"].get(name)
+            if (section is None or dirty.intersection(fields) or
+                    (section.get("_valid_until") is not None and now >= section["_valid_until"])):
+                section = self._compute_stats_section(name)
+                cached["sections"][name] = section
+            stats.update({key: value for key, value in section.items() if not key.startswith("_")})
+
+        stats["recent_activity"] = self.get_activity_history(5)
+        stats["quests"] = self.data["quests"]
+        return stats
+
     def get_achievements(self) -> List[Dict[str, Any]]:
         """
         Get user's achievements
@@ -1322,8 +1799,6 @@ class GamificationSystem:
         Returns:
             List of badges
         """
-        if "badges" not in self.data:
-            self.data["badges"] = []
         return self.data["badges"]
 
     def get_activity_history(self, limit: int = 20) -> List[Dict[str, Any]]:
@@ -1336,44 +1811,153 @@ class GamificationSystem:
         Returns:
             List of activity entries
         """
-        return self.data["activity_history"][-limit:] if self.data["activity_history"] else []
+        entries = list(islice(reversed(self.data["activity_history"]), limit))
+        entries.reverse()
+        return entries
+
+    def get_activity_page(self, cursor: Optional[int] = None, limit: int = 20) -> Dict[str, Any]:
+        """
+        Get a page of the full activity history, newest first
+
+        Entries recorded before the event log existed are only kept in the
+        document's activity history; they follow the logged ones, with a
+        negative cursor and no "seq".
+
+        Args:
+            cursor: Value of "next_cursor" returned by the previous page (None
+                for the newest entries)
+            limit: Maximum number of entries to return
+
+        Returns:
+            Dict with the entries ("seq" added to each one) and the cursor of
+            the next page (None when there is nothing older)
+        """
+        items = []
+        if cursor is None or cursor > 0:
+            for event in self.events.iter_events_reverse(before_seq=cursor, event_type="activity"):
+                if len(items) == limit:
+                    return {"items": items, "next_cursor": items[-1]["seq"]}
+                entry = dict(event["entry"])
+                entry["seq"] = event["seq"]
+                items.append(entry)
+
+        legacy = self._legacy_activity()
+        end = len(legacy) if cursor is None or cursor > 0 else min(-cursor, len(legacy))
+        start = max(0, end - (limit - len(items)))
+        for entry in reversed(legacy[start:end]):
+            entry = dict(entry)
+            entry["seq"] = None
+            items.append(entry)
+
+        return {"items": items, "next_cursor": -start if start > 0 else None}
+
+    def _legacy_activity(self) -> List[Dict[str, Any]]:
+        """
+        Get the entries of the activity history older than the event log
+
+        Returns:
+            List of activity entries, oldest first
+        """
+        history = list(self.data["activity_history"])
+        oldest = next((event["entry"] for event in self.events.iter_events(event_type="activity")), None)
+        if oldest is None:
+            return history
+
+        for i, entry in enumerate(history):
+            if entry == oldest:
+                return history[:i]
+        return []
     
-    def get_leaderboard(self, top_n: int = 10) -> List[Dict[str, Any]]:
+    def get_leaderboard_entry(self) -> Dict[str, Any]:
+        """
+        Get the ranking columns of the user
+
+        Returns:
+            Leaderboard entry of the user
+        """
+        return leaderboard_entry(self.username, self.data)
+
+    def _leaderboard_query(self, scope: str, subject: Optional[str]) -> Dict[str, Any]:
+        """
+        Resolve a leaderboard scope to the filters of the index
+
+        Args:
+            scope: One of LEADERBOARD_SCOPES
+            subject: Subject of the "subject" scope
+
+        Returns:
+            Dict with the rolling total key ("total", None for all-time
+            ranks) and the school and class filters
+        """
+        if scope not in LEADERBOARD_SCOPES:
+            raise ValueError(f"Unknown leaderboard scope: {scope}")
+
+        school = self.data["profile"].get("school") or ""
+        query = {"total": None, "school": None, "class_name": None}
+
+        if scope == "class":
+            query["school"] = school
+            query["class_name"] = self.data["profile"].get("class_name") or ""
+        elif scope == "school":
+            query["school"] = school
+        elif scope in ("week", "month"):
+            query["total"] = period_keys(datetime.date.today())[scope]
+            query["school"] = school
+        elif scope == "subject":
+            if not subject:
+                raise ValueError("The subject leaderboard needs a subject")
+            query["total"] = subject_key(subject)
+            query["school"] = school
+
+        return query
+
+    def get_leaderboard(self, top_n: int = 10, scope: str = "global",
+                        subject: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         Get leaderboard of top users
         
         Args:
             top_n: Number of top users to return
+            scope: "global", "school" or "class" rank by level then XP;
+                "week", "month" and "subject" rank by the XP earned in the
+                current week, month or subject, among the user's school
+            subject: Subject of the "subject" scope
             
         Returns:
-            List of top users
+            List of top users ("scope_xp" holds the XP of rolling scopes)
         """
-        leaderboard = []
-        
-        # Get all user files
-        for file in GAMIFICATION_DIR.glob("*.json"):
-            try:
-                with open(file, 'r') as f:
-                    user_data = json.load(f)
-                    username = file.stem
-                    
-                    leaderboard.append({
-                        "username": username,
-                        "points": user_data.get("points", 0),
-                        "xp": user_data.get("xp", 0),
-                        "level": user_data.get("level", 1),
-                        "streak": user_data.get("streak", {}).get("current", 0),
-                        "flame_level": user_data.get("streak", {}).get("flame_level", 0)
-                    })
-            except Exception as e:
-                print(f"Error loading leaderboard data for {file}: {e}")
-        
-        # Sort by level first, then by XP (descending)
-        leaderboard.sort(key=lambda x: (x["level"], x["xp"]), reverse=True)
-        
-        # Return top N
-        return leaderboard[:top_n]
+        try:
+            query = self._leaderboard_query(scope, subject)
+            index = get_leaderboard_index()
+            if query["total"]:
+                return index.top_scope(query["total"], top_n, school=query["school"])
+            return index.top(top_n, school=query["school"], class_name=query["class_name"])
+        except Exception as e:
+            print(f"Error loading leaderboard: {e}")
+            return []
+
+    def get_rank(self, scope: str = "global", subject: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get the rank of the user on the leaderboard
+
+        Args:
+            scope: Leaderboard scope (see get_leaderboard)
+            subject: Subject of the "subject" scope
+
+        Returns:
+            Leaderboard entry of the user with its rank, or None if unavailable
+        """
+        try:
+            query = self._leaderboard_query(scope, subject)
+            index = get_leaderboard_index()
+            if query["total"]:
+                return index.rank_scope(query["total"], self.username, school=query["school"])
+            return index.rank(self.username, school=query["school"], class_name=query["class_name"])
+        except Exception as e:
+            print(f"Error loading leaderboard rank: {e}")
+            return None
 
+    @_transactional
     def create_study_plan(self, test_name: str, test_date: str, subject: str, num_exercises: int) -> Dict[str, Any]:
         """
         Create a new study plan for an upcoming test
@@ -1387,13 +1971,6 @@ class GamificationSystem:
         Returns:
             Dict with the created study plan
         """
-        # Initialize study_plans if it doesn't exist
-        if "study_plans" not in self.data:
-            self.data["study_plans"] = []
-
-        # Also initialize in both default data structures
-        # This ensures it's always available for new users
-
         # Generate a unique ID for the study plan
         plan_id = f"plan_{len(self.data['study_plans']) + 1}_{int(datetime.datetime.now().timestamp())}"
 
@@ -1417,13 +1994,14 @@ class GamificationSystem:
         self._save_data()
 
         # Award points for creating a study plan
-        self.add_points(10, f"Plan d'étude créé pour {test_name}")
+        self.add_points(10, f"Plan d'étude créé pour {test_name}", subject=subject)
 
         # Check for study plan achievements
-        self._check_study_plan_achievements()
+        self._check_achievements("study_plans_created")
 
         return study_plan
 
+    @_transactional
     def track_exercise_completion(self, plan_id: str) -> Dict[str, Any]:
         """
         Track completion of an exercise for a study plan
@@ -1434,11 +2012,6 @@ class GamificationSystem:
         Returns:
             Dict with updated study plan and points information
         """
-        # Initialize study_plans if it doesn't exist
-        if "study_plans" not in self.data:
-            self.data["study_plans"] = []
-            return {"success": False, "message": "Plan d'étude non trouvé"}
-
         # Find the study plan
         study_plan = None
         for plan in self.data["study_plans"]:
@@ -1480,11 +2053,11 @@ class GamificationSystem:
             points_earned += bonus_points
             message += f" (Plan complété ! +{bonus_points} points bonus)"
 
-        self.add_points(points_earned, message)
+        self.add_points(points_earned, message, subject=study_plan.get("subject"))
 
         # Check for study plan achievements if plan was completed
         if study_plan["completed"]:
-            self._check_study_plan_achievements()
+            self._check_achievements("study_plans_completed")
 
         return {
             "success": True,
@@ -1500,12 +2073,10 @@ class GamificationSystem:
         Returns:
             List of study plans
         """
-        if "study_plans" not in self.data:
-            self.data["study_plans"] = []
-
         # Sort by test date (ascending)
         return sorted(self.data["study_plans"], key=lambda x: x["test_date"])
 
+    @_transactional
     def delete_study_plan(self, plan_id: str) -> Dict[str, Any]:
         """
         Delete a study plan
@@ -1516,9 +2087,6 @@ class GamificationSystem:
         Returns:
             Dict with success status
         """
-        if "study_plans" not in self.data:
-            return {"success": False, "message": "Plan d'étude non trouvé"}
-
         # Find the study plan
         for i, plan in enumerate(self.data["study_plans"]):
             if plan["id"] == plan_id:
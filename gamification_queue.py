@@ -0,0 +1,275 @@
+"""
+Background queue for gamification side effects
+
+Request handlers submit gamification events (login, grade view, timetable
+view, ...) instead of running GamificationSystem synchronously. A worker
+thread applies them, one process_events batch per user, and keeps the
+resulting messages as notifications that are flashed on the next page load
+or fetched by polling.
+
+The backlog is bounded: when it is full, the event is applied in the
+request thread. Every queued event is also appended to a spool file, which
+is rewritten with the remaining backlog after each batch, so the events a
+crash or a restart leaves behind are replayed at the next start. Every event
+carries an id, so an event replayed after a partial run is deduplicated by
+process_events.
+"""
+
+import atexit
+import datetime
+import os
+import queue
+import threading
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, List, Any, Optional, Tuple
+import json_codec
+from gamification import GamificationSystem, GAMIFICATION_DIR, MAX_EVENT_BATCH, user_lock
+
+# Spool of the queued events (the backlog as of the last applied batch)
+GAMIFICATION_SPOOL_FILE = GAMIFICATION_DIR / 'queue_spool.ndjson'
+
+# Maximum number of queued events (0 applies every event synchronously)
+QUEUE_MAXSIZE = int(os.environ.get('FIREFLIES_GAMIFICATION_QUEUE_SIZE', '1000'))
+
+# Notifications kept per user until they are delivered
+NOTIFICATIONS_LIMIT = 20
+
+_gamification_queue = None
+
+
+class GamificationQueue:
+    """Bounded queue of gamification events applied by a worker thread"""
+
+    def __init__(self, maxsize: int = QUEUE_MAXSIZE, spool_file=GAMIFICATION_SPOOL_FILE):
+        """
+        Initialize the queue
+
+        Args:
+            maxsize: Maximum number of queued events
+            spool_file: File holding the queued events
+        """
+        self.maxsize = maxsize
+        self.spool_file = spool_file
+        self._queue = queue.Queue(maxsize=max(maxsize, 1))
+        self._notifications = {}
+        self._lock = threading.Lock()
+        # Serializes the spool writes with the queue puts they record
+        self._spool_lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._atexit_registered = False
+
+    def start(self) -> None:
+        """Replay the spooled events and start the worker thread"""
+        if self.maxsize <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+
+        # Queue the spooled events before the worker can rewrite the spool
+        overflow = []
+        with self._spool_lock:
+            for item in self._read_spool():
+                try:
+                    self._queue.put_nowait(item)
+                except queue.Full:
+                    overflow.append(item)
+        self._apply(overflow)
+        self._rewrite_spool()
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="gamification-queue", daemon=True)
+        self._thread.start()
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stop the worker, leaving the events it did not apply in the spool
+
+        Args:
+            timeout: Seconds to wait for the event being applied
+        """
+        if self._thread is None:
+            return
+
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+        # The spool keeps them for the next start
+        self._rewrite_spool()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def submit(self, username: str, event_type: str, **fields: Any) -> Dict[str, Any]:
+        """
+        Queue a gamification event
+
+        Args:
+            username: The username of the user
+            event_type: Event type (see gamification.EVENT_TYPES)
+            fields: Fields required by the event type
+
+        Returns:
+            The queued event
+        """
+        event = {"id": uuid.uuid4().hex, "type": event_type,
+                 "timestamp": datetime.datetime.now().isoformat()}
+        event.update(fields)
+        self._put(username, event)
+        return event
+
+    def pop_notifications(self, username: str) -> List[str]:
+        """
+        Get and clear the messages of the events applied for a user
+
+        Args:
+            username: The username of the user
+
+        Returns:
+            List of messages, oldest first
+        """
+        with self._lock:
+            messages = self._notifications.pop(username, None)
+        return list(messages) if messages else []
+
+    def pending(self) -> int:
+        """
+        Get the number of queued events
+
+        Returns:
+            Approximate size of the backlog
+        """
+        return self._queue.qsize()
+
+    def _put(self, username: str, event: Dict[str, Any]) -> None:
+        """Queue an event, or apply it now when the worker is off or the backlog is full"""
+        if self._thread is not None and not self._stopping.is_set():
+            with self._spool_lock:
+                try:
+                    self._queue.put_nowait((username, event))
+                except queue.Full:
+                    pass
+                else:
+                    self._append_spool([(username, event)])
+                    return
+        self._apply([(username, event)])
+
+    def _run(self) -> None:
+        """Apply queued events until the queue is stopped"""
+        while not self._stopping.is_set():
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+
+            # Coalesce what is already waiting into per-user batches
+            while len(batch) < MAX_EVENT_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._apply(batch)
+            self._rewrite_spool()
+
+    def _apply(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """Apply events with one process_events call per user"""
+        by_user = OrderedDict()
+        for username, event in batch:
+            by_user.setdefault(username, []).append(event)
+
+        for username, events in by_user.items():
+            try:
+                with user_lock(username):
+                    summary = GamificationSystem(username).process_events(events)
+            except Exception as e:
+                print(f"Error applying gamification events for {username}: {e}")
+                continue
+
+            messages = [item["result"]["message"] for item in summary["results"]
+                        if item["result"].get("points_earned", 0) > 0 and item["result"].get("message")]
+            if messages:
+                with self._lock:
+                    self._notifications.setdefault(username, deque(maxlen=NOTIFICATIONS_LIMIT)).extend(messages)
+
+    def _read_spool(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Read the spooled events"""
+        if not self.spool_file.exists():
+            return []
+
+        items = []
+        try:
+            with open(self.spool_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        try:
+                            record = json_codec.loads(line)
+                        except ValueError:
+                            # A crash mid-append leaves a partial last line
+                            continue
+                        items.append((record["username"], record["event"]))
+        except Exception as e:
+            print(f"Error reading gamification spool: {e}")
+        return items
+
+    def _append_spool(self, items: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """Append events to the spool file (under the spool lock)"""
+        try:
+            os.makedirs(self.spool_file.parent, exist_ok=True)
+            with open(self.spool_file, 'a', encoding='utf-8') as f:
+                for username, event in items:
+                    f.write(json_codec.dumps({"username": username, "event": event}, pretty=False) + "\n")
+        except Exception as e:
+            print(f"Error writing gamification spool: {e}")
+
+    def _rewrite_spool(self) -> None:
+        """Replace the spool with the events still queued"""
+        with self._spool_lock:
+            with self._queue.mutex:
+                items = list(self._queue.queue)
+
+            try:
+                if not items:
+                    if self.spool_file.exists():
+                        os.remove(self.spool_file)
+                    return
+
+                temp = self.spool_file.with_name(self.spool_file.name + ".tmp")
+                os.makedirs(self.spool_file.parent, exist_ok=True)
+                with open(temp, 'w', encoding='utf-8') as f:
+                    for username, event in items:
+                        f.write(json_codec.dumps({"username": username, "event": event}, pretty=False) + "\n")
+                os.replace(temp, self.spool_file)
+            except Exception as e:
+                print(f"Error writing gamification spool: {e}")
+
+
+def get_gamification_queue() -> GamificationQueue:
+    """
+    Get the shared gamification queue
+
+    Returns:
+        The queue (events are applied synchronously until it is started)
+    """
+    global _gamification_queue
+    if _gamification_queue is None:
+        _gamification_queue = GamificationQueue()
+    return _gamification_queue
+
+
+def start_gamification_queue() -> Optional[GamificationQueue]:
+    """
+    Start the worker thread of the shared queue
+
+    Returns:
+        The queue, or None if QUEUE_MAXSIZE disables it
+    """
+    if QUEUE_MAXSIZE <= 0:
+        return None
+    gamification_queue = get_gamification_queue()
+    gamification_queue.start()
+    return gamification_queue
@@ -0,0 +1,87 @@
+"""
+Identifiers for flashcard sets and cards
+
+Ids are ULIDs: 48 bits of milliseconds since the epoch followed by 80 random
+bits, written as 26 Crockford base32 characters. They sort by creation time
+as plain strings, and ids made in the same millisecond by this process are
+kept increasing, so a batch of cards created at once cannot collide.
+"""
+
+import datetime
+import os
+import threading
+from typing import Optional
+
+# Crockford base32 alphabet (no I, L, O or U)
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+# Length of an id
+ID_LENGTH = 26
+
+_RANDOM_BITS = 80
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+
+def _encode(value: int) -> str:
+    """Write a 128-bit integer as 26 base32 characters"""
+    chars = []
+    for _ in range(ID_LENGTH):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def new_id(when: Optional[datetime.datetime] = None) -> str:
+    """
+    Generate a new id
+
+    Args:
+        when: Creation time to encode in the id (defaults to now); used to
+            give migrated records an id that sorts by their creation date
+
+    Returns:
+        The id as a 26-character string
+    """
+    global _last_ms, _last_random
+
+    ms = int((when or datetime.datetime.now()).timestamp() * 1000)
+    with _lock:
+        if ms == _last_ms and _last_random + 1 < 1 << _RANDOM_BITS:
+            # Same millisecond: keep the ids increasing
+            random_part = _last_random + 1
+        else:
+            random_part = int.from_bytes(os.urandom(_RANDOM_BITS // 8), "big")
+        _last_ms, _last_random = ms, random_part
+
+    return _encode(ms << _RANDOM_BITS | random_part)
+
+
+def is_id(value: Optional[str]) -> bool:
+    """
+    Check if a value is an id made by new_id
+
+    Args:
+        value: The value to check
+
+    Returns:
+        True if the value is a 26-character base32 id
+    """
+    return isinstance(value, str) and len(value) == ID_LENGTH and all(char in ALPHABET for char in value)
+
+
+def id_time(value: str) -> datetime.datetime:
+    """
+    Get the creation time encoded in an id
+
+    Args:
+        value: The id
+
+    Returns:
+        The creation time (server-local, naive)
+    """
+    number = 0
+    for char in value:
+        number = number << 5 | ALPHABET.index(char)
+    return datetime.datetime.fromtimestamp((number >> _RANDOM_BITS) / 1000)
@@ -0,0 +1,111 @@
+"""
+JSON codec shared by every module that persists data under data/
+
+Uses orjson when it is installed and falls back to the standard library
+otherwise. Output is compact by default; set FIREFLIES_PRETTY_JSON=1 to get
+indented files when debugging.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Write indented JSON files (for debugging)
+PRETTY_JSON = os.environ.get('FIREFLIES_PRETTY_JSON', '').lower() in ('1', 'true', 'yes')
+
+# Name of the backend in use
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumps(obj: Any, pretty: bool = None, sort_keys: bool = False) -> str:
+    """
+    Serialize an object to a JSON string
+
+    Args:
+        obj: The object to serialize (unknown types are converted with str)
+        pretty: Indent the output (defaults to PRETTY_JSON)
+        sort_keys: Sort the keys of dicts
+
+    Returns:
+        The JSON string
+    """
+    return _dumps_bytes(obj, pretty, sort_keys).decode('utf-8')
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """
+    Deserialize a JSON string
+
+    Args:
+        data: The JSON document
+
+    Returns:
+        The deserialized object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load(path: Union[str, Path]) -> Any:
+    """
+    Load a JSON file
+
+    Args:
+        path: Path of the file
+
+    Returns:
+        The deserialized object
+    """
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def dump(obj: Any, path: Union[str, Path], pretty: bool = None) -> None:
+    """
+    Write an object to a JSON file
+
+    Args:
+        obj: The object to serialize
+        path: Path of the file
+        pretty: Indent the output (defaults to PRETTY_JSON)
+    """
+    data = _dumps_bytes(obj, pretty)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _dumps_bytes(obj: Any, pretty: bool = None, sort_keys: bool = False) -> bytes:
+    """
+    Serialize an object to UTF-8 encoded JSON
+
+    Args:
+        obj: The object to serialize
+        pretty: Indent the output (defaults to PRETTY_JSON)
+        sort_keys: Sort the keys of dicts
+
+    Returns:
+        The encoded JSON document
+    """
+    if pretty is None:
+        pretty = PRETTY_JSON
+
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=str, option=option)
+
+    if pretty:
+        text = json.dumps(obj, indent=2, ensure_ascii=False, default=str, sort_keys=sort_keys)
+    else:
+        text = json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=str, sort_keys=sort_keys)
+    return text.encode('utf-8')
@@ -0,0 +1,409 @@
+"""
+Leaderboard index for the gamification module
+
+The ranking columns of every user are kept in a SQLite table ordered by an
+index on (level, xp), so the top of the leaderboard and the rank of a user
+are read from the index instead of loading every gamification document.
+
+Scoped leaderboards are served from the same database: the school and class
+of each user are columns of the ranking table, and the XP earned per week,
+per month and per subject is kept in rolling totals updated with every save.
+"""
+
+import datetime
+import os
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Iterator, Iterable, Tuple
+
+# Version of the tables, the index is rebuilt when it changes
+INDEX_VERSION = 2
+
+# Scopes of the rolling XP totals
+PERIOD_SCOPES = ("week", "month")
+
+# Days of weekly and monthly totals kept by prune()
+WINDOW_RETENTION_DAYS = 400
+
+
+def period_keys(date: datetime.date) -> Dict[str, str]:
+    """
+    Get the keys of the periods containing a date
+
+    Args:
+        date: The date
+
+    Returns:
+        Dict mapping each period scope to its key (ISO week, month)
+    """
+    iso = date.isocalendar()
+    return {
+        "week": f"week:{iso[0]}-W{iso[1]:02d}",
+        "month": f"month:{date.year}-{date.month:02d}"
+    }
+
+
+def subject_key(subject: str) -> str:
+    """
+    Get the key of the XP total of a subject
+
+    Args:
+        subject: The subject name
+
+    Returns:
+        Scope key of the subject
+    """
+    return f"subject:{subject.strip().lower()}"
+
+
+def xp_totals(activity: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Sum the XP of activity entries per period and subject
+
+    Args:
+        activity: Activity entries (date, xp and optional subject)
+
+    Returns:
+        Dict mapping scope keys to XP
+    """
+    totals = {}
+    for entry in activity:
+        xp = entry.get("xp") or 0
+        if xp <= 0:
+            continue
+        try:
+            date = datetime.datetime.fromisoformat(entry["date"]).date()
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        keys = list(period_keys(date).values())
+        if entry.get("subject"):
+            keys.append(subject_key(entry["subject"]))
+        for key in keys:
+            totals[key] = totals.get(key, 0) + xp
+    return totals
+
+
+class LeaderboardIndex:
+    """SQLite table of the ranking columns of every user"""
+
+    def __init__(self, db_path: Path):
+        """
+        Initialize the leaderboard index
+
+        Args:
+            db_path: Path of the SQLite database
+        """
+        self.db_path = Path(db_path)
+        os.makedirs(self.db_path.parent, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if version is None or int(version[0]) != INDEX_VERSION:
+                conn.execute("DROP TABLE IF EXISTS leaderboard")
+                conn.execute("DROP TABLE IF EXISTS xp_totals")
+                conn.execute("DELETE FROM meta")
+                conn.execute("INSERT INTO meta (key, value) VALUES ('version', ?)", (str(INDEX_VERSION),))
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leaderboard (
+                    username TEXT PRIMARY KEY,
+                    points INTEGER NOT NULL DEFAULT 0,
+                    xp INTEGER NOT NULL DEFAULT 0,
+                    level INTEGER NOT NULL DEFAULT 1,
+                    streak INTEGER NOT NULL DEFAULT 0,
+                    flame_level INTEGER NOT NULL DEFAULT 0,
+                    school TEXT NOT NULL DEFAULT '',
+                    class_name TEXT NOT NULL DEFAULT '',
+                    updated_at TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS leaderboard_rank
+                ON leaderboard (level DESC, xp DESC, username)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS leaderboard_school_rank
+                ON leaderboard (school, level DESC, xp DESC, username)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS leaderboard_class_rank
+                ON leaderboard (school, class_name, level DESC, xp DESC, username)
+            """)
+            # Rolling XP per scope key (week:..., month:..., subject:...)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS xp_totals (
+                    scope TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    school TEXT NOT NULL DEFAULT '',
+                    xp INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (scope, username)
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS xp_totals_rank
+                ON xp_totals (scope, xp DESC, username)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS xp_totals_school_rank
+                ON xp_totals (scope, school, xp DESC, username)
+            """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a short-lived connection committed and closed on exit"""
+        conn = sqlite3.connect(str(self.db_path), timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def is_built(self) -> bool:
+        """
+        Check if the index was filled from the existing user files
+
+        Returns:
+            True if the index is complete
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'built'").fetchone()
+        return row is not None
+
+    def rebuild(self, entries: List[Dict[str, Any]]) -> None:
+        """
+        Replace the content of the index
+
+        Args:
+            entries: Leaderboard entries of every user, each with an optional
+                "xp_totals" dict mapping scope keys to XP
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM leaderboard")
+            conn.execute("DELETE FROM xp_totals")
+            conn.executemany(self._UPSERT_ENTRY, [self._row(entry) for entry in entries])
+            conn.executemany(
+                "INSERT OR REPLACE INTO xp_totals (scope, username, school, xp) VALUES (?, ?, ?, ?)",
+                [(scope, entry["username"], entry.get("school") or "", xp)
+                 for entry in entries for scope, xp in entry.get("xp_totals", {}).items()]
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', ?)",
+                         (datetime.datetime.now().isoformat(),))
+
+    def update(self, entry: Dict[str, Any], xp_deltas: Optional[Dict[str, int]] = None) -> None:
+        """
+        Insert or update the entry of one user
+
+        Args:
+            entry: Leaderboard entry (username, points, xp, level, streak,
+                flame_level, school, class_name)
+            xp_deltas: XP to add to the rolling totals, by scope key
+        """
+        row = self._row(entry)
+        with self._connect() as conn:
+            previous = conn.execute("SELECT school FROM leaderboard WHERE username = ?",
+                                    (row["username"],)).fetchone()
+            conn.execute(self._UPSERT_ENTRY, row)
+
+            # Totals carry the school so scoped windows are read from one index
+            if previous is not None and previous["school"] != row["school"]:
+                conn.execute("UPDATE xp_totals SET school = ? WHERE username = ?",
+                             (row["school"], row["username"]))
+
+            conn.executemany(
+                "INSERT INTO xp_totals (scope, username, school, xp) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (scope, username) DO UPDATE SET xp = xp + excluded.xp, school = excluded.school",
+                [(scope, row["username"], row["school"], xp) for scope, xp in (xp_deltas or {}).items() if xp]
+            )
+
+    def top(self, top_n: int = 10, school: Optional[str] = None,
+            class_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Get the top users by level, then XP
+
+        Args:
+            top_n: Number of users to return
+            school: Only rank the users of this school
+            class_name: Only rank the users of this class (within the school)
+
+        Returns:
+            List of leaderboard entries
+        """
+        where, params = self._scope_filter(school, class_name)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {self._COLUMNS} FROM leaderboard {where} "
+                "ORDER BY level DESC, xp DESC, username LIMIT ?",
+                params + [top_n]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def rank(self, username: str, school: Optional[str] = None,
+             class_name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get the rank of a user
+
+        Args:
+            username: The username
+            school: Rank among the users of this school
+            class_name: Rank among the users of this class (within the school)
+
+        Returns:
+            Leaderboard entry with its 1-based rank, or None if the user is not indexed
+        """
+        where, params = self._scope_filter(school, class_name)
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {self._COLUMNS} FROM leaderboard WHERE username = ?",
+                (username,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            # Users ahead are a prefix of the rank index: one range on (level, xp)
+            # and, among the ties, one range on username
+            scoped = f"{where} AND" if where else "WHERE"
+            ahead = conn.execute(
+                f"SELECT (SELECT COUNT(*) FROM leaderboard {scoped} (level, xp) > (?, ?)) + "
+                f"(SELECT COUNT(*) FROM leaderboard {scoped} level = ? AND xp = ? AND username < ?)",
+                params + [row["level"], row["xp"]] + params + [row["level"], row["xp"], username]
+            ).fetchone()[0]
+
+        entry = dict(row)
+        entry["rank"] = ahead + 1
+        return entry
+
+    def top_scope(self, scope: str, top_n: int = 10, school: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Get the top users of a rolling XP total
+
+        Args:
+            scope: Scope key (see period_keys and subject_key)
+            top_n: Number of users to return
+            school: Only rank the users of this school
+
+        Returns:
+            List of leaderboard entries with the XP of the scope as "scope_xp"
+        """
+        where, params = self._total_filter(scope, school)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {self._COLUMNS}, t.xp AS scope_xp FROM xp_totals t "
+                f"JOIN leaderboard USING (username) {where} "
+                "ORDER BY t.xp DESC, t.username LIMIT ?",
+                params + [top_n]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def rank_scope(self, scope: str, username: str, school: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get the rank of a user in a rolling XP total
+
+        Args:
+            scope: Scope key (see period_keys and subject_key)
+            username: The username
+            school: Rank among the users of this school
+
+        Returns:
+            Leaderboard entry with "scope_xp" and its 1-based rank, or None if
+            the user earned no XP in the scope
+        """
+        where, params = self._total_filter(scope, school)
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {self._COLUMNS}, t.xp AS scope_xp FROM xp_totals t "
+                "JOIN leaderboard USING (username) WHERE t.scope = ? AND t.username = ?",
+                (scope, username)
+            ).fetchone()
+            if row is None:
+                return None
+
+            # Same split as rank: a range on xp, then a range on username among the ties
+            ahead = conn.execute(
+                f"SELECT (SELECT COUNT(*) FROM xp_totals t {where} AND t.xp > ?) + "
+                f"(SELECT COUNT(*) FROM xp_totals t {where} AND t.xp = ? AND t.username < ?)",
+                params + [row["scope_xp"]] + params + [row["scope_xp"], username]
+            ).fetchone()[0]
+
+        entry = dict(row)
+        entry["rank"] = ahead + 1
+        return entry
+
+    def prune(self, today: Optional[datetime.date] = None,
+              retention_days: int = WINDOW_RETENTION_DAYS) -> int:
+        """
+        Delete the weekly and monthly totals older than the retention
+
+        Args:
+            today: Reference date (defaults to today)
+            retention_days: Days of periods to keep
+
+        Returns:
+            Number of rows deleted
+        """
+        oldest = period_keys((today or datetime.date.today()) - datetime.timedelta(days=retention_days))
+        deleted = 0
+        with self._connect() as conn:
+            for scope in PERIOD_SCOPES:
+                # Period keys are zero-padded, so they sort chronologically
+                deleted += conn.execute(
+                    "DELETE FROM xp_totals WHERE scope >= ? AND scope < ?",
+                    (f"{scope}:", oldest[scope])
+                ).rowcount
+        return deleted
+
+    def count(self) -> int:
+        """
+        Get the number of indexed users
+
+        Returns:
+            Number of rows in the index
+        """
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM leaderboard").fetchone()[0]
+
+    _COLUMNS = "username, points, leaderboard.xp AS xp, level, streak, flame_level, leaderboard.school AS school, class_name"
+
+    _UPSERT_ENTRY = (
+        "INSERT OR REPLACE INTO leaderboard "
+        "(username, points, xp, level, streak, flame_level, school, class_name, updated_at) "
+        "VALUES (:username, :points, :xp, :level, :streak, :flame_level, :school, :class_name, :updated_at)"
+    )
+
+    @staticmethod
+    def _scope_filter(school: Optional[str], class_name: Optional[str]) -> Tuple[str, List[Any]]:
+        """Build the WHERE clause restricting the ranking table to a school or class"""
+        clauses, params = [], []
+        if school is not None:
+            clauses.append("school = ?")
+            params.append(school)
+            if class_name is not None:
+                clauses.append("class_name = ?")
+                params.append(class_name)
+        return ("WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    @staticmethod
+    def _total_filter(scope: str, school: Optional[str]) -> Tuple[str, List[Any]]:
+        """Build the WHERE clause selecting one rolling total"""
+        if school is None:
+            return "WHERE t.scope = ?", [scope]
+        return "WHERE t.scope = ? AND t.school = ?", [scope, school]
+
+    @staticmethod
+    def _row(entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the SQL parameters of an entry"""
+        return {
+            "username": entry["username"],
+            "points": entry.get("points", 0),
+            "xp": entry.get("xp", 0),
+            "level": entry.get("level", 1),
+            "streak": entry.get("streak", 0),
+            "flame_level": entry.get("flame_level", 0),
+            "school": entry.get("school") or "",
+            "class_name": entry.get("class_name") or "",
+            "updated_at": datetime.datetime.now().isoformat()
+        }
@@ -16,16 +16,20 @@ from flask import Flask, render_template, request, redirect, url_for, session, f
 from typing import Optional, List, Dict, Any
 import secrets
 from pathlib import Path
+from urllib.parse import urlparse
 from translations import get_translation
-from gamification import GamificationSystem
+from gamification import GamificationSystem, LEADERBOARD_SCOPES, MAX_EVENT_BATCH, CLIENT_EVENT_TYPES
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 # Import our new features
 from study_analytics import StudyAnalytics
+from streaks import StreakService
 from flashcard_system import FlashcardManager
 from calendar_integration import CalendarIntegration
+from data_compaction import start_background_compaction
+from gamification_queue import get_gamification_queue, start_gamification_queue
 
 # Helper function to get homework for a user
 def get_homework_for_user(username, start_date=None):
@@ -85,6 +89,12 @@ def download_nltk_data():
 # Download NLTK data on startup
 download_nltk_data()
 
+# Roll old records up and compact the data/ tree periodically
+start_background_compaction()
+
+# Apply gamification side effects off the request path
+start_gamification_queue()
+
 # Import routes after app is created to avoid circular imports
 from routes import fireflies_routes
 
@@ -771,12 +781,13 @@ def login():
     session['logged_in'] = True
     session['username'] = username
 
-    # Update gamification login streak
-    gamification_system = GamificationSystem(username)
-    streak_result = gamification_system.update_login_streak()
+    # Update gamification login streak (the message is flashed once applied)
+    get_gamification_queue().submit(username, 'login')
 
-    if streak_result['points_earned'] > 0:
-        flash(streak_result['message'], 'success')
+    # Record the school and class used by the scoped leaderboards
+    student_info = getattr(pronote_client.client, 'info', None)
+    get_gamification_queue().submit(username, 'profile', school=urlparse(url).netloc.lower(),
+                                    class_name=getattr(student_info, 'class_name', None))
 
     # Load settings
     settings = load_settings()
@@ -1121,7 +1132,10 @@ def settings():
     # Load current settings
     current_settings = load_settings()
 
-    return render_template('settings.html', settings=current_settings)
+    # Timezone of the day boundaries of the streaks
+    timezone = StreakService(session.get('username', 'unknown_user')).timezone
+
+    return render_template('settings.html', settings=current_settings, timezone=timezone)
 
 @app.route('/accessibility')
 def accessibility():
@@ -1229,11 +1243,7 @@ def grades():
 
     # Track grade view for gamification
     username = session.get('username', 'unknown_user')
-    gamification_system = GamificationSystem(username)
-    gamification_result = gamification_system.track_grade_view()
-
-    if gamification_result['points_earned'] > 0:
-        flash(gamification_result['message'], 'success')
+    get_gamification_queue().submit(username, 'grade_view')
 
     # Get filter parameters
     period_index = request.args.get('period')
@@ -1567,11 +1577,7 @@ def timetable():
 
     # Track timetable view for gamification
     username = session.get('username', 'unknown_user')
-    gamification_system = GamificationSystem(username)
-    gamification_result = gamification_system.track_timetable_view()
-
-    if gamification_result['points_earned'] > 0:
-        flash(gamification_result['message'], 'success')
+    get_gamification_queue().submit(username, 'timetable_view')
         
     # Get study schedule data
     calendar_integration = CalendarIntegration(username)
@@ -2426,14 +2432,31 @@ def leaderboard():
     # Initialize gamification system
     gamification_system = GamificationSystem(username)
 
-    # Get leaderboard
-    leaderboard = gamification_system.get_leaderboard()
+    # Get the requested scope
+    scope = request.args.get('scope', 'global')
+    if scope not in LEADERBOARD_SCOPES:
+        scope = 'global'
+    subject = request.args.get('subject', '').strip() or None
+    if scope == 'subject' and not subject:
+        scope = 'global'
+
+    # Get leaderboard and the user's own rank
+    leaderboard = gamification_system.get_leaderboard(scope=scope, subject=subject)
+    user_rank = gamification_system.get_rank(scope=scope, subject=subject)
+
+    # Subjects of the user's flashcard sets and study plans
+    subjects = sorted({plan.get('subject') for plan in gamification_system.get_study_plans() if plan.get('subject')} |
+                      set(FlashcardManager(username).get_subjects()))
 
     # Load settings
     settings = load_settings()
 
     return render_template('leaderboard.html',
                           leaderboard=leaderboard,
+                          user_rank=user_rank,
+                          scope=scope,
+                          subject=subject,
+                          subjects=subjects,
                           current_user=username,
                           settings=settings)
 
@@ -2570,7 +2593,100 @@ def track_flashcard_completion():
     gamification_system = GamificationSystem(username)
 
     # Track flashcard completion
-    result = gamification_system.track_flashcard_completion()
+    result = gamification_system.track_flashcard_quiz_completion()
+
+    return jsonify({'success': True, 'data': result}), 200
+
+@app.route('/api/gamification/activity', methods=['GET'])
+def get_gamification_activity():
+    """API route to page through the activity history, newest first"""
+    if not session.get('logged_in'):
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+
+    # Get username from session
+    username = session.get('username', 'unknown_user')
+
+    try:
+        cursor = request.args.get('cursor', type=int)
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid cursor or limit'}), 400
+
+    # Initialize gamification system
+    gamification_system = GamificationSystem(username)
+
+    page = gamification_system.get_activity_page(cursor, limit)
+
+    return jsonify({'success': True, 'data': page}), 200
+
+@app.route('/api/gamification/timezone', methods=['POST'])
+def set_gamification_timezone():
+    """API route to set the timezone of the day boundaries of the streaks"""
+    if not session.get('logged_in'):
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+
+    # Get username from session
+    username = session.get('username', 'unknown_user')
+
+    data = request.get_json(silent=True) or {}
+    timezone = data.get('timezone')
+    if not isinstance(timezone, str) or not timezone:
+        return jsonify({'success': False, 'message': 'Missing timezone'}), 400
+
+    # Initialize gamification system
+    gamification_system = GamificationSystem(username)
+
+    if not gamification_system.set_timezone(timezone):
+        return jsonify({'success': False, 'message': f'Invalid timezone: {timezone}'}), 400
+
+    return jsonify({'success': True, 'data': {'timezone': timezone}}), 200
+
+@app.route('/api/gamification/notifications', methods=['GET'])
+def get_gamification_notifications():
+    """API route to get the messages of the gamification events applied in the background"""
+    if not session.get('logged_in'):
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+
+    # Get username from session
+    username = session.get('username', 'unknown_user')
+
+    messages = get_gamification_queue().pop_notifications(username)
+
+    return jsonify({'success': True, 'data': {'messages': messages,
+                                              'pending': get_gamification_queue().pending()}}), 200
+
+@app.route('/api/gamification/events', methods=['POST'])
+def track_gamification_events():
+    """API route to apply a batch of gamification events in one request"""
+    if not session.get('logged_in'):
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+
+    # Get username from session
+    username = session.get('username', 'unknown_user')
+
+    # Get request data (a list of events or {"events": [...]})
+    data = request.get_json(silent=True)
+    events = data.get('events') if isinstance(data, dict) else data
+    if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+        return jsonify({'success': False, 'message': 'A list of events is required'}), 400
+
+    if len(events) > MAX_EVENT_BATCH:
+        return jsonify({'success': False, 'message': f'At most {MAX_EVENT_BATCH} events per request'}), 413
+
+    # Login and profile events are derived from the Pronote session, never taken from the client
+    forbidden = sorted({str(event.get('type')) for event in events if event.get('type') not in CLIENT_EVENT_TYPES})
+    if forbidden:
+        return jsonify({'success': False, 'message': f"Event types not allowed: {', '.join(forbidden)}"}), 400
+
+    # Initialize gamification system
+    gamification_system = GamificationSystem(username)
+
+    # Apply every event with a single save
+    try:
+        result = gamification_system.process_events(events)
+    except Exception as e:
+        print(f"Error processing gamification events: {e}")
+        return jsonify({'success': False, 'message': 'Error processing events'}), 500
 
     return jsonify({'success': True, 'data': result}), 200
 
@@ -2915,6 +3031,13 @@ def admin_messages():
 
 # Note: Accessibility routes are already defined in routes.py
 
+# Flash the messages of the gamification events applied since the last page
+@app.before_request
+def flash_gamification_notifications():
+    if session.get('logged_in') and request.endpoint and not request.path.startswith(('/api/', '/static/')):
+        for message in get_gamification_queue().pop_notifications(session.get('username', 'unknown_user')):
+            flash(message, 'success')
+
 # Context processor to provide current year for footer
 @app.context_processor
 def inject_now():
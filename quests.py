@@ -0,0 +1,114 @@
+"""
+Quest templates and progress rules for the gamification module
+
+Quest templates are declared once and indexed at import by the event types
+they subscribe to. A user's active quests are plain dicts stored in the
+gamification data; advancing one for an event is a constant-time update.
+"""
+
+import datetime
+import random
+from typing import Dict, List, Any, Optional
+
+# Every quest template (distinct_days: count at most one event per day)
+QUEST_TEMPLATES: List[Dict[str, Any]] = [
+    # Daily quests
+    {"id": "login", "period": "daily", "name": "Connexion Quotidienne", "description": "Connectez-vous aujourd'hui", "events": ("login",), "target": 1, "xp": 20, "always": True},
+    {"id": "check_grades", "period": "daily", "name": "Vérifier les Notes", "description": "Consultez vos notes aujourd'hui", "events": ("grade_view",), "target": 1, "xp": 30},
+    {"id": "check_timetable", "period": "daily", "name": "Vérifier l'Emploi du Temps", "description": "Consultez votre emploi du temps aujourd'hui", "events": ("timetable_view",), "target": 1, "xp": 30},
+    {"id": "complete_homework", "period": "daily", "name": "Terminer un Devoir", "description": "Marquez un devoir comme terminé", "events": ("homework",), "target": 1, "xp": 50},
+    {"id": "send_message", "period": "daily", "name": "Envoyer un Message", "description": "Envoyez un message à un enseignant ou camarade", "events": ("message_sent",), "target": 1, "xp": 40},
+    {"id": "study_flashcards", "period": "daily", "name": "Réviser des Flashcards", "description": "Terminez une session de flashcards", "events": ("flashcard_session", "flashcard_quiz"), "target": 1, "xp": 40},
+
+    # Weekly quests
+    {"id": "login_streak_5", "period": "weekly", "name": "Série de 5 Jours", "description": "Connectez-vous 5 jours cette semaine", "events": ("login",), "target": 5, "xp": 100, "distinct_days": True},
+    {"id": "complete_5_homework", "period": "weekly", "name": "5 Devoirs", "description": "Terminez 5 devoirs cette semaine", "events": ("homework",), "target": 5, "xp": 150},
+    {"id": "check_grades_3", "period": "weekly", "name": "Vérifier les Notes 3 Fois", "description": "Consultez vos notes 3 jours différents", "events": ("grade_view",), "target": 3, "xp": 80, "distinct_days": True},
+    {"id": "send_3_messages", "period": "weekly", "name": "Envoyer 3 Messages", "description": "Envoyez 3 messages cette semaine", "events": ("message_sent",), "target": 3, "xp": 120},
+    {"id": "flashcard_sessions_5", "period": "weekly", "name": "5 Sessions de Flashcards", "description": "Terminez 5 sessions de flashcards cette semaine", "events": ("flashcard_session", "flashcard_quiz"), "target": 5, "xp": 120},
+]
+
+# Number of quests drawn per period (quests marked "always" included)
+QUESTS_PER_PERIOD = {"daily": 3, "weekly": 3}
+
+# Templates by id, built once at import
+TEMPLATES_BY_ID = {template["id"]: template for template in QUEST_TEMPLATES}
+
+# Ids of the templates subscribed to each event type, built once at import
+SUBSCRIPTIONS: Dict[str, List[str]] = {}
+for _template in QUEST_TEMPLATES:
+    for _event_type in _template["events"]:
+        SUBSCRIPTIONS.setdefault(_event_type, []).append(_template["id"])
+
+
+def period_key(period: str, date: datetime.date) -> str:
+    """
+    Get the key of the quest period containing a date
+
+    Args:
+        period: "daily" or "weekly"
+        date: The date
+
+    Returns:
+        ISO date for daily quests, ISO week for weekly quests
+    """
+    if period == "weekly":
+        iso = date.isocalendar()
+        return f"{iso[0]}-W{iso[1]:02d}"
+    return date.isoformat()
+
+
+def generate(period: str, rng: Optional[random.Random] = None) -> List[Dict[str, Any]]:
+    """
+    Draw the quests of a new period
+
+    Args:
+        period: "daily" or "weekly"
+        rng: Random generator (defaults to the module generator)
+
+    Returns:
+        List of new quest instances
+    """
+    rng = rng or random
+    templates = [template for template in QUEST_TEMPLATES if template["period"] == period]
+    chosen = [template for template in templates if template.get("always")]
+    others = [template for template in templates if not template.get("always")]
+    chosen.extend(rng.sample(others, max(0, min(len(others), QUESTS_PER_PERIOD[period] - len(chosen)))))
+
+    return [{
+        "id": template["id"],
+        "name": template["name"],
+        "description": template["description"],
+        "target": template["target"],
+        "progress": 0,
+        "xp": template["xp"],
+        "completed": False,
+        "days": []
+    } for template in chosen]
+
+
+def advance(quest: Dict[str, Any], day: str) -> bool:
+    """
+    Count one event for a quest
+
+    Args:
+        quest: The quest instance (updated in place)
+        day: ISO date of the event
+
+    Returns:
+        True if the event completed the quest
+    """
+    if quest["completed"]:
+        return False
+
+    template = TEMPLATES_BY_ID.get(quest["id"], {})
+    if template.get("distinct_days"):
+        if day in quest["days"]:
+            return False
+        quest["days"].append(day)
+
+    quest["progress"] += 1
+    if quest["progress"] >= quest["target"]:
+        quest["completed"] = True
+        return True
+    return False
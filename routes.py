@@ -6,12 +6,16 @@ from flask import Blueprint, render_template, session, redirect, url_for, flash,
 import datetime
 import json
 import os
+import tempfile
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 
 from gamification import GamificationSystem
 from study_analytics import StudyAnalytics
-from flashcard_system import FlashcardManager
+from flashcard_system import FlashcardManager, DAILY_NEW_LIMIT, DAILY_REVIEW_LIMIT, RATING_QUALITY
+from ids import new_id
+import flashcard_import
+import flashcard_export
 from calendar_integration import CalendarIntegration
 
 # Create blueprint
@@ -48,9 +52,6 @@ def flashcards():
     # Initialize flashcard manager
     flashcard_manager = FlashcardManager(username)
     
-    # Get all flashcard sets
-    flashcard_sets = flashcard_manager.get_all_sets()
-    
     # Initialize study analytics
     study_analytics = StudyAnalytics(username)
     
@@ -274,7 +275,13 @@ def update_flashcard(set_id, card_id):
         return jsonify({'success': False, 'message': 'Question and answer are required'}), 400
     
     # Update flashcard
-    success = flashcard_manager.update_card(set_id, card_id, question, answer, tags, image_url, audio_url)
+    success = flashcard_manager.update_card(set_id, card_id, {
+        'question': question,
+        'answer': answer,
+        'tags': tags,
+        'image_url': image_url,
+        'audio_url': audio_url
+    })
     
     if not success:
         return jsonify({'success': False, 'message': 'Failed to update flashcard'}), 500
@@ -417,7 +424,7 @@ def update_flashcard_set(set_id):
             if 'question' in card_data and 'answer' in card_data:
                 # Create the card
                 card = {
-                    "id": card_data.get('id') or f"card_{len(current_set['cards'])}_" + str(int(datetime.datetime.now().timestamp())),
+                    "id": card_data.get('id') or new_id(),
                     "question": card_data["question"],
                     "answer": card_data["answer"],
                     "created_at": datetime.datetime.now().isoformat(),
@@ -464,6 +471,37 @@ def delete_flashcard_set_api(set_id):
     
     return jsonify({'success': True}), 200
 
+@fireflies_routes.route('/api/flashcards/<set_id>/scheduler', methods=['PUT'])
+def set_flashcard_scheduler(set_id):
+    """Choose the review scheduler of a flashcard set (sm2 or fsrs)"""
+    if not check_login():
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    # Get username from session
+    username = session.get('username', 'unknown_user')
+    
+    # Initialize flashcard manager
+    flashcard_manager = FlashcardManager(username)
+    
+    # Get JSON data
+    data = request.get_json()
+    if not data or not data.get('scheduler'):
+        return jsonify({'success': False, 'message': 'No scheduler provided'}), 400
+    
+    try:
+        retention = float(data['retention']) if data.get('retention') is not None else None
+        updated_set = flashcard_manager.set_scheduler(set_id, data['scheduler'], retention)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    if not updated_set:
+        return jsonify({'success': False, 'message': 'Flashcard set not found'}), 404
+    
+    return jsonify({'success': True, 'data': {
+        'scheduler': updated_set['scheduler'],
+        'retention': updated_set.get('retention')
+    }}), 200
+
 @fireflies_routes.route('/api/flashcards/rate_card', methods=['POST'])
 def rate_card():
     """Rate a flashcard during quiz"""
@@ -496,6 +534,123 @@ def rate_card():
     
     return jsonify(result), 200
 
+@fireflies_routes.route('/api/flashcards/reviews', methods=['POST'])
+def record_reviews():
+    """Record the ratings of a whole quiz in one request"""
+    if not check_login():
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    # Get username from session
+    username = session.get('username', 'unknown_user')
+    
+    # Initialize flashcard manager
+    flashcard_manager = FlashcardManager(username)
+    
+    # Get JSON data (sendBeacon posts it without a JSON content type)
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('reviews'), list):
+        return jsonify({'success': False, 'message': 'No reviews provided'}), 400
+    
+    # Validate every review before applying any, then group them by set
+    # (each set is loaded and saved once)
+    by_set = {}
+    for review in data['reviews']:
+        if not isinstance(review, dict):
+            return jsonify({'success': False, 'message': 'Invalid review'}), 400
+        set_id = review.get('set_id') or data.get('set_id')
+        card_id = review.get('card_id')
+        rating = review.get('rating')
+        if not isinstance(set_id, str) or not isinstance(card_id, str) or not card_id \
+                or not isinstance(rating, int) or isinstance(rating, bool) or rating not in RATING_QUALITY:
+            return jsonify({'success': False, 'message': 'Invalid review'}), 400
+        
+        timestamp = review.get('timestamp')
+        if timestamp is not None:
+            try:
+                timestamp = datetime.datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Invalid timestamp'}), 400
+        by_set.setdefault(set_id, []).append((card_id, RATING_QUALITY[rating], timestamp))
+    
+    reviewed = 0
+    missing = []
+    for set_id, reviews in by_set.items():
+        result = flashcard_manager.record_reviews(set_id, reviews)
+        if result is None:
+            missing.extend(card_id for card_id, _, _ in reviews)
+            continue
+        reviewed += len(result['reviewed'])
+        missing.extend(result['missing'])
+    
+    return jsonify({'success': True, 'data': {'reviewed': reviewed, 'missing': missing}}), 200
+
+@fireflies_routes.route('/flashcard_review')
+def flashcard_review():
+    """Review the cards due in every set (or in one subject)"""
+    if not check_login():
+        return redirect(url_for('index'))
+    
+    # Get username from session
+    username = session.get('username', 'unknown_user')
+    
+    # Initialize flashcard manager
+    flashcard_manager = FlashcardManager(username)
+    
+    # Load settings
+    settings = load_settings()
+    
+    return render_template('flashcard_review.html',
+                          subject=request.args.get('subject'),
+                          subjects=flashcard_manager.get_subjects(),
+                          settings=settings)
+
+@fireflies_routes.route('/api/flashcards/review_session', methods=['GET'])
+def review_session():
+    """Get a page of the cross-set review session"""
+    if not check_login():
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    # Get username from session
+    username = session.get('username', 'unknown_user')
+    
+    # Initialize flashcard manager
+    flashcard_manager = FlashcardManager(username)
+    
+    try:
+        page_size = min(int(request.args.get('limit', 20)), 100)
+        new_limit = int(request.args.get('new_limit', DAILY_NEW_LIMIT))
+        review_limit = int(request.args.get('review_limit', DAILY_REVIEW_LIMIT))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid limit'}), 400
+    
+    try:
+        page = flashcard_manager.get_review_session(subject=request.args.get('subject') or None,
+                                                    cursor=request.args.get('cursor') or None,
+                                                    page_size=page_size,
+                                                    new_limit=new_limit,
+                                                    review_limit=review_limit)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+    
+    return jsonify({'success': True, 'data': page}), 200
+
+@fireflies_routes.route('/api/flashcards/forecast', methods=['GET'])
+def flashcard_forecast():
+    """Get the number of reviews due on each of the next days, per set and in total"""
+    if not check_login():
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    # Get username from session
+    username = session.get('username', 'unknown_user')
+    
+    # Initialize flashcard manager
+    flashcard_manager = FlashcardManager(username)
+    
+    days = request.args.get('days', 30, type=int)
+    set_id = request.args.get('set_id') or None
+    
+    return jsonify({'success': True, 'data': flashcard_manager.get_forecast(days, set_id)}), 200
+
 @fireflies_routes.route('/api/flashcards/complete_session', methods=['POST'])
 def complete_flashcard_session():
     """Complete a flashcard study session"""
@@ -526,7 +681,9 @@ def complete_flashcard_session():
     study_analytics.record_flashcard_session(set_id, stats, duration)
     
     # Track completion for gamification
-    gamification_result = gamification_system.track_flashcard_completion(set_id, stats)
+    flashcard_set = flashcard_manager.get_set(set_id) or {}
+    gamification_result = gamification_system.track_flashcard_completion(set_id, stats,
+                                                                         subject=flashcard_set.get('subject'))
     
     return jsonify({
         'success': True,
@@ -535,16 +692,13 @@ def complete_flashcard_session():
 
 @fireflies_routes.route('/api/flashcards/import', methods=['POST'])
 def import_flashcards():
-    """Import flashcards from CSV or JSON"""
+    """Import flashcards from a CSV, JSON (lines) or Anki .apkg file in the background"""
     if not check_login():
         return jsonify({'success': False, 'message': 'Not logged in'}), 401
     
     # Get username from session
     username = session.get('username', 'unknown_user')
     
-    # Initialize flashcard manager
-    flashcard_manager = FlashcardManager(username)
-    
     # Check if file was uploaded
     if 'file' not in request.files:
         return jsonify({'success': False, 'message': 'No file uploaded'}), 400
@@ -554,25 +708,44 @@ def import_flashcards():
     if file.filename == '':
         return jsonify({'success': False, 'message': 'No file selected'}), 400
     
-    # Get set ID if provided (for adding to existing set)
-    set_id = request.form.get('set_id')
-    
-    # Get set details if creating new set
-    set_name = request.form.get('set_name', '').strip()
-    set_subject = request.form.get('set_subject', '').strip()
-    set_description = request.form.get('set_description', '').strip()
+    file_format = request.form.get('format') or flashcard_import.detect_format(file.filename)
+    if file_format not in ('csv', 'json', 'apkg'):
+        return jsonify({'success': False, 'message': 'Unsupported file format'}), 400
+    
+    # Save the upload to disk (streamed), the import reads it from there
+    fd, path = tempfile.mkstemp(prefix='flashcard_import_')
+    os.close(fd)
+    file.save(path)
+    
+    # Set ID if adding to an existing set, details of the new set otherwise
+    job = flashcard_import.start_import(
+        username, path, file.filename, file_format,
+        set_id=request.form.get('set_id') or None,
+        set_name=request.form.get('set_name', '').strip(),
+        subject=request.form.get('set_subject', '').strip(),
+        description=request.form.get('set_description', '').strip()
+    )
+    
+    return jsonify({'success': True, 'data': job}), 202
+
+@fireflies_routes.route('/api/flashcards/import/<import_id>', methods=['GET'])
+def import_flashcards_progress(import_id):
+    """Get the progress of a flashcard import"""
+    if not check_login():
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
     
-    # Import flashcards
-    result = flashcard_manager.import_cards(file, set_id, set_name, set_subject, set_description)
+    # Get username from session
+    username = session.get('username', 'unknown_user')
     
-    if not result.get('success', False):
-        return jsonify({'success': False, 'message': result.get('message', 'Import failed')}), 500
+    progress = flashcard_import.get_import(username, import_id)
+    if progress is None:
+        return jsonify({'success': False, 'message': 'Import not found'}), 404
     
-    return jsonify(result), 200
+    return jsonify({'success': True, 'data': progress}), 200
 
 @fireflies_routes.route('/api/flashcards/export/<set_id>', methods=['GET'])
 def export_flashcards(set_id):
-    """Export flashcards to JSON"""
+    """Export flashcards as a stream (JSON, JSON lines, CSV or Anki text)"""
     if not check_login():
         return jsonify({'success': False, 'message': 'Not logged in'}), 401
     
@@ -582,14 +755,38 @@ def export_flashcards(set_id):
     # Initialize flashcard manager
     flashcard_manager = FlashcardManager(username)
     
+    export_format = request.args.get('format', 'json').lower()
+    if export_format not in flashcard_export.MIMETYPES:
+        return jsonify({'success': False, 'message': 'Unsupported export format'}), 400
+    
+    try:
+        fields = flashcard_export.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
     # Get the flashcard set
     flashcard_set = flashcard_manager.get_set(set_id)
     
     if not flashcard_set:
         return jsonify({'success': False, 'message': 'Flashcard set not found'}), 404
     
-    # Export as JSON
-    return jsonify(flashcard_set), 200
+    blocks = flashcard_export.iter_export(flashcard_set, export_format, fields)
+    
+    # Compressed on the fly when asked for and accepted by the client
+    compress = request.args.get('gzip') in ('1', 'true') and 'gzip' in request.headers.get('Accept-Encoding', '')
+    if compress:
+        blocks = flashcard_export.gzip_stream(blocks)
+    
+    response = Response(blocks, mimetype=flashcard_export.MIMETYPES[export_format])
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+    
+    if request.args.get('download') in ('1', 'true'):
+        filename = f"flashcards_{flashcard_set['id']}.{flashcard_export.EXTENSIONS[export_format]}"
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    
+    return response
 
 # Study Analytics routes
 @fireflies_routes.route('/study_analytics')
@@ -0,0 +1,343 @@
+"""
+Review schedulers for the flashcard system
+
+A scheduler decides, from a card's learning data and the quality of a
+review, when the card is due again. Two are available:
+
+- "sm2": SuperMemo-2, with an ease factor and an interval per card (the
+  historical behaviour)
+- "fsrs": an FSRS-style model with a memory stability (days until recall
+  drops to 90%) and a difficulty (1-10) per card, and a desired retention
+
+The FSRS scheduler also works on whole decks at once (array-backed state):
+the batch functions use NumPy when it is installed and plain Python lists
+otherwise.
+"""
+
+import datetime
+import math
+import os
+from typing import Dict, Any, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Scheduler of the sets that did not choose one
+DEFAULT_SCHEDULER = os.environ.get('FIREFLIES_SCHEDULER', 'sm2')
+
+# Probability of recall aimed at by the FSRS scheduler
+DEFAULT_RETENTION = 0.9
+
+# Longest interval given to a card (days)
+MAXIMUM_INTERVAL = 36500
+
+
+def quality_grade(quality: int) -> int:
+    """
+    Convert an SM-2 quality (0-5) to an FSRS grade
+
+    Args:
+        quality: The quality of the response (0-5)
+
+    Returns:
+        1=again, 2=hard, 3=good, 4=easy
+    """
+    if quality < 3:
+        return 1
+    return min(quality, 5) - 1
+
+
+def _elapsed_days(learning_data: Dict[str, Any], now: datetime.datetime) -> float:
+    """Days since the last review of a card (0 if it was never reviewed)"""
+    last_review = learning_data.get("last_review")
+    if not last_review:
+        return 0.0
+    try:
+        return max(0.0, (now - datetime.datetime.fromisoformat(last_review)).total_seconds() / 86400)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class Scheduler:
+    """Interface of the review schedulers"""
+
+    name = ""
+
+    def review(self, learning_data: Dict[str, Any], quality: int, now: datetime.datetime) -> int:
+        """
+        Apply a review to the learning data of a card
+
+        Updates the scheduler's own fields and "interval"; the caller sets
+        last_review, next_review and the history.
+
+        Args:
+            learning_data: The learning data of the card (updated in place)
+            quality: The quality of the response (0-5)
+            now: Time of the review
+
+        Returns:
+            Days until the next review
+        """
+        raise NotImplementedError
+
+
+class SM2Scheduler(Scheduler):
+    """SuperMemo-2 scheduler"""
+
+    name = "sm2"
+
+    @staticmethod
+    def next_review(ease_factor: float, interval: int, quality: int) -> Tuple[int, float]:
+        """
+        Calculate the next review interval based on performance
+
+        Args:
+            ease_factor: The ease factor of the card (starts at 2.5)
+            interval: The current interval in days
+            quality: The quality of the response (0-5)
+
+        Returns:
+            Tuple of (new_interval, new_ease_factor)
+        """
+        if quality < 3:
+            # If response was incorrect, reset interval to 1
+            return 1, max(1.3, ease_factor - 0.2)
+
+        # If first time or incorrect last time
+        if interval == 0:
+            new_interval = 1
+        elif interval == 1:
+            new_interval = 6
+        else:
+            new_interval = math.ceil(interval * ease_factor)
+
+        # Adjust ease factor based on quality
+        new_ease_factor = ease_factor + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+
+        # Keep ease factor within reasonable bounds
+        new_ease_factor = max(1.3, min(new_ease_factor, 2.5))
+
+        return min(new_interval, MAXIMUM_INTERVAL), new_ease_factor
+
+    def review(self, learning_data: Dict[str, Any], quality: int, now: datetime.datetime) -> int:
+        interval, ease_factor = self.next_review(
+            learning_data.get("ease_factor", 2.5), learning_data.get("interval", 0), quality
+        )
+        learning_data["ease_factor"] = ease_factor
+        learning_data["interval"] = interval
+        return interval
+
+
+class FSRSScheduler(Scheduler):
+    """FSRS-style scheduler (stability and difficulty per card)"""
+
+    name = "fsrs"
+
+    # Default model weights (FSRS v4.5)
+    WEIGHTS = (0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031, 1.6474,
+               0.1367, 1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272, 2.8755)
+
+    # Shape of the forgetting curve: R(t) = (1 + FACTOR * t / S) ** DECAY
+    DECAY = -0.5
+    FACTOR = 19 / 81
+
+    def __init__(self, retention: float = DEFAULT_RETENTION, weights: Optional[Sequence[float]] = None):
+        """
+        Initialize the scheduler
+
+        Args:
+            retention: Probability of recall at which cards become due (0-1)
+            weights: Model weights (defaults to WEIGHTS)
+        """
+        if not 0 < retention < 1:
+            raise ValueError(f"Invalid retention: {retention}")
+        self.retention = retention
+        self.w = tuple(weights or self.WEIGHTS)
+
+    def initial_difficulty(self, grade: int) -> float:
+        """Difficulty of a card after its first review"""
+        return min(10.0, max(1.0, self.w[4] - (grade - 3) * self.w[5]))
+
+    def retrievability(self, stability: float, elapsed_days: float) -> float:
+        """
+        Probability of recalling a card
+
+        Args:
+            stability: Memory stability of the card (days)
+            elapsed_days: Days since the last review
+
+        Returns:
+            Probability of recall (0-1)
+        """
+        return (1 + self.FACTOR * elapsed_days / stability) ** self.DECAY
+
+    def interval(self, stability: float, retention: Optional[float] = None) -> int:
+        """
+        Days until the probability of recall falls to the retention
+
+        Args:
+            stability: Memory stability of the card (days)
+            retention: Desired retention (defaults to the scheduler's)
+
+        Returns:
+            Interval in whole days (at least 1)
+        """
+        retention = retention if retention is not None else self.retention
+        days = stability / self.FACTOR * (retention ** (1 / self.DECAY) - 1)
+        return min(MAXIMUM_INTERVAL, max(1, round(days)))
+
+    def next_state(self, stability: Optional[float], difficulty: Optional[float],
+                   elapsed_days: float, grade: int) -> Tuple[float, float]:
+        """
+        Compute the memory state of a card after a review
+
+        Args:
+            stability: Stability before the review (None for a new card)
+            difficulty: Difficulty before the review (None for a new card)
+            elapsed_days: Days since the last review
+            grade: 1=again, 2=hard, 3=good, 4=easy
+
+        Returns:
+            Tuple of (stability, difficulty)
+        """
+        w = self.w
+        if stability is None or difficulty is None:
+            return w[grade - 1], self.initial_difficulty(grade)
+
+        # Difficulty moves with the grade and reverts to the mean
+        difficulty = difficulty - w[6] * (grade - 3)
+        difficulty = w[7] * self.initial_difficulty(3) + (1 - w[7]) * difficulty
+        difficulty = min(10.0, max(1.0, difficulty))
+
+        recall = self.retrievability(stability, elapsed_days)
+        if grade == 1:
+            stability = (w[11] * difficulty ** -w[12] * ((stability + 1) ** w[13] - 1)
+                         * math.exp(w[14] * (1 - recall)))
+        else:
+            bonus = w[15] if grade == 2 else w[16] if grade == 4 else 1
+            stability = stability * (1 + math.exp(w[8]) * (11 - difficulty) * stability ** -w[9]
+                                     * (math.exp(w[10] * (1 - recall)) - 1) * bonus)
+
+        return max(0.1, stability), difficulty
+
+    def seed(self, learning_data: Dict[str, Any]) -> Tuple[Optional[float], Optional[float]]:
+        """
+        Get the memory state of a card, derived from its SM-2 state if needed
+
+        Cards reviewed with SM-2 only get their interval as stability and a
+        difficulty matching their ease factor.
+
+        Args:
+            learning_data: The learning data of the card
+
+        Returns:
+            Tuple of (stability, difficulty), (None, None) for a new card
+        """
+        if "stability" in learning_data:
+            return learning_data["stability"], learning_data["difficulty"]
+        if not learning_data.get("reviews"):
+            return None, None
+
+        # Ease 2.5 (the easiest) maps to difficulty 1, ease 1.3 to 10
+        ease_factor = learning_data.get("ease_factor", 2.5)
+        difficulty = min(10.0, max(1.0, 1 + (2.5 - ease_factor) / 1.2 * 9))
+        return max(0.1, float(learning_data.get("interval") or self.w[2])), difficulty
+
+    def review(self, learning_data: Dict[str, Any], quality: int, now: datetime.datetime) -> int:
+        stability, difficulty = self.seed(learning_data)
+        stability, difficulty = self.next_state(
+            stability, difficulty, _elapsed_days(learning_data, now), quality_grade(quality)
+        )
+        interval = 1 if quality < 3 and learning_data.get("reviews") else self.interval(stability)
+
+        learning_data["stability"] = stability
+        learning_data["difficulty"] = difficulty
+        learning_data["interval"] = interval
+        return interval
+
+    def review_batch(self, stability: Sequence[float], difficulty: Sequence[float],
+                     elapsed_days: Sequence[float], grades: Sequence[int]) -> Tuple[Any, Any, Any]:
+        """
+        Apply one review to many reviewed cards at once
+
+        Args:
+            stability: Stability of each card before the review
+            difficulty: Difficulty of each card before the review
+            elapsed_days: Days since the last review of each card
+            grades: Grade of each review (1-4)
+
+        Returns:
+            Tuple of (stability, difficulty, interval) sequences, NumPy
+            arrays when NumPy is installed and lists otherwise
+        """
+        if np is None:
+            states = [self.next_state(s, d, t, g) for s, d, t, g in zip(stability, difficulty, elapsed_days, grades)]
+            return ([s for s, _ in states], [d for _, d in states],
+                    [1 if g == 1 else self.interval(s) for (s, _), g in zip(states, grades)])
+
+        w = self.w
+        stability = np.asarray(stability, dtype=float)
+        difficulty = np.asarray(difficulty, dtype=float)
+        elapsed_days = np.asarray(elapsed_days, dtype=float)
+        grades = np.asarray(grades, dtype=int)
+
+        difficulty = difficulty - w[6] * (grades - 3)
+        difficulty = np.clip(w[7] * self.initial_difficulty(3) + (1 - w[7]) * difficulty, 1.0, 10.0)
+
+        recall = (1 + self.FACTOR * elapsed_days / stability) ** self.DECAY
+        forget = (w[11] * difficulty ** -w[12] * ((stability + 1) ** w[13] - 1)
+                  * np.exp(w[14] * (1 - recall)))
+        bonus = np.where(grades == 2, w[15], np.where(grades == 4, w[16], 1.0))
+        success = stability * (1 + np.exp(w[8]) * (11 - difficulty) * stability ** -w[9]
+                               * (np.exp(w[10] * (1 - recall)) - 1) * bonus)
+        stability = np.maximum(0.1, np.where(grades == 1, forget, success))
+
+        intervals = np.where(grades == 1, 1, self.intervals(stability))
+        return stability, difficulty, intervals
+
+    def intervals(self, stability: Sequence[float], retention: Optional[float] = None) -> Any:
+        """
+        Intervals of many cards at once (see interval)
+
+        Args:
+            stability: Stability of each card
+            retention: Desired retention (defaults to the scheduler's)
+
+        Returns:
+            Intervals in whole days, a NumPy array when NumPy is installed
+            and a list otherwise
+        """
+        if np is None:
+            return [self.interval(s, retention) for s in stability]
+
+        retention = retention if retention is not None else self.retention
+        days = np.asarray(stability, dtype=float) / self.FACTOR * (retention ** (1 / self.DECAY) - 1)
+        return np.clip(np.rint(days), 1, MAXIMUM_INTERVAL).astype(int)
+
+
+# Available schedulers by name
+SCHEDULERS = {
+    SM2Scheduler.name: SM2Scheduler,
+    FSRSScheduler.name: FSRSScheduler,
+}
+
+
+def get_scheduler(name: Optional[str] = None, retention: Optional[float] = None) -> Scheduler:
+    """
+    Get a scheduler by name
+
+    Args:
+        name: Name of the scheduler (defaults to DEFAULT_SCHEDULER)
+        retention: Desired retention, for the schedulers that use one
+
+    Returns:
+        The scheduler
+    """
+    name = name or DEFAULT_SCHEDULER
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler: {name}")
+    if name == FSRSScheduler.name:
+        return FSRSScheduler(retention if retention is not None else DEFAULT_RETENTION)
+    return SCHEDULERS[name]()
@@ -0,0 +1,118 @@
+/**
+ * Batched gamification events for Fireflies
+ *
+ * Pages queue events with trackGamificationEvent(type, fields) instead of
+ * calling one /api/gamification/track_* route per action. The queue is sent
+ * to /api/gamification/events in a single request shortly after the last
+ * event, or when the page is hidden.
+ */
+
+const GAMIFICATION_FLUSH_DELAY = 1000;
+
+let gamificationQueue = [];
+let gamificationFlushTimer = null;
+
+/**
+ * Queue a gamification event
+ *
+ * @param {string} type - Event type (homework, grade_view, timetable_view, message_sent, ...)
+ * @param {Object} fields - Fields required by the event type
+ * @param {boolean} immediate - Send the queue now instead of after the delay
+ * @returns {Promise|undefined} Promise of the batch result when flushed immediately
+ */
+function trackGamificationEvent(type, fields = {}, immediate = false) {
+    const randomPart = Math.random().toString(36).slice(2, 10);
+    gamificationQueue.push(Object.assign({
+        id: `${Date.now().toString(36)}-${randomPart}`,
+        type: type,
+        timestamp: new Date().toISOString()
+    }, fields));
+
+    if (immediate) {
+        return flushGamificationEvents();
+    }
+
+    clearTimeout(gamificationFlushTimer);
+    gamificationFlushTimer = setTimeout(flushGamificationEvents, GAMIFICATION_FLUSH_DELAY);
+}
+
+/**
+ * Send the queued events in one request
+ *
+ * @returns {Promise} Promise of the batch result
+ */
+function flushGamificationEvents() {
+    clearTimeout(gamificationFlushTimer);
+    if (!gamificationQueue.length) {
+        return Promise.resolve(null);
+    }
+
+    const events = gamificationQueue;
+    gamificationQueue = [];
+
+    return fetch('/api/gamification/events', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ events: events })
+    })
+    .then(response => response.json())
+    .catch(error => {
+        // Events carry their id, so sending them again cannot count twice
+        gamificationQueue = events.concat(gamificationQueue);
+        console.error('Error sending gamification events:', error);
+        return null;
+    });
+}
+
+// Send what is left when the user leaves the page
+document.addEventListener('visibilitychange', function() {
+    if (document.visibilityState === 'hidden' && gamificationQueue.length && navigator.sendBeacon) {
+        const blob = new Blob([JSON.stringify({ events: gamificationQueue })], { type: 'application/json' });
+        if (navigator.sendBeacon('/api/gamification/events', blob)) {
+            gamificationQueue = [];
+        }
+    }
+});
+
+/**
+ * Show the messages of the gamification events applied in the background
+ * (login streak, grade and timetable views) once they are ready
+ *
+ * @param {number} attempts - Number of polls left while events are pending
+ */
+function pollGamificationNotifications(attempts = 3) {
+    const container = document.querySelector('.flash-messages');
+    if (!container) {
+        return;
+    }
+
+    fetch('/api/gamification/notifications')
+    .then(response => response.ok ? response.json() : null)
+    .then(data => {
+        if (!data || !data.success) {
+            return;
+        }
+
+        data.data.messages.forEach(message => {
+            const alert = document.createElement('div');
+            alert.className = 'alert alert-success alert-dismissible fade show';
+            alert.innerHTML = '<i class="fas fa-check-circle me-2"></i><span></span>' +
+                '<button type="button" class="btn-close" data-bs-dismiss="alert" aria-label="Close"></button>';
+            alert.querySelector('span').textContent = message;
+            container.appendChild(alert);
+        });
+
+        if (data.data.pending > 0 && attempts > 1) {
+            setTimeout(() => pollGamificationNotifications(attempts - 1), 2000);
+        }
+    })
+    .catch(error => {
+        console.error('Error loading gamification notifications:', error);
+    });
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    setTimeout(pollGamificationNotifications, 1500);
+});
@@ -0,0 +1,420 @@
+"""
+Streak service shared by the login, flashcard and study streaks
+
+Each user has one small document with a timezone and, for every kind of
+streak, a bitmap of the days the user was active (bit i is the day `origin`
++ i, in the user's timezone). The length of the run ending at the last
+active day and the longest run are kept next to the bitmap, so the current
+and max streak are read in O(1); recording a day only touches the bits after
+the last one.
+
+The document is shared by the gamification and study analytics of a user,
+so every change reloads it under a per-user lock before writing it back.
+
+The bitmaps hold dates, not moments: changing the timezone cannot move the
+days already recorded, only the later ones use the new day boundaries.
+
+After a policy change (grace days) the runs of every user are derived again
+from the bitmaps in one batch:
+
+    python streaks.py [username ...]
+"""
+
+import datetime
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import json_codec
+
+# Directory for the streak documents
+STREAKS_DIR = Path('data/streaks')
+
+# Kinds of streak: daily logins and days with a flashcard study session
+STREAK_KINDS = ("login", "study")
+
+# Timezone of the day boundaries of users who did not choose one
+DEFAULT_TIMEZONE = os.environ.get('FIREFLIES_TIMEZONE', 'Europe/Paris')
+
+# Missed days that do not break a streak
+GRACE_DAYS = int(os.environ.get('FIREFLIES_STREAK_GRACE_DAYS', '0'))
+
+# Lock of each user's streak document
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _user_lock(username: str) -> threading.RLock:
+    """Get the lock of a user's streak document"""
+    with _locks_guard:
+        lock = _locks.get(username)
+        if lock is None:
+            lock = _locks[username] = threading.RLock()
+        return lock
+
+
+def _zone(timezone: Optional[str]) -> ZoneInfo:
+    """
+    Get a timezone, falling back to the default one
+
+    Args:
+        timezone: IANA timezone name
+
+    Returns:
+        The timezone
+    """
+    try:
+        return ZoneInfo(timezone or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        print(f"Error loading timezone {timezone}: {e}")
+        return ZoneInfo("UTC")
+
+
+def _empty_record() -> Dict[str, Any]:
+    """
+    Build the record of a streak with no active day
+
+    Returns:
+        Dict with the bitmap and runs of the streak
+    """
+    return {"origin": None, "bits": 0, "last": None, "current": 0, "max": 0}
+
+
+def derive_runs(record: Dict[str, Any], grace_days: int = GRACE_DAYS) -> None:
+    """
+    Compute the current and max runs of a record from its bitmap
+
+    Args:
+        record: The streak record (updated in place)
+        grace_days: Missed days that do not break a streak
+    """
+    bits = record["bits"]
+    current = longest = 0
+    previous = None
+
+    # Walk the set bits only, lowest first
+    while bits:
+        low = bits & -bits
+        day = low.bit_length() - 1
+        bits ^= low
+
+        if previous is not None and day - previous <= 1 + grace_days:
+            current += 1
+        else:
+            current = 1
+        longest = max(longest, current)
+        previous = day
+
+    record["current"] = current
+    record["max"] = longest
+    record["last"] = record["origin"] + previous if previous is not None else None
+
+
+class StreakService:
+    """Class to record active days and read streaks for a user"""
+
+    def __init__(self, username: str, grace_days: int = GRACE_DAYS):
+        """
+        Initialize the streak service for a user
+
+        Args:
+            username: The username of the user
+            grace_days: Missed days that do not break a streak
+        """
+        self.username = username
+        self.grace_days = grace_days
+        self.data_file = STREAKS_DIR / f"{username}.json"
+        self.data = self._load_data()
+
+    def _load_data(self) -> Dict[str, Any]:
+        """
+        Load the streak document of the user
+
+        Returns:
+            Dict with the timezone and a record per kind (bitmaps as integers)
+        """
+        data = {"timezone": None, "streaks": {}}
+        if self.data_file.exists():
+            try:
+                data.update(json_codec.load(self.data_file))
+            except Exception as e:
+                print(f"Error loading streak data: {e}")
+
+        for record in data["streaks"].values():
+            record["bits"] = int(record["bits"], 16) if isinstance(record["bits"], str) else record["bits"]
+        return data
+
+    def _save_data(self) -> None:
+        """Save the streak document of the user (bitmaps as hex strings)"""
+        document = {
+            "timezone": self.data["timezone"],
+            "streaks": {kind: dict(record, bits=format(record["bits"], "x"))
+                        for kind, record in self.data["streaks"].items()}
+        }
+        try:
+            os.makedirs(STREAKS_DIR, exist_ok=True)
+            json_codec.dump(document, self.data_file)
+        except Exception as e:
+            print(f"Error saving streak data: {e}")
+
+    def _record(self, kind: str) -> Dict[str, Any]:
+        """Get the record of a kind of streak, creating it if needed"""
+        if kind not in STREAK_KINDS:
+            raise ValueError(f"Unknown streak kind: {kind}")
+        return self.data["streaks"].setdefault(kind, _empty_record())
+
+    @property
+    def timezone(self) -> str:
+        """Timezone of the day boundaries of the user"""
+        return self.data["timezone"] or DEFAULT_TIMEZONE
+
+    def set_timezone(self, timezone: str) -> bool:
+        """
+        Set the timezone of the day boundaries of the user
+
+        Days already recorded keep their date; only later days use the new
+        boundaries. The bitmaps do not keep the time of the activity, so the
+        past days cannot be derived again in the new timezone.
+
+        Args:
+            timezone: IANA timezone name
+
+        Returns:
+            True if the timezone was valid and saved
+        """
+        try:
+            ZoneInfo(timezone)
+        except (ZoneInfoNotFoundError, ValueError) as e:
+            print(f"Error setting timezone {timezone}: {e}")
+            return False
+
+        with _user_lock(self.username):
+            self.data = self._load_data()
+            if self.data["timezone"] != timezone:
+                self.data["timezone"] = timezone
+                self._save_data()
+        return True
+
+    def today(self) -> datetime.date:
+        """
+        Get the current date in the timezone of the user
+
+        Returns:
+            Today's date for the user
+        """
+        return datetime.datetime.now(_zone(self.timezone)).date()
+
+    def local_date(self, when: datetime.datetime) -> datetime.date:
+        """
+        Get the date of a moment in the timezone of the user
+
+        Args:
+            when: The moment (naive values are server-local time)
+
+        Returns:
+            The date of the moment for the user
+        """
+        return when.astimezone(_zone(self.timezone)).date()
+
+    def gap(self, kind: str, day: Optional[datetime.date] = None) -> Optional[int]:
+        """
+        Get the number of days since the last active day
+
+        Args:
+            kind: Kind of streak
+            day: The day to compare with (defaults to today)
+
+        Returns:
+            Days since the last active day, or None if there is none
+        """
+        record = self._record(kind)
+        if record["last"] is None:
+            return None
+        return (day or self.today()).toordinal() - record["last"]
+
+    def current(self, kind: str, day: Optional[datetime.date] = None) -> int:
+        """
+        Get the current streak (0 once it is broken)
+
+        Args:
+            kind: Kind of streak
+            day: The day to read the streak at (defaults to today)
+
+        Returns:
+            Number of days of the streak still alive at that day
+        """
+        gap = self.gap(kind, day)
+        if gap is None or gap > 1 + self.grace_days:
+            return 0
+        return self._record(kind)["current"]
+
+    def run(self, kind: str) -> int:
+        """
+        Get the run ending at the last active day, even if it is broken since
+
+        Args:
+            kind: Kind of streak
+
+        Returns:
+            Number of days of the last run
+        """
+        return self._record(kind)["current"]
+
+    def max(self, kind: str) -> int:
+        """
+        Get the longest streak
+
+        Args:
+            kind: Kind of streak
+
+        Returns:
+            Number of days of the longest run
+        """
+        return self._record(kind)["max"]
+
+    def last_day(self, kind: str) -> Optional[datetime.date]:
+        """
+        Get the last active day
+
+        Args:
+            kind: Kind of streak
+
+        Returns:
+            The last active day, or None if there is none
+        """
+        last = self._record(kind)["last"]
+        return datetime.date.fromordinal(last) if last is not None else None
+
+    def record(self, kind: str, day: Optional[datetime.date] = None, bridge: bool = False) -> Dict[str, Any]:
+        """
+        Record an active day
+
+        Args:
+            kind: Kind of streak
+            day: The active day (defaults to today)
+            bridge: Count the missed days since the last active day as active
+                (used by the streak shield)
+
+        Returns:
+            Dict with the streak after the day, the days since the previous
+            active day and whether the day was new
+        """
+        with _user_lock(self.username):
+            # Another copy of the document may have recorded a day since it was loaded
+            self.data = self._load_data()
+            record = self._record(kind)
+            day = day or self.today()
+            ordinal = day.toordinal()
+            gap = ordinal - record["last"] if record["last"] is not None else None
+
+            if record["origin"] is None:
+                record["origin"] = ordinal
+            elif ordinal < record["origin"]:
+                record["bits"] <<= record["origin"] - ordinal
+                record["origin"] = ordinal
+
+            position = ordinal - record["origin"]
+            if record["bits"] >> position & 1:
+                return {"current": record["current"], "max": record["max"], "gap": gap, "new_day": False}
+
+            if bridge and gap is not None and gap > 1:
+                record["bits"] |= ((1 << gap) - 1) << (record["last"] - record["origin"])
+            record["bits"] |= 1 << position
+
+            if gap is None or gap < 0:
+                # First day, or a day before the last one: derive the runs again
+                derive_runs(record, self.grace_days)
+            else:
+                if gap <= 1 + self.grace_days or bridge:
+                    record["current"] += gap if bridge and gap > 1 else 1
+                else:
+                    record["current"] = 1
+                record["max"] = max(record["max"], record["current"])
+                record["last"] = ordinal
+
+            self._save_data()
+            return {"current": record["current"], "max": record["max"], "gap": gap, "new_day": True}
+
+    def seed(self, kind: str, last_day: Optional[str], current: int, longest: int = 0) -> bool:
+        """
+        Fill an empty record from a streak stored the old way
+
+        Args:
+            kind: Kind of streak
+            last_day: ISO date of the last active day
+            current: Length of the run ending at that day
+            longest: Longest run known
+
+        Returns:
+            True if the record was filled
+        """
+        if self._record(kind)["last"] is not None or not last_day:
+            return False
+
+        with _user_lock(self.username):
+            self.data = self._load_data()
+            record = self._record(kind)
+            if record["last"] is not None:
+                return False
+
+            last = datetime.date.fromisoformat(last_day).toordinal()
+            run = max(1, current)
+            record["origin"] = last - run + 1
+            record["bits"] = (1 << run) - 1
+            derive_runs(record, self.grace_days)
+            record["max"] = max(record["max"], longest)
+            self._save_data()
+        return True
+
+    def recompute(self) -> bool:
+        """
+        Derive every run of the user from the bitmaps again
+
+        Returns:
+            True if a run changed
+        """
+        changed = False
+        with _user_lock(self.username):
+            self.data = self._load_data()
+            for record in self.data["streaks"].values():
+                if record["origin"] is None:
+                    continue
+                before = (record["current"], record["max"], record["last"])
+                derive_runs(record, self.grace_days)
+                changed = changed or before != (record["current"], record["max"], record["last"])
+
+            if changed:
+                self._save_data()
+        return changed
+
+
+def recompute_all(usernames: Optional[List[str]] = None, grace_days: int = GRACE_DAYS) -> Dict[str, Any]:
+    """
+    Derive the streaks of every user again (after a policy change)
+
+    Args:
+        usernames: Users to process (defaults to every user with streaks)
+        grace_days: Missed days that do not break a streak
+
+    Returns:
+        Dict with the number of users processed and changed
+    """
+    if usernames is None:
+        usernames = sorted(p.stem for p in STREAKS_DIR.glob("*.json")) if STREAKS_DIR.exists() else []
+
+    changed = 0
+    for username in usernames:
+        try:
+            if StreakService(username, grace_days).recompute():
+                changed += 1
+        except Exception as e:
+            print(f"Error recomputing streaks for {username}: {e}")
+
+    return {"users": len(usernames), "changed": changed}
+
+
+if __name__ == "__main__":
+    result = recompute_all(usernames=sys.argv[1:] or None)
+    print(f"Streaks recomputed for {result['users']} users ({result['changed']} changed)")
@@ -2,19 +2,71 @@
 Study Analytics System for tracking and analyzing study habits and performance
 """
 
-import json
 import datetime
 import os
+import shutil
 import math
-import random
 from pathlib import Path
 from typing import Dict, List, Any, Optional, Tuple
+from collections import Counter
+import json_codec
+from document_schema import DocumentSchema
+from columnar_store import ColumnStore
 from flashcard_system import FlashcardManager
+from streaks import StreakService
 
 # Path for analytics data
 ANALYTICS_DIR = Path('data/analytics')
 os.makedirs(ANALYTICS_DIR, exist_ok=True)
 
+# Columns of the study session history (strings are dictionary-encoded)
+SESSION_COLUMNS = {
+    "ts": "d",
+    "duration": "i",
+    "set_id": "i",
+    "set_name": "i",
+    "subject": "i",
+    "day_of_week": "b",
+    "hour_of_day": "b",
+    "failed": "i",
+    "hard": "i",
+    "good": "i",
+    "easy": "i",
+    "total": "i",
+    "performance": "f"
+}
+
+# Rating counters stored for each session
+SESSION_STAT_KEYS = ("failed", "hard", "good", "easy", "total")
+
+
+def _default_data() -> Dict[str, Any]:
+    """
+    Build the study analytics data of a new user
+
+    Returns:
+        Dict containing default study analytics data
+    """
+    return {
+        "subject_performance": {},
+        "daily_stats": {},
+        "weekly_stats": {},
+        "monthly_stats": {},
+        "study_streak": 0,
+        "last_study_date": None,
+        "total_study_time": 0,
+        "preferences": {
+            "best_study_time": None,
+            "best_study_days": [],
+            "favorite_subjects": []
+        }
+    }
+
+
+# Versioned schema of the study analytics document
+STUDY_ANALYTICS_SCHEMA = DocumentSchema("study analytics", 1, _default_data)
+
+
 class StudyAnalytics:
     """Class to manage study analytics"""
     
@@ -30,64 +82,153 @@ class StudyAnalytics:
         os.makedirs(self.user_dir, exist_ok=True)
         self.data_file = self.user_dir / "study_data.json"
         self.data = self._load_data()
+        self.sessions = ColumnStore(self.user_dir / "sessions", SESSION_COLUMNS)
+        self._migrate_history()
         self.flashcard_manager = FlashcardManager(username)
+        self._remap_set_ids()
+        self.streaks = StreakService(username)
+        self.streaks.seed("study", self.data.get("last_study_date"), self.data.get("study_streak", 0))
         
     def _load_data(self) -> Dict[str, Any]:
         """
-        Load study analytics data from file
-        
+        Load study analytics data from file, migrating older documents once
+
         Returns:
             Dict containing study analytics data
         """
-        if not self.data_file.exists():
-            # Initialize with default data
-            return {
-                "study_sessions": [],
-                "flashcard_reviews": [],
-                "subject_performance": {},
-                "daily_stats": {},
-                "weekly_stats": {},
-                "monthly_stats": {},
-                "study_streak": 0,
-                "last_study_date": None,
-                "total_study_time": 0,
-                "preferences": {
-                    "best_study_time": None,
-                    "best_study_days": [],
-                    "favorite_subjects": []
-                }
-            }
-        
-        try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading study analytics data: {e}")
-            return {
-                "study_sessions": [],
-                "flashcard_reviews": [],
-                "subject_performance": {},
-                "daily_stats": {},
-                "weekly_stats": {},
-                "monthly_stats": {},
-                "study_streak": 0,
-                "last_study_date": None,
-                "total_study_time": 0,
-                "preferences": {
-                    "best_study_time": None,
-                    "best_study_days": [],
-                    "favorite_subjects": []
-                }
-            }
+        data, migrated = STUDY_ANALYTICS_SCHEMA.load(self.data_file)
+
+        if migrated:
+            try:
+                json_codec.dump(data, self.data_file)
+            except Exception as e:
+                print(f"Error saving study analytics data: {e}")
+
+        return data
     
     def _save_data(self) -> None:
         """Save study analytics data to file"""
         try:
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=2, default=str)
+            json_codec.dump(self.data, self.data_file)
         except Exception as e:
             print(f"Error saving study analytics data: {e}")
     
+    def _remap_set_ids(self) -> None:
+        """Point the history of the sets whose id was migrated to their new id"""
+        legacy_ids = self.flashcard_manager.legacy_ids()
+        if not legacy_ids:
+            return
+
+        try:
+            self.sessions.rename_strings(legacy_ids)
+        except Exception as e:
+            print(f"Error remapping flashcard set ids in study analytics: {e}")
+
+    def _migrate_history(self) -> None:
+        """
+        Move the session history from the JSON document to the column store
+
+        Per-card review rows are not kept: their counts are in the session
+        rows and in the daily stats, which the analytics queries read.
+        """
+        # Review store written by earlier versions
+        reviews_dir = self.user_dir / "reviews"
+        if reviews_dir.exists():
+            shutil.rmtree(reviews_dir, ignore_errors=True)
+
+        if "study_sessions" not in self.data and "flashcard_reviews" not in self.data:
+            return
+
+        sessions = sorted(self.data.pop("study_sessions", None) or [], key=lambda s: s.get("date", ""))
+        rows = []
+        for session in sessions:
+            try:
+                date = datetime.datetime.fromisoformat(session.get("date", ""))
+            except (ValueError, TypeError):
+                continue
+            rows.append(self._session_row(session, date))
+        self.sessions.extend(rows)
+
+        self.data.pop("flashcard_reviews", None)
+        self._save_data()
+
+    def _session_row(self, session: Dict[str, Any], date: datetime.datetime) -> Dict[str, Any]:
+        """
+        Encode a session as a row of the session column store
+
+        Args:
+            session: The session data
+            date: The date of the session
+
+        Returns:
+            Dict mapping column names to values
+        """
+        stats = session.get("stats", {})
+        row = {
+            "ts": date.timestamp(),
+            "duration": session.get("duration", 0),
+            "set_id": self.sessions.intern(session.get("set_id")),
+            "set_name": self.sessions.intern(session.get("set_name", "Unknown")),
+            "subject": self.sessions.intern(session.get("subject", "Unknown")),
+            "day_of_week": date.weekday(),
+            "hour_of_day": date.hour,
+            "performance": session.get("performance", 0)
+        }
+        for key in SESSION_STAT_KEYS:
+            row[key] = stats.get(key, 0)
+        return row
+
+    def _get_sessions(self, start_date: Optional[datetime.date] = None) -> List[Dict[str, Any]]:
+        """
+        Get the study sessions since a date, oldest first
+
+        Only the rows of the requested range are read from the column store.
+
+        Args:
+            start_date: First day to include (defaults to the whole history)
+
+        Returns:
+            List of session dicts
+        """
+        start_ts = None
+        if start_date is not None:
+            start_ts = datetime.datetime.combine(start_date, datetime.time.min).timestamp()
+
+        rows = self.sessions.range_bounds(start_ts)
+        columns = {name: self.sessions.read_slice(name, rows) for name in SESSION_COLUMNS}
+
+        sessions = []
+        for i in range(rows.stop - rows.start):
+            date = datetime.datetime.fromtimestamp(columns["ts"][i])
+            sessions.append({
+                "id": f"session_{rows.start + i + 1}_{int(columns['ts'][i])}",
+                "type": "flashcard",
+                "set_id": self.sessions.string(columns["set_id"][i]),
+                "set_name": self.sessions.string(columns["set_name"][i]),
+                "subject": self.sessions.string(columns["subject"][i]),
+                "date": date.isoformat(),
+                "day_of_week": columns["day_of_week"][i],
+                "hour_of_day": columns["hour_of_day"][i],
+                "duration": columns["duration"][i],
+                "stats": {key: columns[key][i] for key in SESSION_STAT_KEYS},
+                "performance": round(columns["performance"][i], 1)
+            })
+
+        return sessions
+
+    def _last_studied_by_set(self) -> Dict[str, float]:
+        """
+        Get the timestamp of the last session of each set
+
+        Returns:
+            Dict mapping set IDs to epoch seconds
+        """
+        columns = self.sessions.read(["ts", "set_id"])
+        last_studied = {}
+        for ts, set_id in zip(columns["ts"], columns["set_id"]):
+            last_studied[set_id] = ts
+        return {self.sessions.string(set_id): ts for set_id, ts in last_studied.items()}
+
     def record_flashcard_session(self, set_id: str, stats: Dict[str, Any], duration: int) -> None:
         """
         Record a flashcard study session
@@ -112,7 +253,7 @@ class StudyAnalytics:
         # Create session data
         now = datetime.datetime.now()
         session_data = {
-            "id": f"session_{len(self.data['study_sessions']) + 1}_{int(now.timestamp())}",
+            "id": f"session_{len(self.sessions) + 1}_{int(now.timestamp())}",
             "type": "flashcard",
             "set_id": set_id,
             "set_name": flashcard_set.get("name", "Unknown"),
@@ -126,18 +267,7 @@ class StudyAnalytics:
         }
         
         # Add to study sessions
-        self.data["study_sessions"].append(session_data)
-        
-        # Add to flashcard reviews
-        for _ in range(stats.get("total", 0)):
-            review_data = {
-                "session_id": session_data["id"],
-                "set_id": set_id,
-                "subject": flashcard_set.get("subject", "Unknown"),
-                "date": now.isoformat(),
-                "performance": "correct" if random.random() > 0.3 else "incorrect"  # Simplified for now
-            }
-            self.data["flashcard_reviews"].append(review_data)
+        self.sessions.append(self._session_row(session_data, now))
         
         # Update subject performance
         subject = flashcard_set.get("subject", "Unknown")
@@ -216,7 +346,7 @@ class StudyAnalytics:
             self.data["monthly_stats"][month_key]["days_studied"].append(date_key)
         
         # Update study streak
-        self._update_study_streak(now.date())
+        self._update_study_streak(self.streaks.local_date(now))
         
         # Update total study time
         self.data["total_study_time"] += duration
@@ -258,52 +388,25 @@ class StudyAnalytics:
         Update the study streak
         
         Args:
-            study_date: The date of the study session
+            study_date: The date of the study session, in the user's timezone
         """
-        last_study_date = self.data.get("last_study_date")
-        
-        if not last_study_date:
-            # First study session
-            self.data["study_streak"] = 1
-            self.data["last_study_date"] = study_date.isoformat()
-            return
-        
-        # Convert to date object if it's a string
-        if isinstance(last_study_date, str):
-            last_study_date = datetime.date.fromisoformat(last_study_date)
-        
-        # If already studied today, no streak update
-        if last_study_date == study_date:
-            return
-        
-        # If studied yesterday, increment streak
-        if (study_date - last_study_date).days == 1:
-            self.data["study_streak"] += 1
-        # If missed a day, reset streak
-        elif (study_date - last_study_date).days > 1:
-            self.data["study_streak"] = 1
-        
-        self.data["last_study_date"] = study_date.isoformat()
+        result = self.streaks.record("study", study_date)
+        self.data["study_streak"] = result["current"]
+        self.data["last_study_date"] = self.streaks.last_day("study").isoformat()
     
     def _update_preferences(self) -> None:
         """Update user study preferences based on analytics"""
+        columns = self.sessions.read(["hour_of_day", "day_of_week", "subject"])
+
         # Find best study time
-        hour_counts = {}
-        for session in self.data["study_sessions"]:
-            hour = session.get("hour_of_day")
-            if hour is not None:
-                hour_counts[hour] = hour_counts.get(hour, 0) + 1
+        hour_counts = Counter(columns["hour_of_day"])
         
         if hour_counts:
             best_hour = max(hour_counts, key=hour_counts.get)
             self.data["preferences"]["best_study_time"] = best_hour
         
         # Find best study days
-        day_counts = {}
-        for session in self.data["study_sessions"]:
-            day = session.get("day_of_week")
-            if day is not None:
-                day_counts[day] = day_counts.get(day, 0) + 1
+        day_counts = Counter(columns["day_of_week"])
         
         if day_counts:
             # Get the top 3 days
@@ -312,10 +415,10 @@ class StudyAnalytics:
         
         # Find favorite subjects
         subject_counts = {}
-        for session in self.data["study_sessions"]:
-            subject = session.get("subject")
+        for subject_id, count in Counter(columns["subject"]).items():
+            subject = self.sessions.string(subject_id)
             if subject and subject != "Unknown":
-                subject_counts[subject] = subject_counts.get(subject, 0) + 1
+                subject_counts[subject] = count
         
         if subject_counts:
             # Get the top 3 subjects
@@ -344,19 +447,8 @@ class StudyAnalytics:
         else:
             start_date = (now - datetime.timedelta(days=7)).date()
         
-        # Get all study sessions
-        all_sessions = self.data.get("study_sessions", [])
-        
-        # Filter sessions by date for the current period
-        filtered_sessions = []
-        for session in all_sessions:
-            try:
-                session_date = datetime.datetime.fromisoformat(session.get("date", "")).date()
-                if session_date >= start_date:
-                    filtered_sessions.append(session)
-            except (ValueError, TypeError):
-                # Skip sessions with invalid dates
-                continue
+        # Get the study sessions of the current period
+        filtered_sessions = self._get_sessions(start_date)
         
         # Calculate total study time in minutes
         total_time_seconds = sum(session.get("duration", 0) for session in filtered_sessions)
@@ -373,8 +465,8 @@ class StudyAnalytics:
         if cards_reviewed > 0:
             accuracy = round((correct_cards / cards_reviewed) * 100)
         
-        # Get current streak
-        streak = self.data.get("study_streak", 0)
+        # Get current streak (0 once a day was missed)
+        streak = self.streaks.current("study")
         
         # Prepare activity data using all historical sessions
         activity_data = self._prepare_activity_data(filtered_sessions, period)
@@ -511,75 +603,6 @@ class StudyAnalytics:
         
         return result
     
-    def get_difficult_cards(self, limit: int = 5) -> List[Dict[str, Any]]:
-        """
-        Get the most difficult flashcards based on review history
-        
-        Args:
-            limit: Maximum number of cards to return
-            
-        Returns:
-            List of dictionaries with difficult card data
-        """
-        # Get all flashcard reviews
-        reviews = self.data.get("flashcard_reviews", [])
-        
-        if not reviews:
-            return []
-        
-        # Group reviews by card_id
-        card_stats = {}
-        
-        for review in reviews:
-            card_id = review.get("card_id")
-            if not card_id:
-                continue
-            
-            if card_id not in card_stats:
-                card_stats[card_id] = {
-                    "total": 0,
-                    "incorrect": 0,
-                    "set_id": review.get("set_id"),
-                    "subject": review.get("subject", "Unknown")
-                }
-            
-            card_stats[card_id]["total"] += 1
-            if review.get("performance") == "incorrect":
-                card_stats[card_id]["incorrect"] += 1
-        
-        # Calculate failure rate for each card
-        difficult_cards = []
-        
-        for card_id, stats in card_stats.items():
-            if stats["total"] < 3:  # Require at least 3 reviews
-                continue
-            
-            failure_rate = round((stats["incorrect"] / stats["total"]) * 100)
-            
-            # Only include cards with failure rate > 30%
-            if failure_rate > 30:
-                # Get card details
-                set_id = stats["set_id"]
-                if set_id:
-                    card = self.flashcard_manager.get_card(set_id, card_id)
-                    set_data = self.flashcard_manager.get_set(set_id)
-                    
-                    if card and set_data:
-                        difficult_cards.append({
-                            "id": card_id,
-                            "question": card.get("question", "Unknown"),
-                            "set_id": set_id,
-                            "set_name": set_data.get("name", "Unknown Set"),
-                            "subject": stats["subject"],
-                            "failure_rate": failure_rate,
-                            "total_reviews": stats["total"]
-                        })
-        
-        # Sort by failure rate (highest first)
-        difficult_cards.sort(key=lambda x: x["failure_rate"], reverse=True)
-        
-        return difficult_cards[:limit]
-    
     def get_study_recommendations(self) -> List[Dict[str, Any]]:
         """
         Generate personalized study recommendations based on analytics
@@ -983,11 +1006,8 @@ class StudyAnalytics:
                 all_cards[set_id] = cards
                 total_cards += len(cards)
         
-        # Get all study sessions sorted by date
-        all_sessions = sorted(
-            self.data.get("study_sessions", []),
-            key=lambda s: s.get("date", "")
-        )
+        # Get the study sessions of the period (sorted by date)
+        all_sessions = self._get_sessions(start_date)
         
         # Generate date range
         date_range = []
@@ -1160,44 +1180,26 @@ class StudyAnalytics:
         Returns:
             List of dicts with set progress data
         """
-        # Get all flashcard sets
-        flashcard_sets_dict = self.flashcard_manager.get_all_sets()
-        
-        # Get due cards for each set
+        # Card counts, due counts and mastery come from the set manifest
         result = []
+        last_studied_by_set = self._last_studied_by_set()
         
-        for set_id, set_data in flashcard_sets_dict.items():
-            
-            # Get due cards
-            due_cards = self.flashcard_manager.get_due_cards(set_id)
-            
-            # Calculate mastery level
-            mastery = 0
-            cards = set_data.get("cards", [])
-            
-            if cards:
-                mastered_cards = 0
-                for card in cards:
-                    if card.get("learning_data", {}).get("interval", 0) >= 7:
-                        mastered_cards += 1
-                
-                mastery = round((mastered_cards / len(cards)) * 100)
+        for summary in self.flashcard_manager.get_set_summaries():
+            set_id = summary["id"]
             
             # Find last studied date
             last_studied = None
-            for session in reversed(self.data["study_sessions"]):
-                if session.get("set_id") == set_id:
-                    last_studied = datetime.datetime.fromisoformat(session["date"]).strftime("%Y-%m-%d")
-                    break
+            if set_id in last_studied_by_set:
+                last_studied = datetime.datetime.fromtimestamp(last_studied_by_set[set_id]).strftime("%Y-%m-%d")
             
             result.append({
                 "id": set_id,
-                "name": set_data.get("name", "Unknown"),
-                "subject": set_data.get("subject", "Unknown"),
-                "card_count": len(cards),
-                "mastery": mastery,
+                "name": summary["name"] or "Unknown",
+                "subject": summary["subject"] or "Unknown",
+                "card_count": summary["card_count"],
+                "mastery": summary["mastery"],
                 "last_studied": last_studied,
-                "due_cards": len(due_cards)
+                "due_cards": summary["due_count"]
             })
         
         # Sort by due cards (descending) and then by mastery (ascending)
@@ -1311,14 +1313,11 @@ class StudyAnalytics:
                 })
         
         # Recommendation 4: Maintain streak
-        streak = self.data.get("study_streak", 0)
-        last_study_date = self.data.get("last_study_date")
+        streak = self.streaks.current("study")
+        last_date = self.streaks.last_day("study")
         
-        if streak >= 2 and last_study_date:
-            last_date = datetime.date.fromisoformat(last_study_date) if isinstance(last_study_date, str) else last_study_date
-            today = datetime.date.today()
-            
-            if last_date < today:
+        if streak >= 2 and last_date:
+            if last_date < self.streaks.today():
                 recommendations.append({
                     "title": f"Maintenez votre série d'étude de {streak} jours !",
                     "description": "Étudiez aujourd'hui pour ne pas perdre votre série.",
@@ -1327,7 +1326,7 @@ class StudyAnalytics:
                 })
         
         # Recommendation 5: Try new set
-        studied_set_ids = {session.get("set_id") for session in self.data["study_sessions"]}
+        studied_set_ids = set(self._last_studied_by_set())
         new_sets = [s for s in set_progress if s["id"] not in studied_set_ids]
         
         if new_sets: